@@ -1,13 +1,26 @@
+import argparse
 import threading
-import queue
-from langchain_community.llms import Ollama
-from langchain.prompts import (
-    FewShotChatMessagePromptTemplate,
-    ChatPromptTemplate,
-    MessagesPlaceholder
-)
-from langchain_core.messages import HumanMessage, AIMessage
-from cara import MiniFace
+import os
+
+from startup_profile import StartupProfiler
+
+# Antes de cualquier importación pesada, para medir todo el arranque (--profile-startup)
+profiler = StartupProfiler()
+
+# cara (tkinter) se importa en main(): bertraco_server.py usa este módulo sin ventana
+from chat_pipeline import MessageQueue, disabled_stages
+from model_warmup import ModelWarmer
+from response_cache import ResponseCache
+from turn_metrics import metrics_from_env, start_metrics_server
+
+# langchain y el cliente de Ollama se cargan en init_runtime(), en segundo plano y con la
+# ventana ya en pantalla.
+llm = None
+prefijo_prompt = None
+cache_respuestas = None
+warmer = None
+nucleo = None
+metricas = None
 
 ejemplos = [
     {"mensaje_usuario": "hola, como estas?", "respuesta_asistente": "Hola, estoy bien, gracias por preguntar."},
@@ -18,88 +31,137 @@ ejemplos = [
     {"mensaje_usuario": "¿qué te gusta hacer en tu tiempo libre?", "respuesta_asistente": "No tengo tiempo libre, pero me gusta hablar contigo."},
 ]
 
-prompt_ejemplos = ChatPromptTemplate.from_messages(
-    [
-        ("human", "{mensaje_usuario}"),
-        ("assistant", "{respuesta_asistente}"),
-    ]
-)
-
-few_shot_template = FewShotChatMessagePromptTemplate(
-    examples=ejemplos,
-    example_prompt=prompt_ejemplos
-)
-
-prompt_final = ChatPromptTemplate.from_messages(
-    [
-        ("system", "Eres un asistente amigable hablas de manera casual, no te enfocas en resolver problemas complejos, simplemente respondes de manera amigable. Hablas UNICAMENTE en español."),
-        few_shot_template,
-        MessagesPlaceholder(variable_name="historial"),
-        ("human", "{pregunta}"),
-    ]
-)
-
-# Configurar el modelo Ollama
-llm = Ollama(model="qwen:0.5b")
-
-def chat_loop(face, message_queue):
-    """Función que maneja la lógica del chat en un hilo separado."""
-    historial = []
-    while True:
-        try:
-            # Espera a recibir un mensaje desde la GUI
-            pregunta = message_queue.get()
-            if pregunta is None: # Señal para terminar
-                break
-
-            # Despertar la cara (aunque ya debería estarlo por la interacción)
-            face.after(0, face.wake_up)
-            
-            mensajes = prompt_final.format_messages(
-                pregunta=pregunta,
-                mensaje_usuario=pregunta,
-                historial=historial
-            )
-            
-            respuesta_completa = ""
-            respuesta_stream = llm.stream(mensajes)
-            
-            animacion_iniciada = False
-            for chunk in respuesta_stream:
-                if not animacion_iniciada:
-                    # Inicia la animación y el mensaje en la GUI
-                    face.after(0, face.start_speaking)
-                    face.after(0, face.start_assistant_message)
-                    animacion_iniciada = True
-                
-                # Muestra el chunk en la GUI
-                face.after(0, face.append_assistant_message, chunk)
-                respuesta_completa += chunk
-            
-            if animacion_iniciada:
-                # Detiene la animación y finaliza el mensaje en la GUI
-                face.after(0, face.stop_speaking)
-                face.after(0, face.end_assistant_message)
-            
-            # Guardar en el historial y mantener solo los últimos 3 intercambios
-            historial.append(HumanMessage(content=pregunta))
-            historial.append(AIMessage(content=respuesta_completa))
-            historial = historial[-6:]
-
-        except Exception as e:
-            print(f"Error en el chat_loop: {e}")
-            break
+def build_prompt():
+    with profiler.step("import langchain"):
+        from langchain.prompts import (
+            FewShotChatMessagePromptTemplate,
+            ChatPromptTemplate,
+            MessagesPlaceholder
+        )
+
+    prompt_ejemplos = ChatPromptTemplate.from_messages(
+        [
+            ("human", "{mensaje_usuario}"),
+            ("assistant", "{respuesta_asistente}"),
+        ]
+    )
+
+    few_shot_template = FewShotChatMessagePromptTemplate(
+        examples=ejemplos,
+        example_prompt=prompt_ejemplos
+    )
+
+    return ChatPromptTemplate.from_messages(
+        [
+            ("system", "Eres un asistente amigable hablas de manera casual, no te enfocas en resolver problemas complejos, simplemente respondes de manera amigable. Hablas UNICAMENTE en español."),
+            few_shot_template,
+            MessagesPlaceholder(variable_name="historial"),
+            ("human", "{pregunta}"),
+        ]
+    )
+
+# Historial con presupuesto de tokens en lugar de los últimos 3 intercambios fijos.
+# Con HISTORIAL_RESUMEN los intercambios que no caben se resumen en segundo plano entre turnos.
+HISTORIAL_MAX_TOKENS = 512
+HISTORIAL_RESUMEN = os.environ.get("BERTRACO_HISTORY_SUMMARY", "0") == "1"
+
+# Caché de respuestas para preguntas repetidas (BERTRACO_RESPONSE_CACHE=0 la desactiva).
+# CACHE_RESPUESTAS_FUZZY activa además el nivel difuso por similitud (p. ej. 0.85).
+CACHE_RESPUESTAS_RUTA = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "respuestas.json")
+CACHE_RESPUESTAS_FUZZY = None
+CACHE_RESPUESTAS = os.environ.get("BERTRACO_RESPONSE_CACHE", "1") != "0"
+
+# Etapas del núcleo que se apagan (BERTRACO_STAGES_OFF, ver chat_pipeline.py)
+ETAPAS_DESACTIVADAS = disabled_stages()
+
+
+def init_runtime():
+    """Carga lo pesado (langchain y el cliente del LLM) con la ventana ya en pantalla."""
+    global llm, prefijo_prompt, cache_respuestas, metricas
+
+    with profiler.step("plantilla del prompt"):
+        prompt_final = build_prompt()
+        from prompt_prefix import PromptPrefix
+        # Sistema + ejemplos renderizados una sola vez; cada turno solo añade historial y pregunta
+        # (BERTRACO_PROMPT_PREFIX=0 vuelve a renderizar todo en cada turno)
+        prefijo_prompt = PromptPrefix(prompt_final)
+
+    with profiler.step("cliente del LLM"):
+        with profiler.step("import ollama_client (httpx, ollama)"):
+            from ollama_client import make_llm
+        # Configurar el modelo Ollama (cliente asyncio con conexión persistente;
+        # BERTRACO_LLM_CLIENT=langchain usa el Ollama de langchain_community)
+        llm = make_llm("qwen:0.5b")
+        # Un registro por turno en JSONL (BERTRACO_METRICS, ver turn_metrics.py)
+        metricas = metrics_from_env("texto", llm)
+
+    if CACHE_RESPUESTAS:
+        with profiler.step("caché de respuestas"):
+            cache_respuestas = ResponseCache(CACHE_RESPUESTAS_RUTA, fuzzy_threshold=CACHE_RESPUESTAS_FUZZY)
+
+def make_pipeline(face, audio_out=None, warmer=None):
+    """Núcleo del chat para esta cadena (ver chat_pipeline.py): solo generar y mostrar."""
+    from chat_pipeline import ChatPipeline
+    from conversation_memory import ConversationMemory, make_llm_summarizer
+
+    memoria = ConversationMemory(
+        max_tokens=HISTORIAL_MAX_TOKENS,
+        summarizer=make_llm_summarizer(llm) if HISTORIAL_RESUMEN else None,
+    )
+    return ChatPipeline(face, llm, prefijo_prompt, memoria, cache=cache_respuestas, warmer=warmer,
+                        disabled=ETAPAS_DESACTIVADAS, metrics=metricas)
+
+
+def startup(face, message_queue, profile=False):
+    """
+    Hilo de chat: inicializa lo pesado con la ventana ya en pantalla (la cara en "thinking") y
+    luego atiende los mensajes. Lo que se escriba mientras tanto espera en la cola.
+    """
+    global warmer, nucleo
+    try:
+        with profiler.step("inicialización"):
+            init_runtime()
+    except (Exception, SystemExit) as e:
+        print(f"Error al inicializar: {e}")
+        face.after(0, face.destroy)
+        return
+    profiler.mark("listo para chatear")
+
+    # Carga el modelo (y el prefijo del prompt) en el servidor; la cara sigue en "thinking"
+    # hasta que termina
+    warmer = ModelWarmer(llm, face, prime_messages=prefijo_prompt.messages if prefijo_prompt.enabled else None).start()
+
+    if profile:
+        print(f"Perfil de arranque:\n{profiler.report()}")
+    nucleo = make_pipeline(face, warmer=warmer)
+    # Escape en la ventana corta la respuesta en curso
+    face.on_cancel = nucleo.cancel
+    # Prometheus en /metrics si se pide BERTRACO_METRICS_PORT
+    start_metrics_server(metricas)
+    nucleo.run(message_queue)
 
 
 def main():
+    parser = argparse.ArgumentParser(description="BERTraco, asistente de texto")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Muestra cuánto tarda cada importación y paso del arranque")
+    args = parser.parse_args()
+
+    with profiler.step("import cara (tkinter)"):
+        from cara import MiniFace
+
     # Cola para comunicar la GUI con el hilo de chat
-    message_queue = queue.Queue()
+    message_queue = MessageQueue()
 
-    # Crear y mostrar la carita, pasándole la cola
-    face = MiniFace(send_queue=message_queue)
+    # Crear y mostrar la carita, pasándole la cola. Piensa hasta que todo esté cargado.
+    with profiler.step("crear ventana"):
+        face = MiniFace(send_queue=message_queue)
+        face.start_thinking()
+    face.after(0, profiler.mark, "ventana visible")
     
-    # Iniciar la lógica del chat en un hilo separado para no bloquear la GUI
-    chat_thread = threading.Thread(target=chat_loop, args=(face, message_queue), daemon=True)
+    # Iniciar la carga y la lógica del chat en un hilo separado para no bloquear la GUI
+    chat_thread = threading.Thread(target=startup, args=(face, message_queue, args.profile_startup),
+                                   name="chat", daemon=True)
     chat_thread.start()
     
     # Iniciar el bucle principal de la GUI
@@ -107,6 +169,22 @@ def main():
 
     # Al cerrar la ventana, terminar el hilo de chat
     message_queue.put(None)
+    print(f"Transcripción: {face.transcript_stats()}")
+    if hasattr(llm, "stats"):
+        print(f"LLM: {llm.stats()}")
+    if prefijo_prompt:
+        print(f"Prefijo del prompt: {prefijo_prompt.stats()}")
+    if warmer:
+        warmer.stop()
+        print(f"Calentamiento del modelo: {warmer.stats()}")
+    if nucleo:
+        print(f"Etapas: {nucleo.stats()}")
+    if metricas:
+        print(f"Métricas por turno: {metricas.stats()}")
+        metricas.close()
+    if cache_respuestas:
+        print(f"Caché de respuestas: {cache_respuestas.stats()}")
+        cache_respuestas.close()
 
 
 if __name__ == "__main__":
@@ -1,30 +1,52 @@
+import argparse
 import threading
-import queue
-import time
-# Cambiamos la importación de pydub.playback
-import simpleaudio as sa
-from langchain_community.llms import Ollama
-from langchain.prompts import (
-    FewShotChatMessagePromptTemplate,
-    ChatPromptTemplate,
-    MessagesPlaceholder
-)
-from langchain_core.messages import HumanMessage, AIMessage
-from cara import MiniFace
-# Importar el generador de voz y sus dependencias
-import animalese_like
+import os
+
+from startup_profile import StartupProfiler
+
+# Antes de cualquier importación pesada, para medir todo el arranque (--profile-startup)
+profiler = StartupProfiler()
+
+# cara (tkinter) se importa en main(): bertraco_server.py usa este módulo sin ventana
+from chat_pipeline import MessageQueue, disabled_stages
+from model_warmup import ModelWarmer
+from response_cache import ResponseCache
+from turn_metrics import metrics_from_env, start_metrics_server
+
+# langchain, el cliente de Ollama, la voz (numpy, pydub) y la salida de audio se cargan en
+# init_runtime(), en segundo plano y con la ventana ya en pantalla.
+llm = None
+prefijo_prompt = None
+cache_respuestas = None
+animalese_like = None
+animalese_samples = None
+animalese_pitch_bank = None
+audio_out = None
+warmer = None
+nucleo = None
+metricas = None
 
 # --- Configuración de la Voz ---
 SAMPLES_FOLDER = "audios" # Carpeta donde guardas tus archivos .wav de sílabas
-try:
-    # Cargar las muestras de audio una sola vez al inicio
-    animalese_samples = animalese_like.load_samples(SAMPLES_FOLDER)
-except FileNotFoundError:
-    print(f"ADVERTENCIA: No se encontró la carpeta '{SAMPLES_FOLDER}' o está vacía.")
-    print("La aplicación se ejecutará sin la voz de 'animalese'.")
-    animalese_samples = None
+
+# Tonos cuantizados a pasos de 0.25 semitonos y reutilizados entre palabras.
+# Poner PITCH_STEP = None para volver al tono continuo (re-muestrea cada sílaba).
+PITCH_STEP = 0.25
+
+# Salida de audio: "auto", "sounddevice", "simpleaudio", "null" o "file:salida.wav"
+AUDIO_BACKEND = os.environ.get("BERTRACO_AUDIO", "auto")
+# Máximo de audio pendiente (s) antes de retener el texto. Si el audio va al día, el texto
+# aparece tan rápido como lo genera el modelo.
+AUDIO_LATENCY_BUDGET_S = 1.0
+# Cola de audio acotada: las palabras cortas se fusionan en frases y, si se llena, lo más
+# antiguo se resume en una sílaba ("summary"). Otras políticas: "block", "drop_oldest".
+AUDIO_QUEUE_MAX = 32
+AUDIO_QUEUE_POLICY = "summary"
 # --- Fin Configuración de la Voz ---
 
+# Etapas del núcleo que se apagan (BERTRACO_STAGES_OFF, ver chat_pipeline.py)
+ETAPAS_DESACTIVADAS = disabled_stages()
+
 
 ejemplos = [
     {"mensaje_usuario": "hola, como estas?", "respuesta_asistente": "Hola, estoy bien, gracias por preguntar."},
@@ -35,160 +57,202 @@ ejemplos = [
     {"mensaje_usuario": "¿qué te gusta hacer en tu tiempo libre?", "respuesta_asistente": "No tengo tiempo libre, pero me gusta hablar contigo."},
 ]
 
-prompt_ejemplos = ChatPromptTemplate.from_messages(
-    [
-        ("human", "{mensaje_usuario}"),
-        ("assistant", "{respuesta_asistente}"),
-    ]
-)
-
-few_shot_template = FewShotChatMessagePromptTemplate(
-    examples=ejemplos,
-    example_prompt=prompt_ejemplos
-)
-
-prompt_final = ChatPromptTemplate.from_messages(
-    [
-        ("system", "Eres un asistente amigable hablas de manera casual, no te enfocas en resolver problemas complejos, simplemente respondes de manera amigable. Hablas UNICAMENTE en español."),
-        few_shot_template,
-        MessagesPlaceholder(variable_name="historial"),
-        ("human", "{pregunta}"),
-    ]
-)
-
-# Configurar el modelo Ollama
-llm = Ollama(model="qwen:0.5b")
-
-def audio_loop(audio_queue):
+def build_prompt():
+    with profiler.step("import langchain"):
+        from langchain.prompts import (
+            FewShotChatMessagePromptTemplate,
+            ChatPromptTemplate,
+            MessagesPlaceholder
+        )
+
+    prompt_ejemplos = ChatPromptTemplate.from_messages(
+        [
+            ("human", "{mensaje_usuario}"),
+            ("assistant", "{respuesta_asistente}"),
+        ]
+    )
+
+    few_shot_template = FewShotChatMessagePromptTemplate(
+        examples=ejemplos,
+        example_prompt=prompt_ejemplos
+    )
+
+    return ChatPromptTemplate.from_messages(
+        [
+            ("system", "Eres un asistente amigable hablas de manera casual, no te enfocas en resolver problemas complejos, simplemente respondes de manera amigable. Hablas UNICAMENTE en español."),
+            few_shot_template,
+            MessagesPlaceholder(variable_name="historial"),
+            ("human", "{pregunta}"),
+        ]
+    )
+
+# Historial con presupuesto de tokens en lugar de los últimos 3 intercambios fijos.
+# Con HISTORIAL_RESUMEN los intercambios que no caben se resumen en segundo plano entre turnos.
+HISTORIAL_MAX_TOKENS = 512
+HISTORIAL_RESUMEN = os.environ.get("BERTRACO_HISTORY_SUMMARY", "0") == "1"
+
+# Caché de respuestas para preguntas repetidas (BERTRACO_RESPONSE_CACHE=0 la desactiva).
+# CACHE_RESPUESTAS_FUZZY activa además el nivel difuso por similitud (p. ej. 0.85).
+CACHE_RESPUESTAS_RUTA = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "respuestas_voice.json")
+CACHE_RESPUESTAS_FUZZY = None
+CACHE_RESPUESTAS = os.environ.get("BERTRACO_RESPONSE_CACHE", "1") != "0"
+
+
+def init_runtime():
+    """Carga lo pesado (langchain, cliente del LLM, voz y audio) con la ventana ya en pantalla."""
+    global llm, prefijo_prompt, cache_respuestas, metricas
+    global animalese_like, animalese_samples, animalese_pitch_bank, audio_out
+
+    with profiler.step("plantilla del prompt"):
+        prompt_final = build_prompt()
+        from prompt_prefix import PromptPrefix
+        # Sistema + ejemplos renderizados una sola vez; cada turno solo añade historial y pregunta
+        # (BERTRACO_PROMPT_PREFIX=0 vuelve a renderizar todo en cada turno)
+        prefijo_prompt = PromptPrefix(prompt_final)
+
+    with profiler.step("cliente del LLM"):
+        with profiler.step("import ollama_client (httpx, ollama)"):
+            from ollama_client import make_llm
+        # Configurar el modelo Ollama (cliente asyncio con conexión persistente;
+        # BERTRACO_LLM_CLIENT=langchain usa el Ollama de langchain_community)
+        llm = make_llm("qwen:0.5b")
+        # Un registro por turno en JSONL (BERTRACO_METRICS, ver turn_metrics.py)
+        metricas = metrics_from_env("voz", llm)
+
+    if CACHE_RESPUESTAS:
+        with profiler.step("caché de respuestas"):
+            cache_respuestas = ResponseCache(CACHE_RESPUESTAS_RUTA, fuzzy_threshold=CACHE_RESPUESTAS_FUZZY)
+
+    with profiler.step("voz"):
+        with profiler.step("import animalese_like (numpy, pydub)"):
+            import animalese_like
+        with profiler.step("cargar muestras"):
+            try:
+                # Cargar las muestras de audio una sola vez al inicio
+                animalese_samples = animalese_like.load_samples(SAMPLES_FOLDER)
+            except FileNotFoundError:
+                print(f"ADVERTENCIA: No se encontró la carpeta '{SAMPLES_FOLDER}' o está vacía.")
+                print("La aplicación se ejecutará sin la voz de 'animalese'.")
+                animalese_samples = None
+        if animalese_samples and PITCH_STEP:
+            animalese_pitch_bank = animalese_like.PitchBank(animalese_samples, step=PITCH_STEP)
+
+    with profiler.step("salida de audio"):
+        from audio_stream import AudioOutputStream
+        # Un único stream de salida para toda la sesión
+        audio_out = AudioOutputStream(sample_rate=animalese_like.SAMPLE_RATE, backend=AUDIO_BACKEND).start()
+
+
+def render_voice(text_chunk):
+    """Etapa synthesize: PCM de un trozo de texto, con un tono distinto cada vez."""
+    return animalese_like.render_animalese(
+        text=text_chunk,
+        samples=animalese_samples,
+        pitch_range_semitones=4, # Rango de tono ajustado
+        gap_ms=10,
+        pitch_bank=animalese_pitch_bank
+    )
+
+
+def make_pipeline(face, audio_out=None, warmer=None):
+    """
+    Núcleo del chat para esta cadena (ver chat_pipeline.py): generar, trocear, sintetizar,
+    reproducir y mostrar. Sin muestras de voz, solo generar y mostrar.
+    """
+    from chat_pipeline import ChatPipeline
+    from conversation_memory import ConversationMemory, make_llm_summarizer
+
+    memoria = ConversationMemory(
+        max_tokens=HISTORIAL_MAX_TOKENS,
+        summarizer=make_llm_summarizer(llm) if HISTORIAL_RESUMEN else None,
+    )
+    return ChatPipeline(
+        face, llm, prefijo_prompt, memoria, cache=cache_respuestas, warmer=warmer,
+        synthesize=render_voice if animalese_samples else None, audio_out=audio_out,
+        audio_budget_s=AUDIO_LATENCY_BUDGET_S, speech_queue_max=AUDIO_QUEUE_MAX,
+        speech_policy=AUDIO_QUEUE_POLICY, disabled=ETAPAS_DESACTIVADAS, metrics=metricas,
+    )
+
+
+def startup(face, message_queue, profile=False):
     """
-    Hilo que procesa fragmentos de texto de una cola, los convierte en audio
-    y los reproduce.
+    Hilo de chat: inicializa lo pesado con la ventana ya en pantalla (la cara en "thinking") y
+    luego atiende los mensajes. Lo que se escriba mientras tanto espera en la cola.
     """
-    if not animalese_samples:
-        # Si no hay muestras de audio, simplemente vacía la cola y no hagas nada.
-        while True:
-            item = audio_queue.get()
-            if item is None:
-                break
+    global warmer, nucleo
+    try:
+        with profiler.step("inicialización"):
+            init_runtime()
+    except (Exception, SystemExit) as e:
+        print(f"Error al inicializar: {e}")
+        face.after(0, face.destroy)
         return
+    profiler.mark("listo para chatear")
 
-    while True:
-        text_chunk = audio_queue.get()
-        if text_chunk is None: # Señal para terminar el hilo
-            break
-        
-        # Genera el audio para el fragmento de texto.
-        # Usamos un seed aleatorio para que suene diferente cada vez.
-        audio_segment = animalese_like.text_to_animalese(
-            text=text_chunk,
-            samples=animalese_samples,
-            pitch_range_semitones=4, # Rango de tono ajustado
-            gap_ms=10
-        )
-        # Reproduce el audio usando simpleaudio para evitar problemas de permisos.
-        # Esta función es bloqueante, lo cual es bueno para que los sonidos no se superpongan.
-        play_obj = sa.play_buffer(
-            audio_segment.raw_data,
-            num_channels=audio_segment.channels,
-            bytes_per_sample=audio_segment.sample_width,
-            sample_rate=audio_segment.frame_rate
-        )
-        play_obj.wait_done() # Espera a que el sonido termine de reproducirse
-
-
-def chat_loop(face, message_queue, audio_queue):
-    """Función que maneja la lógica del chat en un hilo separado."""
-    historial = []
-    while True:
-        try:
-            # Espera a recibir un mensaje desde la GUI
-            pregunta = message_queue.get()
-            if pregunta is None: # Señal para terminar
-                audio_queue.put(None) # Propaga la señal de fin al hilo de audio
-                break
-
-            # Despertar la cara (aunque ya debería estarlo por la interacción)
-            face.after(0, face.wake_up)
-            
-            mensajes = prompt_final.format_messages(
-                pregunta=pregunta,
-                mensaje_usuario=pregunta,
-                historial=historial
-            )
-            
-            respuesta_completa = ""
-            respuesta_stream = llm.stream(mensajes)
-            
-            animacion_iniciada = False
-            buffer_palabra = ""
-            for chunk in respuesta_stream:
-                if not animacion_iniciada:
-                    # Inicia la animación y el mensaje en la GUI
-                    face.after(0, face.start_speaking)
-                    face.after(0, face.start_assistant_message)
-                    animacion_iniciada = True
-                
-                # Muestra el chunk en la GUI
-                face.after(0, face.append_assistant_message, chunk)
-                respuesta_completa += chunk
-                buffer_palabra += chunk
-
-                # Cuando se forma una palabra (o un fragmento), la enviamos al hilo de audio
-                if ' ' in buffer_palabra or '\n' in buffer_palabra:
-                    if animalese_samples:
-                        audio_queue.put(buffer_palabra)
-                    buffer_palabra = ""
-                
-                # --- LÍMITE DE VELOCIDAD ---
-                # Añadimos una pequeña pausa para dar tiempo a que el audio se reproduzca.
-                # Esto limita la velocidad máxima de aparición del texto.
-                time.sleep(0.3) # Pausa de 30ms por cada fragmento del LLM
-                
-
-            # Detener cualquier audio en reproducción antes de vaciar la cola
-            sa.stop_all()
-            # Vacía la cola de audio después de que el modelo haya terminado de responder
-            while not audio_queue.empty():
-                audio_queue.get()
-
-            if animacion_iniciada:
-                # Detiene la animación y finaliza el mensaje en la GUI
-                face.after(0, face.stop_speaking)
-                face.after(0, face.end_assistant_message)
-            
-            # Guardar en el historial y mantener solo los últimos 3 intercambios
-            historial.append(HumanMessage(content=pregunta))
-            historial.append(AIMessage(content=respuesta_completa))
-            historial = historial[-6:]
-
-        except Exception as e:
-            print(f"Error en el chat_loop: {e}")
-            audio_queue.put(None)
-            break
+    # Carga el modelo (y el prefijo del prompt) en el servidor; la cara sigue en "thinking"
+    # hasta que termina
+    warmer = ModelWarmer(llm, face, prime_messages=prefijo_prompt.messages if prefijo_prompt.enabled else None).start()
+
+    if profile:
+        print(f"Perfil de arranque:\n{profiler.report()}")
+    nucleo = make_pipeline(face, audio_out, warmer)
+    # Escape en la ventana corta la respuesta en curso
+    face.on_cancel = nucleo.cancel
+    # Prometheus en /metrics si se pide BERTRACO_METRICS_PORT
+    start_metrics_server(metricas)
+    nucleo.run(message_queue)
 
 
 def main():
+    parser = argparse.ArgumentParser(description="BERTraco con voz animalese")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Muestra cuánto tarda cada importación y paso del arranque")
+    args = parser.parse_args()
+
+    with profiler.step("import cara (tkinter)"):
+        from cara import MiniFace
+
     # Cola para comunicar la GUI con el hilo de chat
-    message_queue = queue.Queue()
-    # Cola para comunicar el hilo de chat con el hilo de audio
-    audio_queue = queue.Queue()
+    message_queue = MessageQueue()
 
-    # Crear y mostrar la carita, pasándole la cola de mensajes
-    face = MiniFace(send_queue=message_queue)
-    
-    # Iniciar la lógica del chat en un hilo separado para no bloquear la GUI
-    chat_thread = threading.Thread(target=chat_loop, args=(face, message_queue, audio_queue), daemon=True)
-    chat_thread.start()
+    # Crear y mostrar la carita, pasándole la cola de mensajes. Piensa hasta que todo esté cargado.
+    with profiler.step("crear ventana"):
+        face = MiniFace(send_queue=message_queue)
+        face.start_thinking()
+    face.after(0, profiler.mark, "ventana visible")
 
-    # Iniciar el hilo de audio
-    audio_thread = threading.Thread(target=audio_loop, args=(audio_queue,), daemon=True)
-    audio_thread.start()
+    # Iniciar la carga y la lógica del chat en un hilo separado para no bloquear la GUI
+    chat_thread = threading.Thread(target=startup, args=(face, message_queue, args.profile_startup),
+                                   name="chat", daemon=True)
+    chat_thread.start()
     
     # Iniciar el bucle principal de la GUI
     face.mainloop()
 
     # Al cerrar la ventana, terminar los hilos
     message_queue.put(None)
+    if nucleo:
+        print(f"Etapas: {nucleo.stats()}")
+    if animalese_pitch_bank:
+        print(f"Banco de tonos: {animalese_pitch_bank.stats()}")
+    print(f"Transcripción: {face.transcript_stats()}")
+    if audio_out:
+        print(f"Audio: {audio_out.stats()}")
+    if hasattr(llm, "stats"):
+        print(f"LLM: {llm.stats()}")
+    if prefijo_prompt:
+        print(f"Prefijo del prompt: {prefijo_prompt.stats()}")
+    if warmer:
+        warmer.stop()
+        print(f"Calentamiento del modelo: {warmer.stats()}")
+    if metricas:
+        print(f"Métricas por turno: {metricas.stats()}")
+        metricas.close()
+    if cache_respuestas:
+        print(f"Caché de respuestas: {cache_respuestas.stats()}")
+        cache_respuestas.close()
+    if audio_out:
+        audio_out.close()
 
 
 if __name__ == "__main__":
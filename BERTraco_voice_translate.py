@@ -1,96 +1,117 @@
+import argparse
 import threading
-import queue
-import time
 import os
 
+from startup_profile import StartupProfiler
+
+# Antes de cualquier importación pesada, para medir todo el arranque (--profile-startup)
+profiler = StartupProfiler()
+
 # --- Módulo de Traducción ---
-import argostranslate.package
-import argostranslate.translate
+# argostranslate se importa dentro de setup_translation(), que corre en segundo plano.
+# Si no hay modelos se quedan en None y translate_* devuelven el texto sin traducir.
+es_to_en_translator = None
+en_to_es_translator = None
+
+# Traducciones ya hechas, por frase, guardadas en disco (BERTRACO_TRANSLATION_CACHE=0 la desactiva).
+# Se invalidan solas si cambia el paquete de Argos instalado.
+CACHE_TRADUCCIONES_RUTA = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "traducciones.json")
+CACHE_TRADUCCIONES = os.environ.get("BERTRACO_TRANSLATION_CACHE", "1") != "0"
+cache_traducciones = None
+versiones_traduccion = {}
+
+# Argos traduce en un proceso aparte para no competir por el GIL con la cara y el audio
+# (BERTRACO_TRANSLATION_PROCESS=0 traduce en el propio hilo de chat, como antes)
+TRADUCCION_EN_PROCESO = os.environ.get("BERTRACO_TRANSLATION_PROCESS", "1") != "0"
+servicio_traduccion = None
+
+# Modelos de Argos sin internet: se instalan los .argosmodel de estos directorios (separados por
+# os.pathsep en BERTRACO_ARGOS_MODELS, p. ej. un mirror montado) y solo se descargan si
+# BERTRACO_ARGOS_ONLINE no es 0. El manifiesto guarda qué paquete resolvió cada dirección para
+# cargarlo directamente en los siguientes arranques.
+MODELOS_TRADUCCION_DIRS = [d for d in os.environ.get("BERTRACO_ARGOS_MODELS", "").split(os.pathsep) if d] + [
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "modelos_traduccion"),
+]
+TRADUCCION_ONLINE = os.environ.get("BERTRACO_ARGOS_ONLINE", "1") != "0"
+MANIFIESTO_TRADUCTORES = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "traductores.json")
+PARES_TRADUCCION = (("es", "en"), ("en", "es"))
+traduccion_disponible = False
 
-# --- Configuración de la Traducción (Lógica Corregida) ---
+# --- Configuración de la Traducción ---
 def setup_translation():
     """
-    Comprueba si los modelos de traducción están instalados.
-    Si no lo están, los descarga e instala desde internet.
+    Carga los traductores es <-> en, instalando antes los modelos que falten desde los
+    directorios locales (o internet, si se permite). Devuelve (es->en, en->es, versiones);
+    si no hay modelos devuelve (None, None, {}) y la app sigue sin traducir.
     """
-    # Primero, comprueba si los idiomas y las traducciones ya existen
-    installed_langs = argostranslate.translate.get_installed_languages()
-    es = next((lang for lang in installed_langs if lang.code == "es"), None)
-    en = next((lang for lang in installed_langs if lang.code == "en"), None)
+    with profiler.step("import translation_models"):
+        from translation_models import load_translators
 
-    if es and en and es.get_translation(en) and en.get_translation(es):
-        print("Modelos de traducción (es <-> en) ya están instalados.")
-        return es.get_translation(en), en.get_translation(es)
-
-    # Si no están, proceder a la descarga e instalación
-    print("Modelos de traducción no encontrados. Descargando e instalando...")
     try:
-        argostranslate.package.update_package_index()
-        available_packages = argostranslate.package.get_available_packages()
-
-        # Función para encontrar e instalar un paquete específico
-        def find_and_install(from_code, to_code):
-            package_to_install = next(
-                (p for p in available_packages if p.from_code == from_code and p.to_code == to_code),
-                None
-            )
-            if package_to_install is None:
-                raise ValueError(f"No se encontró el paquete de traducción de {from_code} a {to_code}.")
-            
-            print(f"Instalando: {package_to_install.from_name} -> {package_to_install.to_name}")
-            package_to_install.install()
-
-        # Instalar los paquetes necesarios (si no están ya)
-        if not (en and en.get_translation(es)):
-            find_and_install("en", "es")
-        if not (es and es.get_translation(en)):
-            find_and_install("es", "en")
-
-        # Recargar los idiomas y devolver los traductores
-        installed_langs = argostranslate.translate.get_installed_languages()
-        es = next(lang for lang in installed_langs if lang.code == "es")
-        en = next(lang for lang in installed_langs if lang.code == "en")
-        print("Modelos de traducción instalados y cargados correctamente.")
-        return es.get_translation(en), en.get_translation(es)
-
+        traductores, versiones = load_translators(
+            PARES_TRADUCCION, MANIFIESTO_TRADUCTORES, MODELOS_TRADUCCION_DIRS, online=TRADUCCION_ONLINE,
+        )
     except Exception as e:
-        print(f"Error crítico durante la configuración de la traducción: {e}")
-        print("Asegúrate de tener una conexión a internet para descargar los modelos.")
-        exit()
-
-# Inicializar la traducción
-es_to_en_translator, en_to_es_translator = setup_translation()
+        print(f"Traducción no disponible ({e}); se sigue sin traducir.")
+        print(f"Para activarla, deja los .argosmodel es->en y en->es en {MODELOS_TRADUCCION_DIRS[-1]}"
+              " o en un directorio de BERTRACO_ARGOS_MODELS.")
+        return None, None, {}
+    print("Modelos de traducción (es <-> en) cargados.")
+    return traductores["es->en"], traductores["en->es"], versiones
 
 def translate_es_to_en(text):
+    if es_to_en_translator is None:
+        return text
     print(f"Traduciendo de español a inglés: {text}")
+    if cache_traducciones:
+        return cache_traducciones.translate("es->en", versiones_traduccion["es->en"], text,
+                                            es_to_en_translator.translate)
     return es_to_en_translator.translate(text)
 
 def translate_en_to_es(text):
+    if en_to_es_translator is None:
+        return text
     print(f"Traduciendo de inglés a español: {text}")
+    if cache_traducciones:
+        return cache_traducciones.translate("en->es", versiones_traduccion["en->es"], text,
+                                            en_to_es_translator.translate)
     return en_to_es_translator.translate(text)
 # --- Fin Módulo de Traducción ---
 
 
-import simpleaudio as sa
-from langchain_community.llms import Ollama
-from langchain.prompts import (
-    FewShotChatMessagePromptTemplate,
-    ChatPromptTemplate,
-    MessagesPlaceholder
-)
-from langchain_core.messages import HumanMessage, AIMessage
-from cara import MiniFace
-import animalese_like
+# cara (tkinter) se importa en main(): bertraco_server.py usa este módulo sin ventana
+from chat_pipeline import MessageQueue, disabled_stages
+from model_warmup import ModelWarmer
+from response_cache import ResponseCache
+from sentence_stream import SentenceSegmenter
+from turn_metrics import metrics_from_env, start_metrics_server
+
+# langchain, el cliente de Ollama, la voz (numpy, pydub), la salida de audio y los traductores
+# se cargan en init_runtime(), en segundo plano y con la ventana ya en pantalla.
+llm = None
+prefijo_prompt_en = None
+cache_respuestas = None
+animalese_like = None
+animalese_samples = None
+animalese_pitch_bank = None
+audio_out = None
+warmer = None
+nucleo = None
+metricas = None
 
 # --- Configuración de la Voz ---
 SAMPLES_FOLDER = "audios"
-try:
-    animalese_samples = animalese_like.load_samples(SAMPLES_FOLDER)
-except FileNotFoundError:
-    print(f"ADVERTENCIA: No se encontró la carpeta '{SAMPLES_FOLDER}'. La aplicación se ejecutará sin voz.")
-    animalese_samples = None
+PITCH_STEP = 0.25
+
+AUDIO_BACKEND = os.environ.get("BERTRACO_AUDIO", "auto")
+AUDIO_LATENCY_BUDGET_S = 1.0
+AUDIO_QUEUE_MAX = 32
+AUDIO_QUEUE_POLICY = "summary"
 # --- Fin Configuración de la Voz ---
 
+# Etapas del núcleo que se apagan (BERTRACO_STAGES_OFF, ver chat_pipeline.py)
+ETAPAS_DESACTIVADAS = disabled_stages()
+
 # --- Prompt en INGLÉS para el modelo ---
 ejemplos_en = [
     {"mensaje_usuario": "hello, how are you?", "respuesta_asistente": "Hello, I'm fine, thanks for asking."},
@@ -99,120 +120,230 @@ ejemplos_en = [
     {"mensaje_usuario": "can you tell me a joke?", "respuesta_asistente": "Sure, why don't scientists trust atoms? Because they make up everything!"},
 ]
 
-prompt_ejemplos_en = ChatPromptTemplate.from_messages(
-    [
-        ("human", "{mensaje_usuario}"),
-        ("assistant", "{respuesta_asistente}"),
-    ]
-)
+def build_prompt_en():
+    with profiler.step("import langchain"):
+        from langchain.prompts import (
+            FewShotChatMessagePromptTemplate,
+            ChatPromptTemplate,
+            MessagesPlaceholder
+        )
 
-few_shot_template_en = FewShotChatMessagePromptTemplate(
-    examples=ejemplos_en,
-    example_prompt=prompt_ejemplos_en
-)
+    prompt_ejemplos_en = ChatPromptTemplate.from_messages(
+        [
+            ("human", "{mensaje_usuario}"),
+            ("assistant", "{respuesta_asistente}"),
+        ]
+    )
 
-prompt_final_en = ChatPromptTemplate.from_messages(
-    [
-        ("system", "You are a friendly assistant. You speak casually, you don't focus on solving complex problems, you just respond in a friendly way. You ONLY speak in English."),
-        few_shot_template_en,
-        MessagesPlaceholder(variable_name="historial"),
-        ("human", "{pregunta}"),
-    ]
-)
+    few_shot_template_en = FewShotChatMessagePromptTemplate(
+        examples=ejemplos_en,
+        example_prompt=prompt_ejemplos_en
+    )
+
+    return ChatPromptTemplate.from_messages(
+        [
+            ("system", "You are a friendly assistant. You speak casually, you don't focus on solving complex problems, you just respond in a friendly way. You ONLY speak in English."),
+            few_shot_template_en,
+            MessagesPlaceholder(variable_name="historial"),
+            ("human", "{pregunta}"),
+        ]
+    )
 # --- Fin Prompt en INGLÉS ---
 
-# Configurar el modelo Ollama
-llm = Ollama(model="qwen:0.5b")
+# Historial (en inglés) con presupuesto de tokens en lugar de los últimos 3 intercambios fijos.
+# Con HISTORIAL_RESUMEN los intercambios que no caben se resumen en segundo plano entre turnos.
+HISTORIAL_MAX_TOKENS = 512
+HISTORIAL_RESUMEN = os.environ.get("BERTRACO_HISTORY_SUMMARY", "0") == "1"
+SUMMARY_INSTRUCTION_EN = (
+    "Summarize the following conversation between the user and the assistant in a few "
+    "sentences, in English. Keep any names, facts and preferences the user mentioned."
+)
+
+# Caché de respuestas para preguntas repetidas (BERTRACO_RESPONSE_CACHE=0 la desactiva).
+# Se indexa por la pregunta en español y guarda también la parte en inglés para el historial,
+# así un acierto se salta las dos traducciones y el LLM.
+# CACHE_RESPUESTAS_FUZZY activa además el nivel difuso por similitud (p. ej. 0.85).
+CACHE_RESPUESTAS_RUTA = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "respuestas_translate.json")
+CACHE_RESPUESTAS_FUZZY = None
+CACHE_RESPUESTAS = os.environ.get("BERTRACO_RESPONSE_CACHE", "1") != "0"
+
+
+def init_runtime():
+    """Carga lo pesado (traductores, langchain, cliente del LLM, voz y audio) con la ventana ya en pantalla."""
+    global es_to_en_translator, en_to_es_translator, cache_traducciones, versiones_traduccion, servicio_traduccion
+    global traduccion_disponible
+    global llm, prefijo_prompt_en, cache_respuestas, metricas
+    global animalese_like, animalese_samples, animalese_pitch_bank, audio_out
 
-def audio_loop(audio_queue):
-    if not animalese_samples:
-        while True:
-            if audio_queue.get() is None: break
+    # Inicializar la traducción
+    with profiler.step("traductores (setup_translation)"):
+        es_to_en_translator, en_to_es_translator, versiones_traduccion = setup_translation()
+    traduccion_disponible = es_to_en_translator is not None
+
+    if traduccion_disponible and TRADUCCION_EN_PROCESO:
+        with profiler.step("proceso de traducción"):
+            from translation_service import TranslationService
+            try:
+                servicio_traduccion = TranslationService(manifest_path=MANIFIESTO_TRADUCTORES).start()
+                # Mismo .translate(texto) que los traductores de Argos
+                es_to_en_translator = servicio_traduccion.translator("es->en")
+                en_to_es_translator = servicio_traduccion.translator("en->es")
+            except Exception as e:
+                servicio_traduccion = None
+                print(f"No se pudo arrancar el proceso de traducción, se traduce en este proceso: {e}")
+
+    if traduccion_disponible and CACHE_TRADUCCIONES:
+        with profiler.step("caché de traducciones"):
+            from translation_cache import TranslationCache
+            cache_traducciones = TranslationCache(CACHE_TRADUCCIONES_RUTA)
+            cache_traducciones.retain_versions(versiones_traduccion)
+
+    with profiler.step("plantilla del prompt"):
+        prompt_final_en = build_prompt_en()
+        from prompt_prefix import PromptPrefix
+        # Sistema + ejemplos renderizados una sola vez; cada turno solo añade historial y pregunta
+        # (BERTRACO_PROMPT_PREFIX=0 vuelve a renderizar todo en cada turno)
+        prefijo_prompt_en = PromptPrefix(prompt_final_en)
+
+    with profiler.step("cliente del LLM"):
+        with profiler.step("import ollama_client (httpx, ollama)"):
+            from ollama_client import make_llm
+        # Configurar el modelo Ollama (cliente asyncio con conexión persistente;
+        # BERTRACO_LLM_CLIENT=langchain usa el Ollama de langchain_community)
+        llm = make_llm("qwen:0.5b")
+        # Un registro por turno en JSONL (BERTRACO_METRICS, ver turn_metrics.py)
+        metricas = metrics_from_env("traduccion", llm)
+
+    if CACHE_RESPUESTAS:
+        with profiler.step("caché de respuestas"):
+            cache_respuestas = ResponseCache(CACHE_RESPUESTAS_RUTA, fuzzy_threshold=CACHE_RESPUESTAS_FUZZY)
+
+    with profiler.step("voz"):
+        with profiler.step("import animalese_like (numpy, pydub)"):
+            import animalese_like
+        with profiler.step("cargar muestras"):
+            try:
+                animalese_samples = animalese_like.load_samples(SAMPLES_FOLDER)
+            except FileNotFoundError:
+                print(f"ADVERTENCIA: No se encontró la carpeta '{SAMPLES_FOLDER}'. La aplicación se ejecutará sin voz.")
+                animalese_samples = None
+        if animalese_samples and PITCH_STEP:
+            animalese_pitch_bank = animalese_like.PitchBank(animalese_samples, step=PITCH_STEP)
+
+    with profiler.step("salida de audio"):
+        from audio_stream import AudioOutputStream
+        audio_out = AudioOutputStream(sample_rate=animalese_like.SAMPLE_RATE, backend=AUDIO_BACKEND).start()
+
+
+def render_voice(text_chunk):
+    """Etapa synthesize: PCM de un trozo de texto en español."""
+    return animalese_like.render_animalese(
+        text=text_chunk, samples=animalese_samples, pitch_range_semitones=4, gap_ms=10,
+        pitch_bank=animalese_pitch_bank
+    )
+
+def make_pipeline(face, audio_out=None, warmer=None):
+    """
+    Núcleo del chat para esta cadena (ver chat_pipeline.py): la pregunta se traduce a inglés, el
+    LLM genera en inglés y cada frase se traduce a español en cuanto está completa, mientras sigue
+    la generación. El historial va en inglés.
+    """
+    from chat_pipeline import ChatPipeline
+    from conversation_memory import ConversationMemory, make_llm_summarizer
+
+    memoria_en = ConversationMemory( # El historial ahora debe estar en inglés
+        max_tokens=HISTORIAL_MAX_TOKENS,
+        summarizer=make_llm_summarizer(llm, SUMMARY_INSTRUCTION_EN,
+                                       labels=("Previous summary", "User", "Assistant")) if HISTORIAL_RESUMEN else None,
+        summary_prefix="Summary of the earlier conversation: ",
+    )
+    return ChatPipeline(
+        face, llm, prefijo_prompt_en, memoria_en,
+        # Sin traducción la respuesta está en inglés: no se guarda como respuesta en español
+        cache=cache_respuestas if traduccion_disponible else None, warmer=warmer,
+        translate_in=translate_es_to_en if traduccion_disponible else None,
+        translate_out=translate_en_to_es, segmenter_factory=SentenceSegmenter,
+        synthesize=render_voice if animalese_samples else None, audio_out=audio_out,
+        audio_budget_s=AUDIO_LATENCY_BUDGET_S, speech_queue_max=AUDIO_QUEUE_MAX,
+        speech_policy=AUDIO_QUEUE_POLICY, disabled=ETAPAS_DESACTIVADAS, metrics=metricas,
+    )
+
+def startup(face, message_queue, profile=False):
+    """
+    Hilo de chat: inicializa lo pesado con la ventana ya en pantalla (la cara en "thinking") y
+    luego atiende los mensajes. Lo que se escriba mientras tanto espera en la cola.
+    """
+    global warmer, nucleo
+    try:
+        with profiler.step("inicialización"):
+            init_runtime()
+    except (Exception, SystemExit) as e:
+        print(f"Error al inicializar: {e}")
+        face.after(0, face.destroy)
         return
+    profiler.mark("listo para chatear")
 
-    while True:
-        text_chunk = audio_queue.get()
-        if text_chunk is None: break
-        
-        audio_segment = animalese_like.text_to_animalese(
-            text=text_chunk, samples=animalese_samples, pitch_range_semitones=4, gap_ms=10
-        )
-        play_obj = sa.play_buffer(
-            audio_segment.raw_data, audio_segment.channels,
-            audio_segment.sample_width, audio_segment.frame_rate
-        )
-        play_obj.wait_done()
-
-def chat_loop(face, message_queue, audio_queue):
-    historial_en = [] # El historial ahora debe estar en inglés
-    while True:
-        try:
-            pregunta_es = message_queue.get()
-            if pregunta_es is None:
-                audio_queue.put(None)
-                break
-
-            face.after(0, face.wake_up)
-            
-            # 1. Traducir pregunta del usuario a inglés
-            pregunta_en = translate_es_to_en(pregunta_es)
-            
-            mensajes = prompt_final_en.format_messages(
-                pregunta=pregunta_en,
-                mensaje_usuario=pregunta_en,
-                historial=historial_en
-            )
-            
-            # Recolectar la respuesta completa en inglés primero
-            respuesta_en_completa = ""
-            for chunk in llm.stream(mensajes):
-                respuesta_en_completa += chunk
-            
-            # 2. Traducir la respuesta completa del LLM a español
-            respuesta_es_completa = translate_en_to_es(respuesta_en_completa)
-
-            # 3. Simular el "streaming" de la respuesta traducida
-            face.after(0, face.start_speaking)
-            face.after(0, face.start_assistant_message)
-            
-            palabras_es = respuesta_es_completa.split()
-            for palabra in palabras_es:
-                # Añadir la palabra (y un espacio) a la GUI
-                face.after(0, face.append_assistant_message, f"{palabra} ")
-                
-                # Poner la palabra en la cola de audio para generar sonido
-                if animalese_samples:
-                    audio_queue.put(palabra)
-                
-                # Pequeña pausa para simular el ritmo de habla
-                time.sleep(0.1) 
-            
-            sa.stop_all()
-            while not audio_queue.empty(): audio_queue.get()
-
-            face.after(0, face.stop_speaking)
-            face.after(0, face.end_assistant_message)
-            
-            # Guardar en el historial (en inglés)
-            historial_en.append(HumanMessage(content=pregunta_en))
-            historial_en.append(AIMessage(content=respuesta_en_completa))
-            historial_en = historial_en[-6:]
-
-        except Exception as e:
-            print(f"Error en el chat_loop: {e}")
-            audio_queue.put(None)
-            break
+    # Carga el modelo (y el prefijo del prompt) en el servidor; la cara sigue en "thinking"
+    # hasta que termina
+    warmer = ModelWarmer(llm, face, prime_messages=prefijo_prompt_en.messages if prefijo_prompt_en.enabled else None).start()
+
+    if profile:
+        print(f"Perfil de arranque:\n{profiler.report()}")
+    nucleo = make_pipeline(face, audio_out, warmer)
+    # Escape en la ventana corta la respuesta en curso
+    face.on_cancel = nucleo.cancel
+    # Prometheus en /metrics si se pide BERTRACO_METRICS_PORT
+    start_metrics_server(metricas)
+    nucleo.run(message_queue)
 
 def main():
-    message_queue = queue.Queue()
-    audio_queue = queue.Queue()
-    face = MiniFace(send_queue=message_queue)
+    parser = argparse.ArgumentParser(description="BERTraco con voz animalese y traducción es <-> en")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Muestra cuánto tarda cada importación y paso del arranque")
+    args = parser.parse_args()
+
+    with profiler.step("import cara (tkinter)"):
+        from cara import MiniFace
+
+    message_queue = MessageQueue()
+    with profiler.step("crear ventana"):
+        face = MiniFace(send_queue=message_queue)
+        face.start_thinking()
+    face.after(0, profiler.mark, "ventana visible")
     
-    threading.Thread(target=chat_loop, args=(face, message_queue, audio_queue), daemon=True).start()
-    threading.Thread(target=audio_loop, args=(audio_queue,), daemon=True).start()
+    threading.Thread(target=startup, args=(face, message_queue, args.profile_startup),
+                     name="chat", daemon=True).start()
     
     face.mainloop()
     message_queue.put(None)
+    if nucleo:
+        print(f"Etapas: {nucleo.stats()}")
+    if animalese_pitch_bank:
+        print(f"Banco de tonos: {animalese_pitch_bank.stats()}")
+    print(f"Transcripción: {face.transcript_stats()}")
+    if audio_out:
+        print(f"Audio: {audio_out.stats()}")
+    if hasattr(llm, "stats"):
+        print(f"LLM: {llm.stats()}")
+    if prefijo_prompt_en:
+        print(f"Prefijo del prompt: {prefijo_prompt_en.stats()}")
+    if warmer:
+        warmer.stop()
+        print(f"Calentamiento del modelo: {warmer.stats()}")
+    if metricas:
+        print(f"Métricas por turno: {metricas.stats()}")
+        metricas.close()
+    if cache_respuestas:
+        print(f"Caché de respuestas: {cache_respuestas.stats()}")
+        cache_respuestas.close()
+    if cache_traducciones:
+        print(f"Caché de traducciones: {cache_traducciones.stats()}")
+        cache_traducciones.close()
+    if servicio_traduccion:
+        print(f"Traducción: {servicio_traduccion.stats()}")
+        servicio_traduccion.close()
+    if audio_out:
+        audio_out.close()
 
 if __name__ == "__main__":
     main()
@@ -7,6 +7,7 @@ Simple, lightweight "Animal Crossing"-like voice generator in Python.
 Requirements:
   - Python 3.7+
   - pydub (pip install pydub)
+  - numpy (pip install numpy)
   - ffmpeg installed and available in PATH (for pydub to load/save many formats)
 
 Concept:
@@ -15,17 +16,43 @@ Concept:
     (by changing sample frame_rate), and concatenates them into a single output file.
   - This is intentionally simple and lightweight (no heavy DSP libraries). It aims for a similar
     playful effect, not a perfect replica of Animal Crossing's "Animalese".
+  - The output is assembled by render_animalese() into a single int16 NumPy buffer that is sized
+    once up front; text_to_animalese() wraps it and returns a pydub AudioSegment as before.
 
 Usage example:
   python3 animalese_like.py --samples samples/ --text "hola mundo" --out out.wav --seed 1
+  python3 animalese_like.py --samples samples/ --batch lines.jsonl --workers 4 --seed 1
 
 Author: Generated by ChatGPT for the user.
 """
 
 import argparse
+import csv
+import functools
+import hashlib
+import json
 import os
 import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
 from pydub import AudioSegment
+from pydub.utils import db_to_float
+
+# Formato de salida del motor: mono, 16 bits, 44.1 kHz
+SAMPLE_RATE = 44100
+# pydub crea los silencios a 11025 Hz y los re-muestrea al concatenarlos
+_SILENCE_RATE = 11025
+SPACE_MS = 80
+FADE_IN_MS = 5
+FADE_OUT_MS = 50
+# Recorte aplicado a cada muestra al cargarla (inicio y final)
+TRIM_EDGES_MS = 15
+# Subir si cambia el formato o el procesado de la caché de muestras
+_SAMPLE_CACHE_VERSION = 1
 
 # -------------------- Utility functions --------------------
 def change_pitch(audio_seg: AudioSegment, semitones: float) -> AudioSegment:
@@ -45,87 +72,494 @@ def change_pitch(audio_seg: AudioSegment, semitones: float) -> AudioSegment:
     shifted = audio_seg._spawn(audio_seg.raw_data, overrides={"frame_rate": new_rate}).set_frame_rate(44100)
     return shifted
 
-def load_samples(folder: str, max_samples: int = 5, trim_ms: int = 180) -> list:
+class PitchBank:
+    """
+    Bounded memo of pitched syllables keyed by (sample index, quantized semitone shift).
+
+    Shifts are rounded to a multiple of `step` semitones, so with a pitch range of 4 and a step of
+    0.25 there are only 33 variants per sample and, once warm, synthesis is a copy per syllable.
+    Entries are evicted least-recently-used once `max_bytes` of PCM is held.
+    """
+    def __init__(self, samples: list, step: float = 0.25, max_bytes: int = 32 * 1024 * 1024):
+        if step <= 0:
+            raise ValueError("step must be a positive number of semitones")
+        self.samples = samples
+        self.step = step
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def quantize(self, semitones: float) -> float:
+        return round(semitones / self.step) * self.step
+
+    def get(self, idx: int, semitones: float) -> np.ndarray:
+        """
+        Return the int16 PCM of sample `idx` shifted by `semitones` (quantized), rendering it on a miss.
+        """
+        key = (idx, round(semitones / self.step))
+        with self._lock:
+            pcm = self._cache.get(key)
+            if pcm is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return pcm
+            self.misses += 1
+        pcm = segment_to_pcm(change_pitch(self.samples[idx], key[1] * self.step))
+        with self._lock:
+            if key not in self._cache:
+                self._cache[key] = pcm
+                self.nbytes += pcm.nbytes
+            while self.nbytes > self.max_bytes and len(self._cache) > 1:
+                _, old = self._cache.popitem(last=False)
+                self.nbytes -= old.nbytes
+                self.evictions += 1
+        return pcm
+
+    def prerender(self, pitch_range_semitones: float):
+        """
+        Render every (sample, shift) pair within +-pitch_range_semitones ahead of time.
+        """
+        top = int(round(pitch_range_semitones / self.step))
+        for idx in range(len(self.samples)):
+            for k in range(-top, top + 1):
+                self.get(idx, k * self.step)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._cache),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "bytes": self.nbytes,
+            }
+
+def _decode_sample(path: str) -> AudioSegment:
+    """
+    Decode one sample file (through ffmpeg for compressed formats), normalize and trim it.
+    """
+    seg = AudioSegment.from_file(path)
+    # normalize to mono and 16-bit 44.1k for consistency
+    seg = seg.set_frame_rate(SAMPLE_RATE).set_sample_width(2).set_channels(1)
+
+    # Recortar 15ms del inicio y 15ms del final para limpiar el audio
+    trim_amount = TRIM_EDGES_MS
+    if len(seg) > trim_amount * 2:
+        seg = seg[trim_amount:-trim_amount]
+
+    # Eliminamos el recorte a una longitud máxima para usar el audio completo
+    # if len(seg) > trim_ms:
+    #     seg = seg[:trim_ms]
+    return seg
+
+def _sample_cache_key(path: str) -> str:
+    """
+    Hash of the file contents plus everything _decode_sample() does to it, so that editing a sample
+    or changing the normalization invalidates its cache entry.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    digest.update(f"v{_SAMPLE_CACHE_VERSION}:{SAMPLE_RATE}:2:1:{TRIM_EDGES_MS}".encode())
+    return digest.hexdigest()[:16]
+
+def _load_cached_sample(cache_dir: str, path: str):
+    """
+    Return (AudioSegment or None, cache file path). Stale entries for the same file are removed when
+    possible; a read-only or concurrently modified cache directory only skips that cleanup.
+    """
+    name = os.path.basename(path)
+    cache_path = os.path.join(cache_dir, f"{name}.{_sample_cache_key(path)}.npy")
+    try:
+        for entry in os.listdir(cache_dir):
+            key = entry[len(name) + 1:-len(".npy")]
+            if entry.startswith(name + ".") and entry.endswith(".npy") and len(key) == 16 and "." not in key \
+                    and os.path.join(cache_dir, entry) != cache_path:
+                try:
+                    os.remove(os.path.join(cache_dir, entry))
+                except OSError:
+                    pass
+    except OSError:
+        # Solo es limpieza: si la entrada buena tampoco se puede leer, abajo se decodifica el original
+        pass
+    if not os.path.exists(cache_path):
+        return None, cache_path
+    try:
+        pcm = np.load(cache_path)
+    except (OSError, ValueError):
+        return None, cache_path
+    return pcm_to_segment(pcm), cache_path
+
+def _store_cached_sample(cache_path: str, seg: AudioSegment):
+    # Escribimos a un temporal y renombramos para no dejar nunca un .npy a medias
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            np.save(f, segment_to_pcm(seg))
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"WARNING: could not write sample cache {cache_path}: {e}")
+
+def load_samples(folder: str, max_samples: int = 5, trim_ms: int = 180, use_cache: bool = True,
+                 cache_dir: str = None, workers: int = None) -> list:
     """
     Load up to max_samples audio files from folder (sorted by name). Trim each to trim_ms milliseconds max.
     Returns list of AudioSegment
+
+    Decoded, normalized and trimmed PCM is cached as .npy files in cache_dir (default: folder/.cache)
+    and read back with np.load on later loads. Files missing from the cache are decoded in parallel with up
+    to `workers` threads (ffmpeg runs as a subprocess, so threads are enough).
     """
     files = sorted([os.path.join(folder, f) for f in os.listdir(folder)
                     if f.lower().endswith((".wav", ".mp3", ".ogg", ".flac", ".m4a"))])
     if not files:
         raise FileNotFoundError(f"No audio files found in {folder}. Place up to {max_samples} syllable files in that folder.")
     files = files[:max_samples]
-    segs = []
-    for p in files:
-        seg = AudioSegment.from_file(p)
-        # normalize to mono and 16-bit 44.1k for consistency
-        seg = seg.set_frame_rate(44100).set_sample_width(2).set_channels(1)
-
-        # Recortar 15ms del inicio y 15ms del final para limpiar el audio
-        trim_amount = 15
-        if len(seg) > trim_amount * 2:
-            seg = seg[trim_amount:-trim_amount]
-
-        # Eliminamos el recorte a una longitud máxima para usar el audio completo
-        # if len(seg) > trim_ms:
-        #     seg = seg[:trim_ms]
-        segs.append(seg)
+
+    segs = [None] * len(files)
+    cache_paths = [None] * len(files)
+    if use_cache:
+        cache_dir = cache_dir or os.path.join(folder, ".cache")
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+        except OSError as e:
+            print(f"WARNING: sample cache disabled, cannot create {cache_dir}: {e}")
+            use_cache = False
+    if use_cache:
+        for i, p in enumerate(files):
+            segs[i], cache_paths[i] = _load_cached_sample(cache_dir, p)
+
+    missing = [i for i, seg in enumerate(segs) if seg is None]
+    if missing:
+        with ThreadPoolExecutor(max_workers=workers or min(len(missing), os.cpu_count() or 1)) as pool:
+            for i, seg in zip(missing, pool.map(_decode_sample, [files[i] for i in missing])):
+                segs[i] = seg
+                if use_cache:
+                    _store_cached_sample(cache_paths[i], seg)
     return segs
 
+# -------------------- NumPy engine helpers --------------------
+def segment_to_pcm(seg: AudioSegment) -> np.ndarray:
+    """
+    Return the raw data of a mono 16-bit AudioSegment as an int16 array (no copy).
+    """
+    return np.frombuffer(seg.raw_data, dtype=np.int16)
+
+def pcm_to_segment(pcm: np.ndarray, frame_rate: int = SAMPLE_RATE) -> AudioSegment:
+    """
+    Wrap an int16 mono array back into a pydub AudioSegment.
+    """
+    return AudioSegment(data=pcm.astype(np.int16, copy=False).tobytes(), sample_width=2,
+                        frame_rate=frame_rate, channels=1)
+
+def _silent_frames(duration_ms: float) -> int:
+    # Mismo cálculo que AudioSegment.silent()
+    return int(_SILENCE_RATE * (duration_ms / 1000.0))
+
+@functools.lru_cache(maxsize=256)
+def _resampled_len(frames: int) -> int:
+    """
+    Number of frames pydub produces when a silence of `frames` frames at 11025 Hz is
+    synced to 44.1 kHz. audioop.ratecv does not give exactly frames * 4, so we ask pydub
+    once per length and memoize it.
+    """
+    if frames == 0:
+        return 0
+    silence = AudioSegment(data=b"\0\0" * frames, sample_width=2, frame_rate=_SILENCE_RATE, channels=1)
+    return int(silence.set_frame_rate(SAMPLE_RATE).frame_count())
+
+def _mul(pcm: np.ndarray, factor) -> np.ndarray:
+    # Igual que audioop.mul: satura y redondea hacia menos infinito
+    return np.floor(np.clip(pcm * factor, -32768, 32767)).astype(np.int16)
+
+def _len_ms(n_frames: int, frame_rate: int) -> int:
+    # Igual que AudioSegment.__len__
+    return round(1000 * (float(n_frames) / frame_rate))
+
+def _slice_ms(pcm: np.ndarray, frame_rate: int, start, end) -> np.ndarray:
+    """
+    Millisecond slicing with the same rounding and padding rules as AudioSegment.__getitem__.
+    """
+    length = _len_ms(len(pcm), frame_rate)
+
+    def position(val):
+        if val < 0:
+            val = length - abs(val)
+        val = length * (frame_rate / 1000.0) if val == float("inf") else val * (frame_rate / 1000.0)
+        return int(val)
+
+    first = position(min(start, length))
+    last = position(min(end, length))
+    data = pcm[first:last]
+    missing = (last - first) - len(data)
+    if missing > 0 and len(data):
+        data = np.concatenate([data, np.zeros(missing, dtype=np.int16)])
+    return data
+
+def _fade(pcm: np.ndarray, frame_rate: int, to_gain=0, from_gain=0, start=None, end=None,
+          duration=None) -> np.ndarray:
+    """
+    Vectorized port of AudioSegment.fade() for short (<= 100 ms) fades, which pydub applies
+    one gain step per frame. Kept bit-exact so the NumPy engine matches the pydub path.
+    """
+    length = _len_ms(len(pcm), frame_rate)
+    start = min(length, start) if start is not None else None
+    end = min(length, end) if end is not None else None
+    if start is not None and start < 0:
+        start += length
+    if end is not None and end < 0:
+        end += length
+    if start is not None:
+        end = start + duration
+    else:
+        start = end - duration
+
+    from_power = db_to_float(from_gain)
+    before_fade = _slice_ms(pcm, frame_rate, 0, start)
+    if from_gain != 0:
+        before_fade = _mul(before_fade, from_power)
+
+    gain_delta = db_to_float(to_gain) - from_power
+    start_frame = start * (frame_rate / 1000.0)
+    fade_frames = end * (frame_rate / 1000.0) - start_frame
+    steps = np.arange(int(fade_frames))
+    volume = from_power + (gain_delta / fade_frames) * steps
+    # get_frame() indexa bytes, así que los índices negativos cuentan desde el final
+    index = (start_frame + steps).astype(np.int64)
+    n = len(pcm)
+    valid = ((index >= 0) & (index < n)) | ((index < -1) & (index + n >= 0))
+    index = np.where(index < 0, index + n, index)[valid]
+    faded = _mul(pcm[index], volume[valid])
+
+    after_fade = _slice_ms(pcm, frame_rate, end, length)
+    if to_gain != 0:
+        after_fade = _mul(after_fade, db_to_float(to_gain))
+    return np.concatenate([before_fade, faded, after_fade]).astype(np.int16, copy=False)
+
+def _apply_edge_fades(pcm: np.ndarray, frame_rate: int = SAMPLE_RATE) -> np.ndarray:
+    # Equivale a out.fade_in(5).fade_out(50)
+    pcm = _fade(pcm, frame_rate, from_gain=-120, start=0, duration=FADE_IN_MS)
+    return _fade(pcm, frame_rate, to_gain=-120, end=float("inf"), duration=FADE_OUT_MS)
+
 # -------------------- Main generator --------------------
-def text_to_animalese(text: str, samples: list, pitch_range_semitones: int = 7,
-                      syllable_len_ms: int = 140, gap_ms: int = 30, seed=None) -> AudioSegment:
+def render_animalese(text: str, samples: list, pitch_range_semitones: int = 7,
+                     gap_ms: int = 30, seed=None, pitch_bank: PitchBank = None) -> np.ndarray:
     """
-    Convert text into a synthetic 'animalese-like' audio stream using provided samples.
-    - text: input string
-    - samples: list of AudioSegment syllables (length up to 5 expected)
-    - pitch_range_semitones: maximum absolute semitone shift (random between -range..+range)
-    - syllable_len_ms: target duration for each syllable (samples will be trimmed/padded)
-    - gap_ms: silence between syllables
+    NumPy engine behind text_to_animalese(). Returns mono int16 PCM at 44.1 kHz.
+
+    The text is planned first (one pitched syllable or silence per character), then the output
+    buffer is allocated once and every syllable is copied into place, so the cost is linear in
+    the output length instead of re-copying the whole buffer for every character.
+    samples must be mono 16-bit AudioSegments as returned by load_samples(). A text without any
+    voiced character returns the equivalent silence at 44.1 kHz.
+    With a pitch_bank the random shift is quantized to the bank's step and the pitched syllable is
+    reused from the bank instead of being resampled again.
     """
     if seed is not None:
         random.seed(seed)
 
-    out = AudioSegment.silent(duration=0)
-    silence_short = AudioSegment.silent(duration=gap_ms)
+    space_frames = _silent_frames(SPACE_MS)
+    gap_frames = _resampled_len(_silent_frames(gap_ms))
 
-    # Ya no pre-procesamos los audios a una longitud fija. Usamos los originales.
-    proc_samples = samples
-
-    # Map characters to samples using a small deterministic mapping so same input -> similar output
+    # Plan: lista de (pcm o None para silencio, número de frames)
+    plan = []
+    # pydub mantiene la salida a 11025 Hz hasta la primera sílaba, y entonces re-muestrea
+    # todos los espacios iniciales como un solo bloque
+    leading_frames = 0
+    voiced = False
     for ch in text:
         if ch.isspace():
-            # Usamos un silencio de duración media para los espacios
-            out += AudioSegment.silent(duration=80)
+            if voiced:
+                plan.append((None, _resampled_len(space_frames)))
+            else:
+                leading_frames += space_frames
             continue
-        # pick sample index by character code to distribute over available samples
-        idx = ord(ch) % len(proc_samples)
-        base = proc_samples[idx]
-        # pick a random semitone shift within range
+        if not voiced:
+            plan.append((None, _resampled_len(leading_frames)))
+            voiced = True
+        idx = ord(ch) % len(samples)
         semitone = random.uniform(-pitch_range_semitones, pitch_range_semitones)
-        changed = change_pitch(base, semitone)
-        # Eliminamos la aleatorización de la duración y el recorte. Usamos el audio completo.
-        out += changed + silence_short
+        if pitch_bank is not None:
+            syllable = pitch_bank.get(idx, semitone)
+        else:
+            syllable = segment_to_pcm(change_pitch(samples[idx], semitone))
+        plan.append((syllable, len(syllable)))
+        plan.append((None, gap_frames))
+
+    if not voiced:
+        return np.zeros(_resampled_len(leading_frames), dtype=np.int16)
+
+    out = np.zeros(sum(n for _, n in plan), dtype=np.int16)
+    pos = 0
+    for pcm, n in plan:
+        if pcm is not None:
+            out[pos:pos + n] = pcm
+        pos += n
 
     # small fade to reduce clicks
-    out = out.fade_in(5).fade_out(50)
-    return out
+    return _apply_edge_fades(out)
+
+def text_to_animalese(text: str, samples: list, pitch_range_semitones: int = 7,
+                      syllable_len_ms: int = 140, gap_ms: int = 30, seed=None,
+                      pitch_bank: PitchBank = None) -> AudioSegment:
+    """
+    Convert text into a synthetic 'animalese-like' audio stream using provided samples.
+    - text: input string
+    - samples: list of AudioSegment syllables (length up to 5 expected)
+    - pitch_range_semitones: maximum absolute semitone shift (random between -range..+range)
+    - syllable_len_ms: kept for compatibility, syllables are used at full length
+    - gap_ms: silence between syllables
+    - pitch_bank: optional PitchBank to quantize and reuse pitched syllables
+
+    Compatibility wrapper around render_animalese(); the result is identical to the old
+    AudioSegment concatenation loop.
+    """
+    if all(ch.isspace() for ch in text):
+        # Sin sílabas pydub nunca sale de 11025 Hz: devolvemos ese mismo silencio
+        if seed is not None:
+            random.seed(seed)
+        silence = np.zeros(_silent_frames(SPACE_MS) * len(text), dtype=np.int16)
+        return pcm_to_segment(_apply_edge_fades(silence, _SILENCE_RATE), _SILENCE_RATE)
+    pcm = render_animalese(text, samples, pitch_range_semitones=pitch_range_semitones,
+                           gap_ms=gap_ms, seed=seed, pitch_bank=pitch_bank)
+    return pcm_to_segment(pcm)
+
+# -------------------- Batch rendering --------------------
+_BATCH_PARAMS = ("pitch_range", "gap_ms", "pitch_step")
+
+def read_manifest(path: str, defaults: dict, base_seed=None) -> list:
+    """
+    Read a JSONL or CSV (by extension) batch manifest. Each entry needs "text" and "out" and may set
+    "seed", "pitch_range", "gap_ms" and "pitch_step" (in JSONL also nested under "params").
+    Entries without a seed get base_seed + line number, so every line stays reproducible.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.lower().endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    jobs = []
+    for n, row in enumerate(rows):
+        if row.get("text") is None or not row.get("out"):
+            raise ValueError(f"{path}: entry {n + 1} needs 'text' and 'out'")
+        params = dict(defaults)
+        params.update({k: v for k, v in row.get("params", {}).items() if k in _BATCH_PARAMS})
+        params.update({k: row[k] for k in _BATCH_PARAMS if row.get(k) not in (None, "")})
+        seed = row.get("seed")
+        if seed in (None, ""):
+            seed = None if base_seed is None else base_seed + n
+        jobs.append({
+            "text": row["text"],
+            "out": row["out"],
+            "seed": None if seed is None else int(seed),
+            "pitch_range": float(params["pitch_range"]),
+            "gap_ms": int(params["gap_ms"]),
+            "pitch_step": float(params["pitch_step"]) if params.get("pitch_step") else None,
+        })
+    return jobs
+
+# Estado de cada proceso del pool: las muestras llegan una sola vez por proceso
+_worker_samples = None
+_worker_banks = {}
+
+def _init_batch_worker(raw_samples: list):
+    global _worker_samples
+    _worker_samples = [pcm_to_segment(np.frombuffer(raw, dtype=np.int16)) for raw in raw_samples]
+    _worker_banks.clear()
+
+def _render_batch_job(job: dict):
+    """
+    Render one manifest entry. Returns (out path, audio seconds, error message or None).
+    """
+    try:
+        bank = None
+        if job["pitch_step"]:
+            bank = _worker_banks.get(job["pitch_step"])
+            if bank is None:
+                bank = _worker_banks[job["pitch_step"]] = PitchBank(_worker_samples, step=job["pitch_step"])
+        seg = text_to_animalese(job["text"], _worker_samples, pitch_range_semitones=job["pitch_range"],
+                                gap_ms=job["gap_ms"], seed=job["seed"], pitch_bank=bank)
+        out_dir = os.path.dirname(job["out"])
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+        seg.export(job["out"], format="wav")
+        return job["out"], len(seg) / 1000.0, None
+    except Exception as e:
+        return job["out"], 0.0, f"{type(e).__name__}: {e}"
+
+def render_batch(jobs: list, samples: list, workers: int = None) -> dict:
+    """
+    Render every job across a process pool. The sample PCM is shipped once to each worker.
+    Returns a throughput summary.
+    """
+    raw_samples = [seg.raw_data for seg in samples]
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    if workers == 1:
+        _init_batch_worker(raw_samples)
+        results = [_render_batch_job(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                                 initargs=(raw_samples,)) as pool:
+            chunksize = max(1, len(jobs) // (workers * 4))
+            results = list(pool.map(_render_batch_job, jobs, chunksize=chunksize))
+    elapsed = time.perf_counter() - start
+
+    failures = [(out, err) for out, _, err in results if err]
+    audio_s = sum(seconds for _, seconds, _ in results)
+    return {
+        "lines": len(jobs),
+        "failed": len(failures),
+        "failures": failures,
+        "workers": workers,
+        "wall_s": elapsed,
+        "lines_per_s": len(jobs) / elapsed if elapsed else 0.0,
+        "chars_per_s": sum(len(job["text"]) for job in jobs) / elapsed if elapsed else 0.0,
+        "audio_s": audio_s,
+        "realtime_factor": audio_s / elapsed if elapsed else 0.0,
+    }
 
 # -------------------- CLI --------------------
 def main():
     parser = argparse.ArgumentParser(description="Generate Animal Crossing-like speech from text using a few syllable samples.")
     parser.add_argument("--samples", required=True, help="Folder with up to 5 short audio sample files (wav/mp3/ogg).")
-    parser.add_argument("--text", required=True, help="Text to convert to 'animalese'. Use quotes.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--text", help="Text to convert to 'animalese'. Use quotes.")
+    source.add_argument("--batch", help="JSONL or CSV manifest with text, out and optional seed/params per line.")
     parser.add_argument("--out", default="animalese_out.wav", help="Output WAV filename.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for --batch (default: CPU count).")
     parser.add_argument("--pitch_range", type=int, default=4, help="Max semitone shift (default 4).")
     parser.add_argument("--syllable_ms", type=int, default=140, help="Target syllable length in milliseconds.")
     parser.add_argument("--gap_ms", type=int, default=30, help="Gap between syllables in ms.")
     parser.add_argument("--seed", type=int, default=None, help="Random seed for reproducibility.")
+    parser.add_argument("--pitch_step", type=float, default=None,
+                        help="Quantize pitch shifts to this many semitones and reuse them (e.g. 0.25).")
     args = parser.parse_args()
 
     samples = load_samples(args.samples, max_samples=5, trim_ms=300)
+    if args.batch:
+        defaults = {"pitch_range": args.pitch_range, "gap_ms": args.gap_ms, "pitch_step": args.pitch_step}
+        jobs = read_manifest(args.batch, defaults, base_seed=args.seed)
+        summary = render_batch(jobs, samples, workers=args.workers)
+        for out, err in summary["failures"]:
+            print(f"FAILED {out}: {err}")
+        print(f"Rendered {summary['lines'] - summary['failed']}/{summary['lines']} lines with "
+              f"{summary['workers']} workers in {summary['wall_s']:.2f}s: "
+              f"{summary['lines_per_s']:.1f} lines/s, {summary['chars_per_s']:.0f} chars/s, "
+              f"{summary['audio_s']:.1f}s of audio ({summary['realtime_factor']:.1f}x real time)")
+        return
+
+    bank = PitchBank(samples, step=args.pitch_step) if args.pitch_step else None
     out_seg = text_to_animalese(args.text, samples, pitch_range_semitones=args.pitch_range,
-                                syllable_len_ms=args.syllable_ms, gap_ms=args.gap_ms, seed=args.seed)
+                                syllable_len_ms=args.syllable_ms, gap_ms=args.gap_ms, seed=args.seed,
+                                pitch_bank=bank)
     out_seg.export(args.out, format="wav")
     print(f"Saved -> {args.out}")
 
@@ -0,0 +1,371 @@
+"""
+audio_stream.py
+
+Salida de audio persistente para la voz de BERTraco.
+
+En lugar de abrir una reproducción nueva por cada palabra (sa.play_buffer + wait_done), se abre
+un único stream de salida que consume frames PCM (int16 mono) desde un buffer circular. El hilo
+de síntesis solo escribe en el buffer, así que las palabras suenan una detrás de otra sin huecos
+y la síntesis de la siguiente palabra no espera a que termine la anterior.
+
+Backends:
+  - "sounddevice": stream de PortAudio con callback (recomendado, pip install sounddevice).
+  - "simpleaudio": reproduce bloques cortos seguidos; se usa si sounddevice no está disponible.
+  - "null": descarta el audio a ritmo de tiempo real (máquinas sin tarjeta de sonido, pruebas).
+  - "file:<ruta.wav>": igual que "null" pero guarda en un WAV lo que se habría reproducido.
+  - una función: igual que "null" pero le pasa cada bloque (bytes PCM) en lugar de reproducirlo;
+    el servidor la usa para mandar el audio a cada cliente.
+  - "auto": sounddevice, luego simpleaudio y por último null.
+"""
+
+import threading
+import time
+import wave
+
+import numpy as np
+
+
+class RingBuffer:
+    """Buffer circular de frames int16 con escritura bloqueante cuando está lleno."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._data = np.zeros(capacity, dtype=np.int16)
+        self._read = 0
+        self._size = 0
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return self._size
+
+    def write(self, pcm: np.ndarray, timeout=None, cancelled=lambda: False) -> int:
+        """
+        Copia pcm al buffer, esperando a que haya espacio. Devuelve los frames escritos, que
+        pueden ser menos si se agota el timeout o cancelled() pasa a ser verdadero.
+        """
+        written = 0
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while written < len(pcm):
+                while self._size == self.capacity:
+                    if cancelled():
+                        return written
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return written
+                    self._cond.wait(remaining if remaining is not None else 0.1)
+                if cancelled():
+                    return written
+                n = min(len(pcm) - written, self.capacity - self._size)
+                start = (self._read + self._size) % self.capacity
+                first = min(n, self.capacity - start)
+                self._data[start:start + first] = pcm[written:written + first]
+                self._data[:n - first] = pcm[written + first:written + n]
+                self._size += n
+                written += n
+                self._cond.notify_all()
+        return written
+
+    def read(self, n: int) -> np.ndarray:
+        """Saca hasta n frames del buffer (puede devolver menos, o ninguno)."""
+        with self._cond:
+            n = min(n, self._size)
+            first = min(n, self.capacity - self._read)
+            out = np.concatenate([self._data[self._read:self._read + first], self._data[:n - first]])
+            self._read = (self._read + n) % self.capacity
+            self._size -= n
+            self._cond.notify_all()
+        return out
+
+    def wait_below(self, n: int, timeout=None) -> bool:
+        """Espera a que queden como mucho n frames en el buffer. Devuelve False si se agota el timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._size <= n, timeout)
+
+    def clear(self):
+        with self._cond:
+            self._read = 0
+            self._size = 0
+            self._cond.notify_all()
+
+
+class AudioOutputStream:
+    """
+    Stream de salida de larga duración alimentado por un RingBuffer.
+
+    write() añade PCM al final de lo que ya está sonando (sin huecos), flush() descarta todo lo
+    pendiente (sustituye a sa.stop_all()). underruns cuenta las veces que el sink se quedó sin
+    datos en mitad de una respuesta, es decir, cuando la síntesis no llegó a tiempo.
+    """
+
+    def __init__(self, sample_rate: int = 44100, backend: str = "auto", buffer_seconds: float = 4.0,
+                 block_frames: int = 1024):
+        self.sample_rate = sample_rate
+        self.block_frames = block_frames
+        self.buffer = RingBuffer(int(sample_rate * buffer_seconds))
+        self.played_frames = 0
+        self.written_frames = 0
+        self.underruns = 0
+        self.underrun_frames = 0
+        self._active = False
+        self._starved = False
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.sink = _make_sink(backend, self)
+
+    @property
+    def backend(self) -> str:
+        return self.sink.name
+
+    def start(self):
+        self.sink.start()
+        return self
+
+    def close(self):
+        self.flush()
+        self.sink.close()
+
+    def write(self, pcm: np.ndarray, timeout=None) -> bool:
+        """
+        Encola pcm (int16 mono) para reproducirlo justo después de lo ya encolado. Bloquea si el
+        buffer está lleno. Devuelve False si un flush() descartó la escritura a mitad de camino.
+        """
+        generation = self._generation
+        cancelled = lambda: self._generation != generation
+        written = self.buffer.write(np.asarray(pcm, dtype=np.int16), timeout=timeout, cancelled=cancelled)
+        with self._lock:
+            if self._generation == generation:
+                self.written_frames += written
+                self._active = True
+        return written == len(pcm) and not cancelled()
+
+    def flush(self):
+        """Corta lo que esté sonando y descarta todo el audio pendiente."""
+        with self._lock:
+            self._generation += 1
+            self._active = False
+            self._starved = False
+            self.buffer.clear()
+
+    def end_utterance(self):
+        """Indica que no llega más audio por ahora: el silencio que sigue no es un underrun."""
+        with self._lock:
+            self._active = False
+            self._starved = False
+
+    def pull(self, n: int, pad: bool = True) -> np.ndarray:
+        """
+        Lo llaman los sinks: devuelve n frames, rellenando con silencio si falta audio (pad=True)
+        o solo los frames reales que haya (pad=False).
+        """
+        pcm = self.buffer.read(n)
+        missing = n - len(pcm)
+        with self._lock:
+            self.played_frames += len(pcm)
+            if missing == n and self._active:
+                # Un bloque entero sin datos en mitad de una respuesta. El último bloque parcial de
+                # cada frase no cuenta, y se cuenta un underrun por sequía, no por bloque.
+                if not self._starved:
+                    self.underruns += 1
+                    self._starved = True
+                self.underrun_frames += missing
+            elif not missing:
+                self._starved = False
+        if missing and pad:
+            pcm = np.concatenate([pcm, np.zeros(missing, dtype=np.int16)])
+        return pcm
+
+    def buffered_seconds(self) -> float:
+        """Segundos de audio escritos que todavía no se han reproducido."""
+        return len(self.buffer) / self.sample_rate
+
+    def wait_backlog(self, max_seconds: float, timeout=None) -> bool:
+        """
+        Espera a que queden como mucho max_seconds de audio por reproducir. Avanza al ritmo real de
+        reproducción del sink. Devuelve False si se agota el timeout.
+        """
+        return self.buffer.wait_below(int(max_seconds * self.sample_rate), timeout)
+
+    def wait_idle(self, timeout=None) -> bool:
+        """Espera a que el buffer se vacíe. Devuelve False si se agota el timeout."""
+        return self.wait_backlog(0, timeout)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": self.backend,
+                "written_s": self.written_frames / self.sample_rate,
+                "played_s": self.played_frames / self.sample_rate,
+                "buffered_s": self.buffered_seconds(),
+                "underruns": self.underruns,
+                "underrun_s": self.underrun_frames / self.sample_rate,
+            }
+
+
+class AudioPacer:
+    """
+    Marca el ritmo del texto según la reproducción del audio, en lugar de un time.sleep() fijo.
+
+    pace() no espera nada mientras el audio va al día, y solo retiene el texto cuando lo que queda
+    por reproducir supera budget_s segundos. waited_s acumula cuánto se ha retenido.
+    """
+
+    def __init__(self, audio_out: AudioOutputStream, budget_s: float = 1.0):
+        self.audio_out = audio_out
+        self.budget_s = budget_s
+        self.waited_s = 0.0
+
+    def pace(self) -> float:
+        start = time.monotonic()
+        self.audio_out.wait_backlog(self.budget_s)
+        waited = time.monotonic() - start
+        self.waited_s += waited
+        return waited
+
+    def drain(self, pending, timeout: float) -> bool:
+        """
+        Al final del turno: espera a que el hilo de audio termine lo que queda en la cola `pending`
+        (pending.join(), también lo que esté sintetizando en ese momento) y a que todo suene.
+        timeout limita la espera a la síntesis y el margen sobre la duración del audio ya escrito.
+        Devuelve False si se agota: entonces quien llama decide si corta lo pendiente.
+        """
+        if not pending.join(timeout):
+            return False
+        return self.audio_out.wait_idle(timeout=self.audio_out.buffered_seconds() + timeout)
+
+
+# -------------------- Sinks --------------------
+class _ClockSink:
+    """Consume bloques a ritmo de tiempo real en un hilo propio (null, file, simpleaudio)."""
+    name = "null"
+    pad = True
+
+    def __init__(self, stream: AudioOutputStream):
+        self.stream = stream
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=1.0)
+
+    def _run(self):
+        block = self.stream.block_frames
+        period = block / self.stream.sample_rate
+        next_tick = time.monotonic()
+        while not self._stop.is_set():
+            self.play(self.stream.pull(block, pad=self.pad))
+            next_tick += period
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_tick = time.monotonic()
+
+    def play(self, pcm: np.ndarray):
+        pass
+
+
+class FileSink(_ClockSink):
+    """Guarda en un WAV los frames consumidos, sin el silencio de relleno entre escrituras."""
+    name = "file"
+    pad = False
+
+    def __init__(self, stream: AudioOutputStream, path: str):
+        super().__init__(stream)
+        self.path = path
+        self._wav = wave.open(path, "wb")
+        self._wav.setnchannels(1)
+        self._wav.setsampwidth(2)
+        self._wav.setframerate(stream.sample_rate)
+
+    def play(self, pcm: np.ndarray):
+        if len(pcm):
+            self._wav.writeframes(pcm.tobytes())
+
+    def close(self):
+        super().close()
+        self._wav.close()
+
+
+class CallbackSink(_ClockSink):
+    """Entrega cada bloque consumido a una función (bytes int16 mono), sin el silencio de relleno."""
+    name = "callback"
+    pad = False
+
+    def __init__(self, stream: AudioOutputStream, callback):
+        super().__init__(stream)
+        self.callback = callback
+
+    def play(self, pcm: np.ndarray):
+        if len(pcm):
+            self.callback(pcm.tobytes())
+
+
+class SimpleAudioSink(_ClockSink):
+    """Reproduce bloques de ~0.25 s con simpleaudio. Puede dejar microcortes entre bloques."""
+    name = "simpleaudio"
+
+    def __init__(self, stream: AudioOutputStream):
+        import simpleaudio
+        super().__init__(stream)
+        self._sa = simpleaudio
+        stream.block_frames = max(stream.block_frames, stream.sample_rate // 4)
+
+    def _run(self):
+        while not self._stop.is_set():
+            pcm = self.stream.pull(self.stream.block_frames)
+            if pcm.any():
+                self._sa.play_buffer(pcm.tobytes(), 1, 2, self.stream.sample_rate).wait_done()
+            else:
+                time.sleep(self.stream.block_frames / self.stream.sample_rate)
+
+
+class SoundDeviceSink:
+    """Stream de PortAudio: el callback de audio saca los frames directamente del buffer."""
+    name = "sounddevice"
+
+    def __init__(self, stream: AudioOutputStream):
+        import sounddevice
+        self.stream = stream
+        self._out = sounddevice.OutputStream(
+            samplerate=stream.sample_rate, channels=1, dtype="int16",
+            blocksize=stream.block_frames, latency="low", callback=self._callback
+        )
+
+    def _callback(self, outdata, frames, time_info, status):
+        outdata[:, 0] = self.stream.pull(frames)
+
+    def start(self):
+        self._out.start()
+
+    def close(self):
+        self._out.stop()
+        self._out.close()
+
+
+def _make_sink(backend, stream: AudioOutputStream):
+    if callable(backend):
+        return CallbackSink(stream, backend)
+    if backend == "null":
+        return _ClockSink(stream)
+    if backend.startswith("file:"):
+        return FileSink(stream, backend[len("file:"):])
+    if backend == "sounddevice":
+        return SoundDeviceSink(stream)
+    if backend == "simpleaudio":
+        return SimpleAudioSink(stream)
+    if backend == "auto":
+        for candidate in (SoundDeviceSink, SimpleAudioSink):
+            try:
+                return candidate(stream)
+            except Exception:
+                continue
+        print("ADVERTENCIA: No hay dispositivo de audio disponible, la voz se descartará.")
+        return _ClockSink(stream)
+    raise ValueError(f"Backend de audio desconocido: {backend}")
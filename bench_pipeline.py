@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+bench_pipeline.py
+
+Latencia de extremo a extremo de la cadena del chat (chat_pipeline.ChatPipeline). No necesita
+Ollama, ni pantalla, ni tarjeta de sonido.
+
+Arranca fake_ollama (tiempos sintéticos, o una grabación con --replay), carga una de las tres
+cadenas igual que bertraco_server.py y le pasa conversaciones de guion con una HeadlessFace y la
+salida de audio "null" (que aun así reproduce a ritmo real). Cada conversación empieza con una
+cadena y un historial nuevos, y el siguiente mensaje solo se manda cuando ha terminado la
+respuesta anterior. Cada turno deja su registro de turn_metrics. El informe da p50/p90/p95/p99/max
+por etapa: esperas en cola, traducción, TTFT, generación, RTF de la síntesis, primera palabra y
+turno completo.
+
+Con --ollama se habla con un servidor de verdad. Si además se da --record, fake_ollama se pone en
+medio como proxy y graba la ejecución para reproducirla luego con --replay. Para grabar sesiones
+de la aplicación de escritorio, se arranca fake_ollama.py --record aparte y se apunta OLLAMA_HOST
+hacia él.
+
+Las cadenas con voz usan sílabas sintéticas (como bench_voice.py) salvo que se pase --samples.
+Los resultados se guardan en JSON para comparar ejecuciones con --compare.
+
+Uso:
+  python bench_pipeline.py --pipeline texto --out bench_pipeline.json
+  python bench_pipeline.py --pipeline voz --ttft 0.8 --tps 12
+  python bench_pipeline.py --pipeline texto --ollama http://127.0.0.1:11434 --record sesion.jsonl
+  python bench_pipeline.py --pipeline texto --replay sesion.jsonl --compare bench_pipeline.json
+"""
+
+import argparse
+import importlib
+import json
+import os
+import tempfile
+import time
+
+from bertraco_server import PIPELINES
+from chat_pipeline import MessageQueue
+from fake_ollama import Cassette, FakeOllama, SyntheticSource
+from headless_face import HeadlessFace
+from turn_metrics import TurnMetrics
+
+CONVERSATIONS = [
+    ["hola, como estas?", "que puedes hacer?", "cuentame un chiste", "gracias, adios"],
+    ["cual es tu color favorito?", "y tu animal favorito?", "por que?"],
+    ["hola", "me cuentas algo sobre el bosque?", "que animales viven alli?", "cual es el mas rapido?",
+     "y el mas lento?"],
+]
+
+# Campo del registro -> menos es mejor (False para los ritmos)
+FIELDS = {
+    "input_wait_s": True,
+    "llm_wait_s": True,
+    "translate_in_s": True,
+    "ttft_s": True,
+    "generation_s": True,
+    "tokens_per_s": False,
+    "translate_out_s": True,
+    "synthesis_rtf": True,
+    "first_output_s": True,
+    "turn_s": True,
+}
+QUANTILES = (0.5, 0.9, 0.95, 0.99)
+
+
+class _ScriptedQueue(MessageQueue):
+    """Da el siguiente mensaje del guion solo cuando la cadena lo pide (al acabar el turno anterior)."""
+
+    def __init__(self, messages, think_s: float = 0.0):
+        super().__init__()
+        self._script = list(messages)
+        self._think_s = think_s
+        self._first = True
+
+    def get(self, block=True, timeout=None):
+        if self.empty():
+            if not self._script:
+                self.put(None)
+            else:
+                if self._think_s and not self._first:
+                    time.sleep(self._think_s)
+                self._first = False
+                self.put(self._script.pop(0))
+        return super().get(block, timeout)
+
+
+class _CollectingMetrics(TurnMetrics):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.records = []
+
+    def record(self, record: dict):
+        self.records.append(dict(record))
+        super().record(record)
+
+
+def percentile(values, q: float) -> float:
+    """Interpolación lineal entre las posiciones más cercanas."""
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q
+    low = int(pos)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+
+def summarize(records: list) -> dict:
+    summary = {}
+    for field in FIELDS:
+        values = [r[field] for r in records if r.get(field) is not None]
+        if not values:
+            continue
+        summary[field] = {"n": len(values), "mean": sum(values) / len(values), "max": max(values)}
+        for q in QUANTILES:
+            summary[field][f"p{round(q * 100)}"] = percentile(values, q)
+    outcomes = {}
+    for r in records:
+        outcomes[r.get("outcome", "completed")] = outcomes.get(r.get("outcome", "completed"), 0) + 1
+    return {"turns": len(records), "outcomes": outcomes, "fields": summary}
+
+
+def load_conversations(path: str) -> list:
+    """Lista JSON de conversaciones, cada una una lista de mensajes del usuario."""
+    with open(path, encoding="utf-8") as f:
+        conversations = json.load(f)
+    if not all(isinstance(c, list) and all(isinstance(m, str) for m in c) for c in conversations):
+        raise ValueError(f"{path}: se esperaba una lista de listas de mensajes")
+    return conversations
+
+
+def start_llm_server(args):
+    """Devuelve (fake_ollama o None, OLLAMA_HOST, etiqueta del origen)."""
+    if args.ollama and not args.record:
+        return None, args.ollama, "ollama"
+    if args.record:
+        server = FakeOllama(upstream=args.ollama, cassette=Cassette(args.record))
+        label = "record"
+    elif args.replay:
+        server = FakeOllama(Cassette(args.replay), speed=args.speed)
+        label = "replay"
+    else:
+        source = SyntheticSource(args.ttft, args.tps, args.tokens, args.jitter, args.seed)
+        server = FakeOllama(source, speed=args.speed, load_s=args.load)
+        label = "synthetic"
+    return server.start(), server.url, label
+
+
+def run(args, conversations, samples_dir: str) -> dict:
+    # Antes de importar la cadena: se leen al importarla
+    os.environ["BERTRACO_AUDIO"] = "null"
+    os.environ["BERTRACO_METRICS"] = "0"  # aquí se usa un TurnMetrics propio
+    if not args.cache:
+        os.environ["BERTRACO_RESPONSE_CACHE"] = "0"
+        os.environ["BERTRACO_TRANSLATION_CACHE"] = "0"
+    server, host, source = start_llm_server(args)
+    os.environ["OLLAMA_HOST"] = host
+
+    pipeline = importlib.import_module(PIPELINES[args.pipeline])
+    if hasattr(pipeline, "SAMPLES_FOLDER"):
+        pipeline.SAMPLES_FOLDER = samples_dir
+    pipeline.init_runtime()
+    llm = pipeline.llm
+    metrics = _CollectingMetrics(args.jsonl, labels={
+        "pipeline": args.pipeline, "model": getattr(llm, "model", None) or "unknown", "source": source})
+    pipeline.metricas = metrics
+
+    prefix = getattr(pipeline, "prefijo_prompt", None) or getattr(pipeline, "prefijo_prompt_en", None)
+    if not args.cold and hasattr(llm, "warm_up"):
+        llm.warm_up(prefix.messages if prefix.enabled else None)
+
+    stages = []
+    started = time.perf_counter()
+    try:
+        for _ in range(args.repeat):
+            for conversation in conversations:
+                face = HeadlessFace(sleep_timeout_s=0)
+                chat = pipeline.make_pipeline(face, getattr(pipeline, "audio_out", None), None)
+                chat.run(_ScriptedQueue(conversation, args.think))
+                stages.append(chat.stats())
+                face.close()
+    finally:
+        metrics.close()
+        for name in ("servicio_traduccion", "cache_traducciones", "cache_respuestas", "audio_out"):
+            component = getattr(pipeline, name, None)
+            if component:
+                component.close()
+    result = summarize(metrics.records)
+    result.update(
+        config={k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        wall_s=time.perf_counter() - started,
+        voice=bool(getattr(pipeline, "animalese_samples", None)),
+        stages=stages,
+        records=metrics.records,
+    )
+    if server:
+        result["llm_server"] = server.stats()
+        server.close()
+    return result
+
+
+def print_report(result: dict):
+    print(f"\n{result['turns']} turnos {result['outcomes']} en {result['wall_s']:.1f}s "
+          f"(voz: {'sí' if result['voice'] else 'no'})")
+    print(f"  {'campo':16s} {'n':>4s} " + " ".join(f"{k:>9s}" for k in ("p50", "p90", "p95", "p99", "max")))
+    for field, s in result["fields"].items():
+        seconds = field.endswith("_s") and field != "tokens_per_s"
+        values = [s[k] * 1000 if seconds else s[k] for k in ("p50", "p90", "p95", "p99", "max")]
+        unit = "ms" if seconds else ""
+        print(f"  {field:16s} {s['n']:4d} " + " ".join(f"{v:9.{1 if seconds else 3}f}" for v in values)
+              + f" {unit}")
+
+
+def compare(result: dict, baseline_path: str):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)["results"]["fields"]
+    print(f"\nfrente a {baseline_path} (>1.00 = ahora mejor)")
+    for field, s in result["fields"].items():
+        old = baseline.get(field)
+        if not old:
+            continue
+        ratios = []
+        for key in ("p50", "p95"):
+            if not old[key] or not s[key]:
+                ratios.append("     -")
+                continue
+            ratio = old[key] / s[key] if FIELDS[field] else s[key] / old[key]
+            ratios.append(f"{ratio:6.2f}x")
+        print(f"  {field:16s} p50 {ratios[0]}  p95 {ratios[1]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latencia de extremo a extremo de la cadena del chat de BERTraco.")
+    parser.add_argument("--pipeline", choices=sorted(PIPELINES), default="texto")
+    parser.add_argument("--conversations", help="Lista JSON de conversaciones (listas de mensajes).")
+    parser.add_argument("--repeat", type=int, default=1, help="Veces que se repite cada conversación.")
+    parser.add_argument("--think", type=float, default=0.0, help="Segundos entre una respuesta y el siguiente mensaje.")
+    parser.add_argument("--cold", action="store_true", help="No calentar el modelo antes del primer turno.")
+    parser.add_argument("--cache", action="store_true", help="Mantener activas las cachés de respuestas y traducciones.")
+    parser.add_argument("--samples", help="Carpeta de muestras de voz (por defecto, sílabas sintéticas).")
+    llm = parser.add_argument_group("LLM")
+    llm.add_argument("--ollama", help="URL de un Ollama de verdad en lugar de fake_ollama.")
+    llm.add_argument("--record", help="Con --ollama: graba las respuestas en este JSONL para --replay.")
+    llm.add_argument("--replay", help="Reproduce las respuestas grabadas en este JSONL.")
+    llm.add_argument("--ttft", type=float, default=0.3, help="Sintético: segundos hasta el primer token.")
+    llm.add_argument("--tps", type=float, default=25.0, help="Sintético: tokens por segundo.")
+    llm.add_argument("--tokens", type=int, default=40, help="Sintético: tokens por respuesta.")
+    llm.add_argument("--jitter", type=float, default=0.2, help="Sintético: variación relativa de los tiempos.")
+    llm.add_argument("--seed", type=int, default=0)
+    llm.add_argument("--speed", type=float, default=1.0, help="Factor de velocidad de los tiempos sintéticos o reproducidos.")
+    llm.add_argument("--load", type=float, default=0.0, help="Sintético: segundos de carga del modelo en la primera petición.")
+    parser.add_argument("--jsonl", help="Guarda también el registro de cada turno en este JSONL.")
+    parser.add_argument("--out", default="bench_pipeline.json", help="Fichero JSON para los resultados.")
+    parser.add_argument("--compare", default=None, help="JSON de resultados anteriores con el que comparar.")
+    args = parser.parse_args()
+    if args.record and not args.ollama:
+        parser.error("--record necesita --ollama (el servidor que se graba)")
+    if args.replay and args.ollama:
+        parser.error("--replay y --ollama no se pueden usar juntos")
+
+    conversations = load_conversations(args.conversations) if args.conversations else CONVERSATIONS
+    with tempfile.TemporaryDirectory() as tmp:
+        samples_dir = args.samples
+        if samples_dir is None and args.pipeline != "texto":
+            from bench_voice import synthetic_samples
+
+            samples_dir = tmp
+            synthetic_samples(samples_dir)
+        result = run(args, conversations, samples_dir)
+
+    print_report(result)
+    if "llm_server" in result:
+        print(f"Servidor del LLM: {result['llm_server']}")
+
+    from bench_voice import metadata
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump({"meta": metadata(), "results": result}, f, indent=2, ensure_ascii=False)
+    print(f"Guardado en {args.out}")
+
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == "__main__":
+    main()
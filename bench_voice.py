@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+bench_voice.py
+
+Mediciones de la síntesis de voz (animalese_like). No necesita tarjeta de sonido: solo genera el
+audio en memoria.
+
+Mide, para textos desde una palabra hasta varios miles de caracteres:
+  - caracteres por segundo y factor de tiempo real (segundos de audio por segundo de CPU)
+  - pico de memoria trazada (tracemalloc) y bytes trazados por carácter
+además del coste por llamada de change_pitch() y de load_samples() con la caché fría y caliente.
+
+Por defecto usa muestras sintéticas para que funcione en cualquier sitio; con --samples audios usa
+los .m4a del repositorio (necesita ffmpeg). Los resultados se guardan en JSON para comparar
+ejecuciones con --compare.
+
+Uso:
+  python bench_voice.py --out bench_results.json
+  python bench_voice.py --samples audios --out new.json --compare bench_results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import animalese_like
+
+LENGTHS = (4, 50, 500, 2000, 5000)
+_WORDS = "hola como estas hoy quiero contarte algo muy bonito sobre el bosque y los animales".split()
+
+
+def make_text(length: int) -> str:
+    words = []
+    while len(" ".join(words)) < length:
+        words.append(_WORDS[len(words) % len(_WORDS)])
+    return " ".join(words)[:length]
+
+
+def synthetic_samples(folder: str, count: int = 5):
+    """Escribe count sílabas tonales cortas en WAV, para que load_samples() funcione sin ffmpeg."""
+    rng = np.random.default_rng(0)
+    for i in range(count):
+        t = np.arange(int(animalese_like.SAMPLE_RATE * 0.12)) / animalese_like.SAMPLE_RATE
+        tone = np.sin(2 * np.pi * (220 + 60 * i) * t) * np.hanning(len(t))
+        pcm = (tone * 12000 + rng.normal(0, 300, len(t))).astype(np.int16)
+        animalese_like.pcm_to_segment(pcm).export(os.path.join(folder, f"s{i}.wav"), format="wav")
+
+
+def timed(fn, repeat: int):
+    """Mediana del tiempo de fn() en repeat ejecuciones, y el último resultado."""
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def traced(fn):
+    """Pico de memoria trazada de una llamada a fn()."""
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base, _ = tracemalloc.get_traced_memory()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak - base
+
+
+def bench_render(samples, repeat: int) -> list:
+    bank = animalese_like.PitchBank(samples, step=0.25)
+    bank.prerender(4)
+    engines = {
+        "text_to_animalese": lambda text: animalese_like.text_to_animalese(
+            text, samples, pitch_range_semitones=4, gap_ms=10, seed=1).raw_data,
+        "render_animalese": lambda text: animalese_like.render_animalese(
+            text, samples, pitch_range_semitones=4, gap_ms=10, seed=1),
+        "render_animalese+bank": lambda text: animalese_like.render_animalese(
+            text, samples, pitch_range_semitones=4, gap_ms=10, seed=1, pitch_bank=bank),
+    }
+    results = []
+    for name, render in engines.items():
+        for length in LENGTHS:
+            text = make_text(length)
+            # Menos repeticiones para los textos largos
+            runs = max(1, repeat if length <= 500 else repeat // 3)
+            seconds, out = timed(lambda: render(text), runs)
+            audio_s = len(out) / 2 / animalese_like.SAMPLE_RATE if isinstance(out, bytes) \
+                else len(out) / animalese_like.SAMPLE_RATE
+            peak = traced(lambda: render(text))
+            results.append({
+                "case": name,
+                "chars": length,
+                "seconds": seconds,
+                "chars_per_s": length / seconds,
+                "realtime_factor": audio_s / seconds,
+                "peak_bytes": peak,
+                "alloc_bytes_per_char": peak / length,
+            })
+    return results
+
+
+def bench_change_pitch(samples, repeat: int) -> dict:
+    calls = 200
+    rng = np.random.default_rng(1)
+    shifts = rng.uniform(-4, 4, calls)
+
+    def run():
+        for i, semitone in enumerate(shifts):
+            animalese_like.change_pitch(samples[i % len(samples)], semitone)
+
+    seconds, _ = timed(run, repeat)
+    return {"case": "change_pitch", "calls": calls, "seconds": seconds, "us_per_call": seconds / calls * 1e6}
+
+
+def bench_load_samples(folder: str, repeat: int) -> list:
+    with tempfile.TemporaryDirectory() as cache_dir:
+        def cold():
+            for entry in os.listdir(cache_dir):
+                os.remove(os.path.join(cache_dir, entry))
+            return animalese_like.load_samples(folder, cache_dir=cache_dir)
+
+        cold_s, _ = timed(cold, repeat)
+        uncached_s, _ = timed(lambda: animalese_like.load_samples(folder, use_cache=False), repeat)
+        warm_s, _ = timed(lambda: animalese_like.load_samples(folder, cache_dir=cache_dir), repeat)
+    return [
+        {"case": "load_samples (sin caché)", "seconds": uncached_s},
+        {"case": "load_samples (caché fría)", "seconds": cold_s},
+        {"case": "load_samples (caché caliente)", "seconds": warm_s},
+    ]
+
+
+def metadata() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(results: list, baseline_path: str):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["case"], r.get("chars")): r for r in json.load(f)["results"]}
+    print(f"\nfrente a {baseline_path} (>1.00 = ahora más rápido)")
+    for r in results:
+        old = baseline.get((r["case"], r.get("chars")))
+        if old:
+            label = r["case"] + (f" [{r['chars']}]" if "chars" in r else "")
+            print(f"  {label:40s} {old['seconds'] / r['seconds']:6.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mide la síntesis de voz animalese.")
+    parser.add_argument("--samples", default=None, help="Carpeta de muestras (por defecto, muestras sintéticas).")
+    parser.add_argument("--repeat", type=int, default=5, help="Ejecuciones por caso; se da la mediana.")
+    parser.add_argument("--out", default="bench_results.json", help="Fichero JSON para los resultados.")
+    parser.add_argument("--compare", default=None, help="JSON de resultados anteriores con el que comparar.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = args.samples
+        if folder is None:
+            folder = tmp
+            synthetic_samples(folder)
+        samples = animalese_like.load_samples(folder, use_cache=False)
+        results = bench_render(samples, args.repeat)
+        results.append(bench_change_pitch(samples, args.repeat))
+        results.extend(bench_load_samples(folder, args.repeat))
+
+    for r in results:
+        if "chars" in r:
+            print(f"{r['case']:24s} {r['chars']:6d} car.  {r['chars_per_s']:10.0f} car./s  "
+                  f"RTF {r['realtime_factor']:8.1f}x  pico {r['peak_bytes'] / 1024:9.0f} KiB  "
+                  f"{r['alloc_bytes_per_char']:8.0f} B/car.")
+        elif "us_per_call" in r:
+            print(f"{r['case']:24s} {r['us_per_call']:10.1f} us/llamada")
+        else:
+            print(f"{r['case']:30s} {r['seconds'] * 1000:8.1f} ms")
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump({"meta": metadata(), "results": results}, f, indent=2)
+    print(f"Guardado en {args.out}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
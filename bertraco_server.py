@@ -0,0 +1,451 @@
+"""
+bertraco_server.py
+
+BERTraco sin ventana: un backend en una máquina compartida que atiende a muchos clientes ligeros
+por HTTP.
+
+Se elige una de las tres cadenas (--pipeline texto | voz | traduccion), que se carga una sola vez
+(LLM, cachés, voz, traductores). Cada conexión de eventos abre su propia sesión: su historial, su
+cara (HeadlessFace) y, con voz, su stream de audio. La sesión ejecuta el mismo ChatPipeline
+(chat_pipeline.py) que la ventana, así que la GUI es solo otro cliente del mismo núcleo.
+
+API (los eventos van por Server-Sent Events; cada "data" es JSON):
+  GET  /events[?audio=1]          abre una sesión ligada a esta conexión y emite sus eventos.
+                                  La sesión se cierra al cortarse la conexión.
+  POST /sessions/<id>/messages    {"text": "..."}: mensaje del usuario para esa sesión.
+  POST /sessions/<id>/cancel      corta la respuesta en curso de esa sesión (como Escape en la
+                                  ventana): deja de generar, de traducir y de sonar.
+  GET  /health                    estado del servidor y estadísticas (con las del planificador:
+                                  turnos en vuelo, cola y tiempo de espera).
+  GET  /metrics                   métricas por turno de todas las sesiones en formato de texto de
+                                  Prometheus (turn_metrics.py), más el estado del planificador.
+
+Las sesiones comparten el LLM a través de un FairScheduler (llm_scheduler.py): como mucho
+BERTRACO_LLM_CONCURRENCY generaciones a la vez, repartidas por turnos entre sesiones. Un mensaje
+se rechaza al llegar con 429 si su sesión ya tiene BERTRACO_SERVER_MAX_PENDING pendientes, o con
+503 si el servidor tiene BERTRACO_SERVER_MAX_QUEUE; ambos con Retry-After.
+
+Eventos: "session" ({"id", "pipeline", "audio"}), "state" ({"state": idle/thinking/speaking/
+sleeping}), "user_message", "message_start", "token" ({"text"}), "message_end",
+"turn_cancelled" y, con
+?audio=1 en las cadenas con voz, "audio" ({"pcm": base64}), PCM s16le mono al ritmo real de
+reproducción. Cada PING_S segundos sin eventos se manda un comentario para mantener la conexión.
+
+Uso:
+  python bertraco_server.py --pipeline voz --port 8765
+  curl -N "http://127.0.0.1:8765/events"
+  curl -d '{"text": "hola"}' http://127.0.0.1:8765/sessions/<id>/messages
+"""
+
+import argparse
+import base64
+import importlib
+import json
+import os
+import queue
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from chat_pipeline import MessageQueue
+from headless_face import HeadlessFace
+from llm_scheduler import FairScheduler, Overloaded, ScheduledLLM, current_session
+from model_warmup import ModelWarmer
+
+# Nombre de la cadena -> script de entrada que la implementa
+PIPELINES = {"texto": "BERTraco", "voz": "BERTraco_voice", "traduccion": "BERTraco_voice_translate"}
+
+SERVIDOR_HOST = os.environ.get("BERTRACO_SERVER_HOST", "127.0.0.1")
+SERVIDOR_PUERTO = int(os.environ.get("BERTRACO_SERVER_PORT", "8765"))
+MAX_SESIONES = int(os.environ.get("BERTRACO_SERVER_MAX_SESSIONS", "16"))
+# Planificador del LLM: generaciones simultáneas (igual que BERTRACO_LLM_CONCURRENCY, que usa
+# el cliente de Ollama), mensajes pendientes en total y por sesión antes de rechazar
+MAX_COLA = int(os.environ.get("BERTRACO_SERVER_MAX_QUEUE", "32"))
+MAX_PENDIENTES_SESION = int(os.environ.get("BERTRACO_SERVER_MAX_PENDING", "2"))
+MAX_MENSAJE_BYTES = 16 * 1024
+PING_S = 15.0
+# Sin mensajes de ningún cliente durante este tiempo, el servidor "se duerme" y deja de renovar
+# el keep_alive del modelo (como la cara de la ventana, pero con más margen)
+REPOSO_SERVIDOR_S = 300.0
+
+_CLOSE = object()  # fin del stream de eventos de una sesión
+
+
+class _TurnQueue(MessageQueue):
+    """
+    Cola de mensajes de una sesión. ChatPipeline atiende un mensaje detrás de otro, así que cuando
+    pide el siguiente, el anterior ya está terminado y se descuenta del planificador.
+    """
+
+    def __init__(self, on_done):
+        super().__init__()
+        self.on_done = on_done
+        self._taken = False
+
+    def get(self, block=True, timeout=None):
+        if self._taken:
+            self._taken = False
+            self.on_done()
+        item = super().get(block, timeout)
+        self._taken = item is not None
+        return item
+
+
+class Session:
+    """Una conversación: su cara sin ventana, su ChatPipeline y, con voz, su audio."""
+
+    def __init__(self, server, audio: bool):
+        self.id = uuid.uuid4().hex[:12]
+        self.server = server
+        self.audio = audio and server.voice
+        self.events = queue.Queue()
+        self.messages = _TurnQueue(on_done=lambda: server.scheduler.done(self.id))
+        self.face = HeadlessFace(emit=self.emit)
+        self.audio_out = None
+        self.closed = False
+
+        pipeline = server.pipeline
+        if server.voice:
+            from audio_stream import AudioOutputStream
+
+            # Stream propio por sesión: marca el ritmo del texto igual que en la ventana y, si el
+            # cliente lo pide, le manda cada bloque en lugar de reproducirlo
+            self.audio_out = AudioOutputStream(
+                sample_rate=pipeline.animalese_like.SAMPLE_RATE,
+                backend=self._send_audio if self.audio else "null",
+            ).start()
+        self.chat = pipeline.make_pipeline(self.face, self.audio_out, server.warmer)
+        self._thread = threading.Thread(target=self._run_chat, name=f"chat-{self.id}", daemon=True)
+        self._thread.start()
+
+    def _run_chat(self):
+        # Todo lo que este hilo (y las etapas que lanza) pida al LLM cuenta como de esta sesión
+        current_session.set(self.id)
+        self.chat.run(self.messages)
+
+    def emit(self, event, data):
+        self.events.put((event, data))
+
+    def _send_audio(self, pcm: bytes):
+        self.emit("audio", {"pcm": base64.b64encode(pcm).decode("ascii")})
+
+    def describe(self) -> dict:
+        audio = None
+        if self.audio:
+            audio = {"sample_rate": self.audio_out.sample_rate, "channels": 1, "format": "s16le"}
+        return {"id": self.id, "pipeline": self.server.pipeline_name, "audio": audio,
+                "state": self.face.state}
+
+    def send(self, text: str):
+        self.emit("user_message", {"text": text})
+        self.messages.put(text)
+
+    def cancel(self) -> bool:
+        """Corta la respuesta en curso. False si no había ninguna."""
+        if not self.chat.cancel():
+            return False
+        self.emit("turn_cancelled", {})
+        return True
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.chat.cancel()
+        self.messages.put(None)
+        self.events.put((_CLOSE, None))
+        # El turno en curso termina antes de soltar el audio y la cara
+        threading.Thread(target=self._finish, name=f"cierre-{self.id}", daemon=True).start()
+
+    def _finish(self):
+        self._thread.join(timeout=300)
+        if self.audio_out:
+            self.audio_out.close()
+        self.face.close()
+
+
+class BertracoServer:
+    def __init__(self, pipeline_name: str, max_sessions: int = MAX_SESIONES):
+        self.pipeline_name = pipeline_name
+        self.pipeline = importlib.import_module(PIPELINES[pipeline_name])
+        # Se sabe tras init_runtime(): hay voz si la cadena la tiene y se cargaron las muestras
+        self.voice = False
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self.warmer = None
+        # Cara del servidor: no la ve nadie, pero ModelWarmer la usa para saber si hay actividad,
+        # y mientras piensa (cargando el modelo) las sesiones también aparecen pensando
+        self.face = HeadlessFace(emit=self._on_server_event, sleep_timeout_s=REPOSO_SERVIDOR_S)
+        from ollama_client import llm_concurrency
+        self.scheduler = FairScheduler(max_concurrent=llm_concurrency(), max_queue_depth=MAX_COLA,
+                                       max_session_depth=MAX_PENDIENTES_SESION)
+        self.counters = {"sessions": 0, "messages": 0, "rejected": 0}
+        self._thinking = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Carga lo pesado de la cadena y empieza a calentar el modelo."""
+        profiler = self.pipeline.profiler
+        self.face.start_thinking()
+        with profiler.step("inicialización"):
+            self.pipeline.init_runtime()
+        profiler.mark("listo para servir")
+        self.voice = bool(getattr(self.pipeline, "animalese_samples", None))
+        llm = self.pipeline.llm
+        # Los ChatPipeline usan el llm global de la cadena: se sustituye por uno que pasa por el
+        # planificador. El calentamiento no hace cola.
+        self.pipeline.llm = ScheduledLLM(llm, self.scheduler)
+        prefijo = getattr(self.pipeline, "prefijo_prompt", None) or getattr(self.pipeline, "prefijo_prompt_en", None)
+        self.warmer = ModelWarmer(llm, self.face,
+                                  prime_messages=prefijo.messages if prefijo.enabled else None).start()
+        return self
+
+    def _on_server_event(self, event, data):
+        if event != "state":
+            return
+        thinking = data["state"] == "thinking"
+        with self._lock:
+            if thinking == self._thinking:
+                return
+            self._thinking = thinking
+            sessions = list(self.sessions.values())
+        for session in sessions:
+            if thinking:
+                session.face.start_thinking()
+            else:
+                session.face.stop_thinking()
+
+    # -------------------- Sesiones --------------------
+    def open_session(self, audio: bool):
+        with self._lock:
+            if len(self.sessions) >= self.max_sessions:
+                self.counters["rejected"] += 1
+                return None
+            session = Session(self, audio)
+            self.sessions[session.id] = session
+            self.counters["sessions"] += 1
+        if self.face.thinking:
+            session.face.start_thinking()
+        return session
+
+    def get_session(self, session_id: str):
+        with self._lock:
+            return self.sessions.get(session_id)
+
+    def close_session(self, session_id: str):
+        with self._lock:
+            session = self.sessions.pop(session_id, None)
+        if session:
+            session.close()
+            self.scheduler.forget(session_id)
+
+    def send(self, session, text: str):
+        """Encola el mensaje o lanza Overloaded si la sesión o el servidor van sobrecargados."""
+        self.scheduler.admit(session.id)
+        with self._lock:
+            self.counters["messages"] += 1
+        self.face.wake_up()
+        session.send(text)
+
+    def close(self):
+        with self._lock:
+            ids = list(self.sessions)
+        for session_id in ids:
+            self.close_session(session_id)
+        if self.warmer:
+            self.warmer.stop()
+        self.face.close()
+
+    def stats(self) -> dict:
+        llm = self.pipeline.llm
+        with self._lock:
+            stats = dict(self.counters, active_sessions=len(self.sessions))
+        stats["pipeline"] = self.pipeline_name
+        stats["model_warm"] = bool(self.warmer and self.warmer.warm.is_set())
+        stats["scheduler"] = self.scheduler.stats()
+        if hasattr(llm, "stats"):
+            stats["llm"] = llm.stats()
+        return stats
+
+    def print_stats(self):
+        """Estadísticas al apagar, como al cerrar la ventana en los scripts de entrada."""
+        print(f"Servidor: {self.stats()}")
+        if self.warmer:
+            print(f"Calentamiento del modelo: {self.warmer.stats()}")
+        for label, name in (("Métricas por turno", "metricas"),
+                            ("Caché de respuestas", "cache_respuestas"),
+                            ("Caché de traducciones", "cache_traducciones"),
+                            ("Traducción", "servicio_traduccion")):
+            component = getattr(self.pipeline, name, None)
+            if component:
+                print(f"{label}: {component.stats()}")
+                component.close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "BERTraco"
+
+    @property
+    def app(self) -> BertracoServer:
+        return self.server.app
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_event(self, event, data):
+        payload = json.dumps(data, ensure_ascii=False)
+        self.wfile.write(f"event: {event}\ndata: {payload}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def do_OPTIONS(self):
+        self.send_response(204)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", "Content-Type")
+        self.end_headers()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/health":
+            self._send_json(200, self.app.stats())
+        elif url.path == "/metrics":
+            self._send_metrics()
+        elif url.path == "/events":
+            audio = parse_qs(url.query).get("audio", ["0"])[0] == "1"
+            self._stream_events(audio)
+        else:
+            self._send_json(404, {"error": "ruta desconocida"})
+
+    def do_POST(self):
+        parts = urlparse(self.path).path.strip("/").split("/")
+        if len(parts) != 3 or parts[0] != "sessions" or parts[2] not in ("messages", "cancel"):
+            self._send_json(404, {"error": "ruta desconocida"})
+            return
+        session = self.app.get_session(parts[1])
+        if session is None:
+            self._send_json(404, {"error": "sesión desconocida"})
+            return
+        if parts[2] == "cancel":
+            self._send_json(200, {"session": session.id, "cancelled": session.cancel()})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_MENSAJE_BYTES:
+            self._send_json(413, {"error": "mensaje demasiado largo"})
+            return
+        try:
+            text = json.loads(self.rfile.read(length) or b"{}").get("text", "")
+        except (ValueError, AttributeError):
+            self._send_json(400, {"error": "se esperaba JSON con el campo text"})
+            return
+        if not isinstance(text, str) or not text.strip():
+            self._send_json(400, {"error": "mensaje vacío"})
+            return
+        try:
+            self.app.send(session, text)
+        except Overloaded as e:
+            # 429 si es esta sesión la que va cargada, 503 si es todo el servidor
+            self._send_json(429 if e.scope == "session" else 503,
+                            {"error": str(e), "retry_after_s": e.retry_after_s},
+                            headers={"Retry-After": str(int(e.retry_after_s + 0.999))})
+            return
+        self._send_json(202, {"session": session.id, "queued": session.messages.qsize()})
+
+    def _send_metrics(self):
+        metrics = getattr(self.app.pipeline, "metricas", None)
+        if metrics is None:
+            self._send_json(404, {"error": "métricas desactivadas (BERTRACO_METRICS=0)"})
+            return
+        scheduler = self.app.scheduler.stats()
+        gauges = {"active_sessions": len(self.app.sessions), "llm_in_flight": scheduler["in_flight"],
+                  "llm_waiting": scheduler["waiting"], "messages_pending": scheduler["pending"]}
+        body = metrics.prometheus_text(gauges).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream_events(self, audio):
+        session = self.app.open_session(audio)
+        if session is None:
+            self._send_json(503, {"error": "demasiadas sesiones abiertas"})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        try:
+            self._send_event("session", session.describe())
+            while True:
+                try:
+                    event, data = session.events.get(timeout=PING_S)
+                except queue.Empty:
+                    self.wfile.write(b": ping\n\n")
+                    self.wfile.flush()
+                    continue
+                if event is _CLOSE:
+                    break
+                self._send_event(event, data)
+        except OSError:
+            pass  # el cliente cortó la conexión
+        finally:
+            self.app.close_session(session.id)
+
+    def log_message(self, format, *args):
+        # Sin una línea por cada petición: solo los errores
+        pass
+
+    def log_error(self, format, *args):
+        print(f"HTTP {self.address_string()}: {format % args}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BERTraco sin ventana: chat, voz y estado de la cara por HTTP (SSE)")
+    parser.add_argument("--pipeline", choices=sorted(PIPELINES), default="texto",
+                        help="Cadena que se sirve: texto, voz (animalese) o traduccion (es <-> en con voz)")
+    parser.add_argument("--host", default=SERVIDOR_HOST)
+    parser.add_argument("--port", type=int, default=SERVIDOR_PUERTO)
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Muestra cuánto tarda cada importación y paso del arranque")
+    args = parser.parse_args()
+
+    # El stream de audio global de la cadena no suena en el servidor: cada sesión tiene el suyo
+    os.environ.setdefault("BERTRACO_AUDIO", "null")
+    app = BertracoServer(args.pipeline)
+    try:
+        app.start()
+    except (Exception, SystemExit) as e:
+        print(f"Error al inicializar: {e}")
+        return
+    if args.profile_startup:
+        print(f"Perfil de arranque:\n{app.pipeline.profiler.report()}")
+
+    httpd = ThreadingHTTPServer((args.host, args.port), _Handler)
+    httpd.daemon_threads = True
+    httpd.app = app
+    print(f"BERTraco ({args.pipeline}) escuchando en http://{args.host}:{httpd.server_port}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        app.close()
+        app.print_stats()
+        audio_out = getattr(app.pipeline, "audio_out", None)
+        if audio_out:
+            audio_out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,18 @@
 import tkinter as tk
 from tkinter import scrolledtext
 import random
+import threading
 import time
+from collections import deque
 
 class MiniFace(tk.Tk):
+    STATES = ("idle", "thinking", "speaking", "sleeping")
+
     def __init__(self, send_queue):
         super().__init__()
         self.send_queue = send_queue
+        # Lo llama Escape para cortar la respuesta en curso (lo asigna el script de entrada)
+        self.on_cancel = None
         # --- Constantes de Configuración de la Cara ---
         self.CANVAS_WIDTH = 200
         self.CANVAS_HEIGHT = 200
@@ -27,7 +33,18 @@ class MiniFace(tk.Tk):
         self.TONGUE_COORDS = (85, 135, 115, 170)
 
         # Parámetros de Animación
-        self.ANIMATION_INTERVAL_MS = 500
+        # Cada estado tiene su propio ritmo de frames. En reposo no hay frames fijos: el bucle
+        # solo se despierta para la siguiente animación o para dormirse.
+        self.SPEAKING_FRAME_MS = 150
+        self.THINKING_FRAME_MS = 300
+        # Dormida, una Z cada SLEEP_Z_INTERVAL_MS que sube en Z_STEPS pasos de Z_FRAME_MS; entre
+        # Z y Z la cara no se despierta
+        self.SLEEP_Z_INTERVAL_MS = 30000
+        self.Z_FRAME_MS = 500
+        self.Z_STEPS = 5
+        self.Z_POOL_SIZE = 1
+        self.FRAME_STATS_WINDOW = 500 # Frames recientes que se guardan por estado
+        self.TRANSCRIPT_FLUSH_MS = 33 # Texto del asistente: como mucho una inserción por frame
         self.IDLE_DELAY_MIN_S = 1.5
         self.IDLE_DELAY_MAX_S = 5.0
         self.SLEEP_TIMEOUT_S = 10.0 # Tiempo de inactividad para dormir
@@ -47,6 +64,7 @@ class MiniFace(tk.Tk):
         self.input_entry = tk.Entry(input_frame, width=40)
         self.input_entry.pack(side=tk.LEFT, fill="x", expand=True)
         self.input_entry.bind("<Return>", self.send_message)
+        self.bind("<Escape>", self.cancel_turn)
 
         send_button = tk.Button(input_frame, text="Enviar", command=self.send_message)
         send_button.pack(side=tk.RIGHT)
@@ -58,17 +76,56 @@ class MiniFace(tk.Tk):
         self.pupil1 = self.canvas.create_oval(*self.PUPIL1_COORDS, fill="black")
         self.pupil2 = self.canvas.create_oval(*self.PUPIL2_COORDS, fill="black")
 
-        # Boca (línea simple cuando está cerrada)
+        # Boca: línea cuando está cerrada y óvalo cuando está abierta. Los dos items se crean una
+        # sola vez y se alternan con itemconfig/coords, nunca se borran.
         self.mouth = self.canvas.create_line(self.MOUTH_X1, self.MOUTH_Y, self.MOUTH_X2, self.MOUTH_Y, width=3)
+        self.mouth_open = self.canvas.create_oval(
+            self.MOUTH_X1, self.MOUTH_Y, self.MOUTH_X2, self.MOUTH_OPEN_HEIGHT, fill="black", state='hidden'
+        )
         
         # Lengua (oculta inicialmente)
         self.tongue = self.canvas.create_oval(*self.TONGUE_COORDS, fill="pink", outline="red", state='hidden')
 
+        # Zs de dormir: un conjunto fijo de items ocultos que se reutilizan
+        self.z_pool = [
+            self.canvas.create_text(0, 0, text="Z", font=("Arial", 12), state='hidden')
+            for _ in range(self.Z_POOL_SIZE)
+        ]
+
+        self.mouth_is_open = False
         self.speaking = False
         self.sleeping = False # Nuevo estado para dormir
-        self.z_particles = [] # Para almacenar las Zs
+        self.thinking = False # Cargando el modelo: no se duerme hasta que termine
+        self._thinking_phase = 0
+        self.z_particles = [] # Zs visibles en este momento
         self.last_activity_time = time.time()
         self.idle_delay = self.IDLE_DELAY_MIN_S
+        self.next_idle_time = self.last_activity_time + self.idle_delay
+
+        # Un único callback de frame pendiente y un único efecto (parpadeo, lengua...) a la vez
+        self._frame_job = None
+        self._frame_due = None
+        self._effect_job = None
+        self._effect_restore = None
+
+        # Estadísticas de coste de los frames en el hilo de la GUI, por estado
+        self.frame_times_ms = {state: deque(maxlen=self.FRAME_STATS_WINDOW) for state in self.STATES}
+        self.frame_lag_ms = deque(maxlen=self.FRAME_STATS_WINDOW)
+        self.wakeups = 0
+        # Despertares del bucle y segundos dormida, para la tasa de despertares al dormir
+        self.sleep_wakeups = 0
+        self.sleep_time_s = 0.0
+        self._sleep_started = None
+
+        # Buffer del texto que llega en streaming desde otros hilos
+        self._transcript_lock = threading.Lock()
+        self._transcript_pending = []
+        self._transcript_first_at = None
+        self._transcript_flush_scheduled = False
+        self.transcript_chunks = 0
+        self.transcript_flushes = 0
+        self.transcript_latency_ms = deque(maxlen=self.FRAME_STATS_WINDOW)
+        self.transcript_latency_total_ms = 0.0
 
         self.animation_loop()
 
@@ -80,8 +137,14 @@ class MiniFace(tk.Tk):
             self.display_message("Tú", msg)
             self.input_entry.delete(0, tk.END)
 
+    def cancel_turn(self, event=None):
+        """Corta la respuesta que se está generando (Escape)."""
+        if self.on_cancel:
+            self.on_cancel()
+
     def display_message(self, sender, message):
         """Muestra un mensaje en el widget de chat."""
+        self.flush_transcript()
         self.chat_display.config(state='normal')
         self.chat_display.insert(tk.END, f"{sender}: {message}\n")
         self.chat_display.config(state='disabled')
@@ -89,6 +152,7 @@ class MiniFace(tk.Tk):
 
     def start_assistant_message(self):
         """Prepara el display para un nuevo mensaje del asistente."""
+        self.flush_transcript()
         self.chat_display.config(state='normal')
         self.chat_display.insert(tk.END, "Asistente: ")
         self.chat_display.config(state='disabled')
@@ -102,36 +166,174 @@ class MiniFace(tk.Tk):
 
     def end_assistant_message(self):
         """Finaliza el mensaje del asistente con un salto de línea."""
+        self.flush_transcript()
         self.chat_display.config(state='normal')
         self.chat_display.insert(tk.END, "\n")
         self.chat_display.config(state='disabled')
         self.chat_display.yview(tk.END)
 
+    def post_assistant_text(self, chunk):
+        """
+        Versión para llamar desde otros hilos de append_assistant_message: el fragmento se
+        acumula y el hilo de la GUI lo inserta junto con los demás, una vez por frame, en lugar de
+        programar un callback por cada fragmento.
+        """
+        with self._transcript_lock:
+            self._transcript_pending.append(chunk)
+            self.transcript_chunks += 1
+            if self._transcript_flush_scheduled:
+                return
+            self._transcript_flush_scheduled = True
+            self._transcript_first_at = time.perf_counter()
+        # after() fuera del lock: desde otro hilo espera al hilo de la GUI, que también usa el lock
+        self.after(self.TRANSCRIPT_FLUSH_MS, self.flush_transcript)
+
+    def flush_transcript(self):
+        """Inserta todo el texto acumulado con una sola inserción y un solo scroll."""
+        with self._transcript_lock:
+            self._transcript_flush_scheduled = False
+            if not self._transcript_pending:
+                return
+            text = "".join(self._transcript_pending)
+            self._transcript_pending = []
+            first_at = self._transcript_first_at
+            self.transcript_flushes += 1
+        self.append_assistant_message(text)
+        latency_ms = (time.perf_counter() - first_at) * 1000
+        self.transcript_latency_ms.append(latency_ms)
+        self.transcript_latency_total_ms += latency_ms
+
+    def transcript_stats(self):
+        """Fragmentos recibidos, inserciones hechas y retraso desde el fragmento hasta pantalla."""
+        latencies = list(self.transcript_latency_ms)
+        return {
+            "chunks": self.transcript_chunks,
+            "flushes": self.transcript_flushes,
+            "callbacks_avoided": self.transcript_chunks - self.transcript_flushes,
+            "mean_latency_ms": sum(latencies) / len(latencies) if latencies else 0.0,
+            "max_latency_ms": max(latencies) if latencies else 0.0,
+            "total_latency_ms": self.transcript_latency_total_ms,
+        }
+
+    # -------------------- Máquina de estados --------------------
+    @property
+    def state(self):
+        if self.speaking:
+            return "speaking"
+        if self.thinking:
+            return "thinking"
+        if self.sleeping:
+            return "sleeping"
+        return "idle"
+
+    def _schedule(self, delay_ms):
+        """Programa el siguiente frame, sustituyendo al que hubiera pendiente."""
+        if self._frame_job is not None:
+            self.after_cancel(self._frame_job)
+        delay_ms = max(0, int(delay_ms))
+        self._frame_due = time.perf_counter() + delay_ms / 1000.0
+        self._frame_job = self.after(delay_ms, self.animation_loop)
+
+    def _start_effect(self, duration_ms, restore):
+        """
+        Ejecuta restore() tras duration_ms. Solo hay un efecto activo: si ya había uno, se
+        restaura antes de empezar el nuevo para que no se pisen.
+        """
+        self._end_effect()
+        self._effect_restore = restore
+        self._effect_job = self.after(duration_ms, self._end_effect)
+
+    def _end_effect(self):
+        if self._effect_job is not None:
+            self.after_cancel(self._effect_job)
+            self._effect_job = None
+        restore, self._effect_restore = self._effect_restore, None
+        if restore is not None:
+            restore()
+
+    def _set_mouth_open(self, is_open, width_offset=0):
+        if is_open:
+            self.canvas.coords(self.mouth_open, self.MOUTH_X1 + width_offset, self.MOUTH_Y,
+                               self.MOUTH_X2 - width_offset, self.MOUTH_OPEN_HEIGHT)
+            self.canvas.itemconfig(self.mouth_open, state='normal')
+            self.canvas.itemconfig(self.mouth, state='hidden')
+        else:
+            self.canvas.itemconfig(self.mouth_open, state='hidden')
+            self.canvas.itemconfig(self.mouth, state='normal')
+        self.mouth_is_open = is_open
+
+    def frame_stats(self):
+        """Coste de los frames en el hilo de la GUI (ms) por estado, y retraso de los callbacks."""
+        def summary(values):
+            if not values:
+                return {"frames": 0}
+            ordered = sorted(values)
+            return {
+                "frames": len(ordered),
+                "mean_ms": sum(ordered) / len(ordered),
+                "p95_ms": ordered[int(0.95 * (len(ordered) - 1))],
+                "max_ms": ordered[-1],
+            }
+        stats = {state: summary(times) for state, times in self.frame_times_ms.items()}
+        stats["lag"] = summary(self.frame_lag_ms)
+        stats["wakeups"] = self.wakeups
+        asleep_s = self.sleep_time_s
+        if self._sleep_started is not None:
+            asleep_s += time.time() - self._sleep_started
+        stats["sleep"] = {
+            "wakeups": self.sleep_wakeups,
+            "seconds": asleep_s,
+            "wakeups_per_s": self.sleep_wakeups / asleep_s if asleep_s else 0.0,
+        }
+        return stats
+
     def wake_up(self):
         """Despierta la cara si está durmiendo."""
         if self.sleeping:
             self.stop_sleeping()
         self.last_activity_time = time.time()
+        self.next_idle_time = self.last_activity_time + self.idle_delay
+        self._schedule(0)
 
     def start_speaking(self):
         self.wake_up()
+        self._end_effect()
         self.speaking = True
+        self._schedule(0)
 
     def stop_speaking(self):
         self.speaking = False
         self.last_activity_time = time.time()
+        self.next_idle_time = self.last_activity_time + self.idle_delay
         # Restaurar boca y ojos a estado neutral
-        self.canvas.delete(self.mouth)
-        self.mouth = self.canvas.create_line(self.MOUTH_X1, self.MOUTH_Y, self.MOUTH_X2, self.MOUTH_Y, width=3)
+        self._set_mouth_open(False)
         self.reset_eyes()
+        self._schedule(0)
+
+    def start_thinking(self):
+        """Ojos entrecerrados mirando a los lados, p. ej. mientras se carga el modelo."""
+        self.wake_up()
+        self._end_effect()
+        self.thinking = True
+        self._thinking_phase = 0
+        self._schedule(0)
+
+    def stop_thinking(self):
+        self.thinking = False
+        self.last_activity_time = time.time()
+        self.next_idle_time = self.last_activity_time + self.idle_delay
+        self.reset_eyes()
+        self._schedule(0)
 
     def start_sleeping(self):
         """Inicia la animación de dormir."""
         if self.speaking:
             self.stop_speaking()
+        self._end_effect()
         
         self.speaking = False
         self.sleeping = True
+        self._sleep_started = time.time()
         
         # Cerrar los ojos (como en blink)
         eye1_closed_coords = (self.EYE1_COORDS[0], self.EYE1_COORDS[1] + 15, self.EYE1_COORDS[2], self.EYE1_COORDS[1] + 15)
@@ -140,12 +342,16 @@ class MiniFace(tk.Tk):
         self.canvas.coords(self.eye2, *eye2_closed_coords)
         self.canvas.itemconfig(self.pupil1, state='hidden')
         self.canvas.itemconfig(self.pupil2, state='hidden')
+        self._schedule(0)
 
     def stop_sleeping(self):
         """Detiene la animación de dormir."""
         self.sleeping = False
+        if self._sleep_started is not None:
+            self.sleep_time_s += time.time() - self._sleep_started
+            self._sleep_started = None
         for z in self.z_particles:
-            self.canvas.delete(z)
+            self.canvas.itemconfig(z, state='hidden')
         self.z_particles = []
         self.reset_eyes()
 
@@ -154,54 +360,86 @@ class MiniFace(tk.Tk):
         open_width_offset = random.randint(-5, 5)
         
         # Cambia entre línea y óvalo para abrir/cerrar
-        if self.canvas.type(self.mouth) == 'line':
-            self.canvas.delete(self.mouth)
-            self.mouth = self.canvas.create_oval(
-                self.MOUTH_X1 + open_width_offset, self.MOUTH_Y, 
-                self.MOUTH_X2 - open_width_offset, self.MOUTH_OPEN_HEIGHT, 
-                fill="black"
-            )
+        if not self.mouth_is_open:
+            self._set_mouth_open(True, open_width_offset)
             # Mover pupilas un poco al hablar
             self.canvas.move(self.pupil1, 0, random.randint(-1, 1))
             self.canvas.move(self.pupil2, 0, random.randint(-1, 1))
         else:
-            self.canvas.delete(self.mouth)
-            self.mouth = self.canvas.create_line(self.MOUTH_X1, self.MOUTH_Y, self.MOUTH_X2, self.MOUTH_Y, width=3)
+            self._set_mouth_open(False)
             self.reset_eyes() # Vuelve a centrar los ojos al cerrar la boca
 
+    def animate_thinking(self):
+        """Mira a un lado y a otro con los ojos entrecerrados."""
+        dx = (0, -6, 0, 6)[self._thinking_phase % 4]
+        self._thinking_phase += 1
+        self.canvas.coords(self.eye1, self.EYE1_COORDS[0], self.EYE1_COORDS[1] + 5, self.EYE1_COORDS[2], self.EYE1_COORDS[3] - 5)
+        self.canvas.coords(self.eye2, self.EYE2_COORDS[0], self.EYE2_COORDS[1] + 5, self.EYE2_COORDS[2], self.EYE2_COORDS[3] - 5)
+        self.canvas.coords(self.pupil1, self.PUPIL1_COORDS[0] + dx, self.PUPIL1_COORDS[1], self.PUPIL1_COORDS[2] + dx, self.PUPIL1_COORDS[3])
+        self.canvas.coords(self.pupil2, self.PUPIL2_COORDS[0] + dx, self.PUPIL2_COORDS[1], self.PUPIL2_COORDS[2] + dx, self.PUPIL2_COORDS[3])
+
     def animate_sleep(self):
-        """Anima las Zs mientras duerme."""
-        # Crear una nueva Z de vez en cuando
-        if random.random() < 0.1:
-            z_id = self.canvas.create_text(self.CANVAS_WIDTH - 30, self.MOUTH_Y - 20, text="Z", font=("Arial", 12))
+        """
+        Anima las Zs mientras duerme y devuelve cuándo hace falta el siguiente frame: solo hay
+        frames mientras una Z está a la vista.
+        """
+        if not self.z_particles:
+            # Sacar una Z nueva, reutilizando una del conjunto
+            z_id = self.z_pool[0]
+            self.canvas.coords(z_id, self.CANVAS_WIDTH - 30, self.MOUTH_Y - 20)
+            self.canvas.itemconfig(z_id, state='normal')
             self.z_particles.append(z_id)
+            return self.Z_FRAME_MS
 
-        # Mover y eliminar las Zs que se van
+        # Mover y ocultar las Zs que se van
+        step = (self.MOUTH_Y - 20) / self.Z_STEPS
         particles_to_remove = []
         for z in self.z_particles:
-            self.canvas.move(z, -1, -2)
+            self.canvas.move(z, -3, -step)
             x, y = self.canvas.coords(z)
-            if y < 0: # Si la Z sale por arriba
+            if y <= 0: # Si la Z sale por arriba
                 particles_to_remove.append(z)
-        
+
         for z in particles_to_remove:
-            self.canvas.delete(z)
+            self.canvas.itemconfig(z, state='hidden')
             self.z_particles.remove(z)
+        return self.Z_FRAME_MS if self.z_particles else self.SLEEP_Z_INTERVAL_MS
 
     def animation_loop(self):
+        """Un frame de la máquina de estados. Decide cuándo hace falta el siguiente."""
+        started = time.perf_counter()
+        if self._frame_due is not None:
+            self.frame_lag_ms.append(max(0.0, started - self._frame_due) * 1000)
+        self._frame_job = None
+        self.wakeups += 1
+        state = self.state
+
+        now = time.time()
         if self.speaking:
-            self.last_activity_time = time.time()
+            self.last_activity_time = now
             self.animate_mouth()
+            delay_ms = self.SPEAKING_FRAME_MS
+        elif self.thinking:
+            self.last_activity_time = now
+            self.animate_thinking()
+            delay_ms = self.THINKING_FRAME_MS
         elif self.sleeping:
-            self.animate_sleep()
-        elif time.time() - self.last_activity_time > self.SLEEP_TIMEOUT_S:
+            self.sleep_wakeups += 1
+            delay_ms = self.animate_sleep()
+        elif now - self.last_activity_time > self.SLEEP_TIMEOUT_S:
             self.start_sleeping()
-        # Modificación clave: Añadir 'and not self.sleeping' a la condición.
-        elif time.time() - self.last_activity_time > self.idle_delay and not self.sleeping:
-            self.run_random_idle_animation()
-            self.idle_delay = random.uniform(self.IDLE_DELAY_MIN_S, self.IDLE_DELAY_MAX_S)
+            delay_ms = 0
+        else:
+            if now >= self.next_idle_time:
+                self.run_random_idle_animation()
+                self.idle_delay = random.uniform(self.IDLE_DELAY_MIN_S, self.IDLE_DELAY_MAX_S)
+                self.next_idle_time = now + self.idle_delay
+            # Dormir antes de la próxima animación si toca
+            sleep_time = self.last_activity_time + self.SLEEP_TIMEOUT_S
+            delay_ms = (min(self.next_idle_time, sleep_time) - now) * 1000 + 1
 
-        self.after(self.ANIMATION_INTERVAL_MS, self.animation_loop)
+        self.frame_times_ms[state].append((time.perf_counter() - started) * 1000)
+        self._schedule(delay_ms)
 
     def run_random_idle_animation(self):
         animations = [self.blink, self.look_around, self.long_blink, self.stick_tongue, self.concentrate]
@@ -233,7 +471,7 @@ class MiniFace(tk.Tk):
         self.canvas.coords(self.eye2, *eye2_closed_coords)
         self.canvas.itemconfig(self.pupil1, state='hidden')
         self.canvas.itemconfig(self.pupil2, state='hidden')
-        self.after(duration, self.reset_eyes)
+        self._start_effect(duration, self.reset_eyes)
 
     def long_blink(self):
         self.blink(duration=random.randint(1000, 2500))
@@ -243,25 +481,24 @@ class MiniFace(tk.Tk):
         dy = random.randint(-5, 5)
         self.canvas.move(self.pupil1, dx, dy)
         self.canvas.move(self.pupil2, dx, dy)
-        self.after(random.randint(700, 1500), self.reset_eyes)
+        self._start_effect(random.randint(700, 1500), self.reset_eyes)
 
     def stick_tongue(self):
         # Abrir la boca un poco
-        self.canvas.delete(self.mouth)
-        self.mouth = self.canvas.create_oval(
+        self._set_mouth_open(True)
+        self.canvas.coords(
+            self.mouth_open,
             self.MOUTH_X1, self.MOUTH_Y, 
-            self.MOUTH_X2, self.MOUTH_Y + 10, # Apertura pequeña
-            fill="black"
+            self.MOUTH_X2, self.MOUTH_Y + 10 # Apertura pequeña
         )
         
         def hide_tongue_and_close_mouth():
             self.canvas.itemconfig(self.tongue, state='hidden')
-            self.canvas.delete(self.mouth)
-            self.mouth = self.canvas.create_line(self.MOUTH_X1, self.MOUTH_Y, self.MOUTH_X2, self.MOUTH_Y, width=3)
+            self._set_mouth_open(False)
 
         self.canvas.itemconfig(self.tongue, state='normal')
         self.canvas.lift(self.tongue) # <-- Mueve la lengua al frente
-        self.after(random.randint(1000, 2000), hide_tongue_and_close_mouth)
+        self._start_effect(random.randint(1000, 2000), hide_tongue_and_close_mouth)
 
     def concentrate(self):
         # Coordenadas para ojos entrecerrados
@@ -270,7 +507,7 @@ class MiniFace(tk.Tk):
 
         self.canvas.coords(self.eye1, *eye1_concentrate_coords)
         self.canvas.coords(self.eye2, *eye2_concentrate_coords)
-        self.after(random.randint(1000, 2500), self.reset_eyes)
+        self._start_effect(random.randint(1000, 2500), self.reset_eyes)
 
 # Ejemplo de uso
 if __name__ == '__main__':
@@ -296,6 +533,15 @@ if __name__ == '__main__':
             face.start_sleeping()
             print("Se durmió.")
 
+    def toggle_thinking():
+        if face.thinking:
+            face.stop_thinking()
+        else:
+            face.start_thinking()
+
+    def show_frame_stats():
+        print(face.frame_stats())
+
     # Añade un botón para probar
     button = tk.Button(face, text="Hablar/Callar", command=toggle_speaking)
     button.pack()
@@ -303,4 +549,10 @@ if __name__ == '__main__':
     sleep_button = tk.Button(face, text="Dormir/Despertar", command=toggle_sleep)
     sleep_button.pack()
 
+    thinking_button = tk.Button(face, text="Pensar", command=toggle_thinking)
+    thinking_button.pack()
+
+    stats_button = tk.Button(face, text="Estadísticas de frames", command=show_frame_stats)
+    stats_button.pack()
+
     face.mainloop()
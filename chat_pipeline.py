@@ -0,0 +1,577 @@
+"""
+chat_pipeline.py
+
+Núcleo del chat compartido por BERTraco.py, BERTraco_voice.py, BERTraco_voice_translate.py y el
+servidor.
+
+Cada script tenía su propio chat_loop con los hilos y las colas cableados a mano (y el de
+traducción, además, su hilo productor). ChatPipeline los sustituye por etapas:
+
+  input -> translate_in -> generate -> translate_out -> chunk -> synthesize -> play
+                                                            \\-> display
+
+  - input: la cola de mensajes (de la ventana o del servidor).
+  - translate_in: traduce la pregunta antes de mandarla al modelo.
+  - generate: hilo que lee el stream del LLM (o la respuesta guardada en la caché).
+  - translate_out: hilo que corta la respuesta en frases (SentenceSegmenter), las traduce según
+    llegan y las pasa palabra a palabra.
+  - chunk: junta el texto en trozos pronunciables (hasta un espacio) para la voz.
+  - synthesize: hilo que convierte cada trozo en PCM.
+  - play: el AudioOutputStream (buffer circular y sink).
+  - display: manda el texto a la cara, al ritmo del audio (AudioPacer).
+
+Las etapas de un turno se conectan con canales acotados (Channel): si una etapa se retrasa, la
+anterior espera en put() en lugar de acumular. Entre chunk y synthesize el canal es la SpeechQueue
+(con su política de cola llena) y entre synthesize y play el buffer del stream de audio.
+
+Una etapa está activa si se le ha dado lo que necesita (traductores, voz, salida de audio) y no
+está en disabled (BERTRACO_STAGES_OFF, p. ej. "synthesize,play" para un chat sin voz).
+
+cancel() corta el turno en curso en todas las etapas: los canales dejan de esperar, se cierra el
+stream del LLM (y con él la petición a Ollama), se vacía la cola de voz y el audio pendiente.
+
+stats() da por etapa los elementos procesados, su latencia (media, p95; en generate, hasta el
+primer fragmento) y la profundidad de su cola de entrada (actual y máxima). Con metrics
+(turn_metrics.TurnMetrics) cada turno deja además su registro: esperas, TTFT, tokens por segundo,
+traducción, síntesis y retraso de la ventana. Para la espera en la cola de entrada, la cola debe
+ser una MessageQueue.
+"""
+
+import contextvars
+import itertools
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+from response_cache import iter_chunks
+from speech_queue import SpeechQueue
+from llm_scheduler import current_cancel
+from turn_metrics import current_metrics
+
+STAGES = ("input", "translate_in", "generate", "translate_out", "chunk", "synthesize", "play", "display")
+# input, generate y display son el chat en sí; el resto se puede apagar
+OPTIONAL_STAGES = ("translate_in", "translate_out", "chunk", "synthesize", "play")
+
+
+def disabled_stages() -> tuple:
+    """Etapas desactivadas por configuración (BERTRACO_STAGES_OFF, separadas por comas)."""
+    names = tuple(s.strip() for s in os.environ.get("BERTRACO_STAGES_OFF", "").split(",") if s.strip())
+    unknown = [s for s in names if s not in OPTIONAL_STAGES]
+    if unknown:
+        raise ValueError(f"Etapas que no se pueden desactivar en BERTRACO_STAGES_OFF: {', '.join(unknown)}. "
+                         f"Opciones: {', '.join(OPTIONAL_STAGES)}")
+    return names
+
+
+def _start_stage(name, target, *args):
+    """Hilo de una etapa con el contexto de quien lo arranca (en el servidor, la sesión del planificador)."""
+    context = contextvars.copy_context()
+    threading.Thread(target=context.run, args=(target, *args), name=name, daemon=True).start()
+
+
+class MessageQueue(queue.Queue):
+    """Cola de mensajes que recuerda cuánto esperó el último que salió (last_wait_s)."""
+
+    def __init__(self, maxsize: int = 0):
+        super().__init__(maxsize)
+        self.last_wait_s = None
+
+    def _put(self, item):
+        self.queue.append((time.perf_counter(), item))
+
+    def _get(self):
+        put_at, item = self.queue.popleft()
+        self.last_wait_s = time.perf_counter() - put_at
+        return item
+
+
+class TurnCancelled(Exception):
+    """El turno se canceló: las etapas dejan lo que estén haciendo."""
+
+
+class Turn:
+    _ids = itertools.count(1)
+
+    def __init__(self, question: str):
+        self.id = next(self._ids)
+        self.question = question
+        self.started = time.perf_counter()
+        self.channels = []
+        # Registro del turno para turn_metrics; lo rellenan las etapas
+        self.record = {}
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+        for channel in list(self.channels):
+            channel.wake()
+
+
+class StageStats:
+    def __init__(self, name: str, window: int = 500):
+        self.name = name
+        self.items = 0
+        self.busy_s = 0.0
+        self.latency_s = deque(maxlen=window)
+        self.depth = 0
+        self.max_depth = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.items += 1
+            self.busy_s += seconds
+            self.latency_s.append(seconds)
+
+    def observe_depth(self, depth: int):
+        with self._lock:
+            self.depth = depth
+            self.max_depth = max(self.max_depth, depth)
+
+    def summary(self) -> dict:
+        with self._lock:
+            ordered = sorted(self.latency_s)
+            return {
+                "items": self.items,
+                "busy_s": self.busy_s,
+                "mean_ms": sum(ordered) / len(ordered) * 1000 if ordered else 0.0,
+                "p95_ms": ordered[int(0.95 * (len(ordered) - 1))] * 1000 if ordered else 0.0,
+                "depth": self.depth,
+                "max_depth": self.max_depth,
+            }
+
+
+class Channel:
+    """Cola acotada entre dos etapas de un turno. put() espera si está llena (contrapresión)."""
+
+    def __init__(self, turn: Turn, maxsize: int = 64, stats: StageStats = None):
+        self.turn = turn
+        self.maxsize = maxsize
+        self.stats = stats
+        self._items = deque()
+        self._closed = False
+        self._error = None
+        self._cond = threading.Condition()
+        turn.channels.append(self)
+
+    def put(self, item):
+        with self._cond:
+            while len(self._items) >= self.maxsize and not self.turn.cancelled:
+                self._cond.wait()
+            if self.turn.cancelled:
+                raise TurnCancelled()
+            self._items.append(item)
+            if self.stats:
+                self.stats.observe_depth(len(self._items))
+            self._cond.notify_all()
+
+    def close(self, error: BaseException = None):
+        """Fin de los datos; con error, quien lea lo recibe como excepción."""
+        with self._cond:
+            self._closed = True
+            self._error = error
+            self._cond.notify_all()
+
+    def wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def __iter__(self):
+        while True:
+            with self._cond:
+                while not self._items and not self._closed and not self.turn.cancelled:
+                    self._cond.wait()
+                if self.turn.cancelled:
+                    raise TurnCancelled()
+                if not self._items:
+                    if self._error is not None:
+                        raise self._error
+                    return
+                item = self._items.popleft()
+                if self.stats:
+                    self.stats.observe_depth(len(self._items))
+                self._cond.notify_all()
+            yield item
+
+
+class ChatPipeline:
+    def __init__(self, face, llm, prompt, memory, cache=None, warmer=None,
+                 translate_in=None, translate_out=None, segmenter_factory=None,
+                 synthesize=None, audio_out=None, audio_budget_s: float = 1.0,
+                 speech_queue_max: int = 32, speech_policy: str = "summary",
+                 channel_size: int = 64, disabled=(), metrics=None):
+        self.face = face
+        self.llm = llm
+        self.prompt = prompt
+        self.memory = memory
+        self.cache = cache
+        self.warmer = warmer
+        self.translate_in = translate_in
+        self.translate_out = translate_out
+        self.segmenter_factory = segmenter_factory
+        self.synthesize = synthesize
+        self.audio_out = audio_out
+        self.audio_budget_s = audio_budget_s
+        self.channel_size = channel_size
+        self.metrics = metrics
+
+        enabled = set(STAGES) - (set(disabled) & set(OPTIONAL_STAGES))
+        if translate_in is None:
+            enabled.discard("translate_in")
+        if translate_out is None or segmenter_factory is None:
+            enabled.discard("translate_out")
+        if synthesize is None or audio_out is None or not {"chunk", "synthesize", "play"} <= enabled:
+            # La voz va entera o no va
+            enabled -= {"chunk", "synthesize", "play"}
+        self.enabled = frozenset(enabled)
+        self.stage_stats = {name: StageStats(name) for name in STAGES}
+        self.turns = {"started": 0, "completed": 0, "cancelled": 0, "errors": 0}
+        self.first_output_s = deque(maxlen=500)
+        self.current = None
+        # Segundos de síntesis y de audio generado, acumulados por el hilo de voz
+        self._synth_totals = [0.0, 0.0]
+        self.synth_errors = 0
+
+        self.speech_queue = None
+        self.pacer = None
+        if "synthesize" in self.enabled:
+            from audio_stream import AudioPacer
+
+            self.speech_queue = SpeechQueue(max_items=speech_queue_max, policy=speech_policy)
+            self.pacer = AudioPacer(audio_out, budget_s=audio_budget_s)
+            threading.Thread(target=self._synthesize_loop, name="voz", daemon=True).start()
+
+    # -------------------- Bucle principal --------------------
+    def run(self, message_queue):
+        """Atiende los mensajes de message_queue hasta recibir None."""
+        while True:
+            pregunta = message_queue.get()
+            self.stage_stats["input"].observe_depth(message_queue.qsize())
+            if pregunta is None:
+                print(f"Historial: {self.memory.stats()}")
+                if self.speech_queue:
+                    self.speech_queue.put(None)
+                break
+            wait = getattr(message_queue, "last_wait_s", None)
+            self.stage_stats["input"].record(wait or 0.0)
+            turn = Turn(pregunta)
+            if wait is not None:
+                turn.record["input_wait_s"] = wait
+            before = self._counters()
+            try:
+                self._run_turn(turn)
+            except Exception as e:
+                self.turns["errors"] += 1
+                turn.record.update(outcome="error", error=str(e))
+                print(f"Error en el chat_loop: {e}")
+            self._finish_record(turn, before)
+
+    def cancel(self) -> bool:
+        """Cancela el turno en curso (si lo hay). Se puede llamar desde cualquier hilo."""
+        turn = self.current
+        if turn is None or turn.cancelled:
+            return False
+        turn.cancel()
+        if self.speech_queue:
+            self.speech_queue.flush()
+        if self.audio_out:
+            self.audio_out.flush()
+        return True
+
+    def _run_turn(self, turn: Turn):
+        self.current = turn
+        self.turns["started"] += 1
+        face = self.face
+        face.after(0, face.wake_up)
+        # El turno tiene prioridad sobre el resumen del historial que pudiera estar generándose
+        self.memory.interrupt_summary()
+
+        historial = self.memory.messages()
+        guardada = self.cache.get(turn.question, historial) if self.cache else None
+        pregunta_llm = turn.question
+        # texto: respuesta completa en el idioma del modelo. frases: con traducción, cada frase del
+        # modelo junto al número de piezas mostradas al acabar la suya, para saber qué llegó a verse
+        respuesta_llm = {"texto": "", "frases": []}
+        translating = "translate_out" in self.enabled
+        turn.record.update(cached=guardada is not None, question_chars=len(turn.question))
+        if guardada is not None:
+            if isinstance(guardada, dict):
+                # Entrada de la cadena con traducción: pregunta y respuesta en los dos idiomas
+                pregunta_llm = guardada["pregunta_en"]
+                respuesta_llm["texto"] = guardada["respuesta_en"]
+                pieces = [f"{palabra} " for palabra in guardada["respuesta_es"].split()]
+                respuesta_llm["frases"].append((len(pieces), guardada["respuesta_en"]))
+            else:
+                respuesta_llm["texto"] = guardada
+                pieces = iter_chunks(guardada)
+        else:
+            if "translate_in" in self.enabled:
+                started = time.perf_counter()
+                pregunta_llm = self.translate_in(turn.question)
+                elapsed = time.perf_counter() - started
+                self.stage_stats["translate_in"].record(elapsed)
+                turn.record["translate_in_s"] = elapsed
+            mensajes = self.prompt.format_messages(pregunta_llm, historial)
+            generated = Channel(turn, self.channel_size, self.stage_stats["translate_out" if translating else "display"])
+            _start_stage("generar", self._generate, turn, mensajes, generated, respuesta_llm)
+            pieces = generated
+            if translating:
+                pieces = Channel(turn, self.channel_size, self.stage_stats["display"])
+                _start_stage("traducir", self._translate_out, turn, generated, pieces, respuesta_llm)
+
+        # Lo que llega a mostrarse, también si el turno se cancela a medias
+        partes = []
+        started_speaking = False
+        drained = False
+        try:
+            started_speaking = self._display(turn, pieces, partes)
+            if self.speech_queue:
+                # Deja sintetizar y sonar lo que queda de la respuesta
+                drained = self.pacer.drain(self.speech_queue, timeout=self.audio_budget_s + 1.0)
+        except TurnCancelled:
+            pass
+        finally:
+            if self.audio_out:
+                self.audio_out.end_utterance()
+                if not drained:
+                    # Cancelado, error o se agotó la espera: lo pendiente ya no debe sonar
+                    if self.speech_queue:
+                        self.speech_queue.flush()
+                    self.audio_out.flush()
+            if started_speaking or partes:
+                face.after(0, face.stop_speaking)
+                face.after(0, face.end_assistant_message)
+            self.current = None
+
+        respuesta = "".join(partes)
+        turn.record["answer_chars"] = len(respuesta)
+        if turn.cancelled:
+            self.turns["cancelled"] += 1
+            turn.record["outcome"] = "cancelled"
+            # Se recuerda solo lo que llegó a verse (en el idioma del modelo), pero no se guarda
+            # en la caché
+            if translating or isinstance(guardada, dict):
+                # Las frases mostradas enteras; la que se cortó a medias no se sabe dónde acaba
+                vista = " ".join(frase for fin, frase in respuesta_llm["frases"] if fin <= len(partes))
+            else:
+                vista = respuesta
+            if vista.strip():
+                self.memory.add_turn(pregunta_llm, vista)
+            return
+        self.turns["completed"] += 1
+        turn.record["outcome"] = "completed"
+        if guardada is None and self.cache and respuesta.strip():
+            if translating:
+                self.cache.put(turn.question, historial, {
+                    "pregunta_en": pregunta_llm,
+                    "respuesta_en": respuesta_llm["texto"],
+                    "respuesta_es": respuesta.strip(),
+                })
+            else:
+                self.cache.put(turn.question, historial, respuesta)
+        # Guardar en el historial (en el idioma del modelo, recortado al presupuesto de tokens)
+        self.memory.add_turn(pregunta_llm, respuesta_llm["texto"])
+
+    # -------------------- Etapas --------------------
+    def _generate(self, turn: Turn, mensajes, out: Channel, respuesta_llm: dict):
+        stats = self.stage_stats["generate"]
+        # Este hilo tiene su propio contexto: el planificador apunta en el registro del turno y ve
+        # si se cancela mientras espera hueco
+        current_metrics.set(turn.record)
+        current_cancel.set(turn._cancelled)
+        started = time.perf_counter()
+        first = last = None
+        tokens = 0
+        error = None
+        stream = None
+        try:
+            stream = self.llm.stream(mensajes)
+            for chunk in stream:
+                if turn.cancelled:
+                    break
+                last = time.perf_counter()
+                if chunk and first is None:
+                    first = last
+                    ttft = first - started
+                    stats.record(ttft)
+                    self.prompt.observe_ttft(ttft)
+                    if self.warmer:
+                        self.warmer.observe_ttft(ttft)
+                tokens += 1
+                respuesta_llm["texto"] += chunk
+                out.put(chunk)
+        except TurnCancelled:
+            pass
+        except Exception as e:
+            error = e
+        finally:
+            # Al cerrar el generador se corta la petición al LLM si el turno no terminó
+            close = getattr(stream, "close", None)
+            if close:
+                close()
+            # Tiempos del modelo, sin la espera por un hueco del planificador
+            wait = turn.record.get("llm_wait_s") or 0.0
+            turn.record["tokens"] = tokens
+            if first is not None:
+                turn.record["ttft_s"] = first - started - wait
+                turn.record["generation_s"] = last - started - wait
+                if tokens > 1 and last > first:
+                    turn.record["tokens_per_s"] = (tokens - 1) / (last - first)
+            # Lo último: al cerrar el canal el turno puede terminar y guardar su registro
+            out.close(error=error)
+
+    def _translate_out(self, turn: Turn, source: Channel, out: Channel, respuesta_llm: dict):
+        stats = self.stage_stats["translate_out"]
+        segmenter = self.segmenter_factory()
+        total = [0.0]
+        emitted = [0]
+        error = None
+
+        def emit(frase):
+            started = time.perf_counter()
+            palabras = self.translate_out(frase).split()
+            elapsed = time.perf_counter() - started
+            stats.record(elapsed)
+            total[0] += elapsed
+            # Antes de mandar las palabras: si se muestran todas, la frase ya consta
+            emitted[0] += len(palabras)
+            respuesta_llm["frases"].append((emitted[0], frase))
+            for palabra in palabras:
+                out.put(f"{palabra} ")
+
+        try:
+            for chunk in source:
+                for frase in segmenter.feed(chunk):
+                    emit(frase)
+            for frase in segmenter.flush():
+                emit(frase)
+        except TurnCancelled:
+            pass
+        except Exception as e:
+            error = e
+        finally:
+            turn.record["translate_out_s"] = total[0]
+            out.close(error=error)
+
+    def _display(self, turn: Turn, pieces, partes: list) -> bool:
+        """Etapas chunk y display, en el hilo del turno: el texto se muestra al ritmo del audio."""
+        face = self.face
+        chunk_stats = self.stage_stats["chunk"]
+        display_stats = self.stage_stats["display"]
+        buffer_voz = ""
+        started_speaking = False
+        for piece in pieces:
+            if turn.cancelled:
+                raise TurnCancelled()
+            started = time.perf_counter()
+            if not started_speaking:
+                first_output = started - turn.started
+                self.first_output_s.append(first_output)
+                turn.record["first_output_s"] = first_output
+                face.after(0, face.start_speaking)
+                face.after(0, face.start_assistant_message)
+                started_speaking = True
+
+            if self.speech_queue:
+                # Trozos pronunciables: hasta el siguiente espacio o salto de línea
+                buffer_voz += piece
+                if " " in buffer_voz or "\n" in buffer_voz:
+                    self.speech_queue.put(buffer_voz)
+                    chunk_stats.record(time.perf_counter() - started)
+                    chunk_stats.observe_depth(self.speech_queue.qsize())
+                    buffer_voz = ""
+
+            # La cara agrupa los fragmentos y los pinta una vez por frame
+            face.post_assistant_text(piece)
+            partes.append(piece)
+            if self.pacer:
+                # Solo se retiene el texto si el audio pendiente supera el presupuesto de latencia
+                self.pacer.pace()
+            display_stats.record(time.perf_counter() - started)
+        if self.speech_queue and buffer_voz.strip() and not turn.cancelled:
+            self.speech_queue.put(buffer_voz)
+        return started_speaking
+
+    def _synthesize_loop(self):
+        """Etapa synthesize: un hilo para todo el pipeline, vive entre turnos."""
+        stats = self.stage_stats["synthesize"]
+        play_stats = self.stage_stats["play"]
+        while True:
+            text = self.speech_queue.get()
+            if text is None:
+                break
+            try:
+                stats.observe_depth(self.speech_queue.qsize())
+                started = time.perf_counter()
+                try:
+                    pcm = self.synthesize(text)
+                except Exception as e:
+                    # Una frase que no se puede sintetizar no debe dejar sin voz el resto de la sesión
+                    self.synth_errors += 1
+                    print(f"Error al sintetizar {text!r}: {e}")
+                    continue
+                elapsed = time.perf_counter() - started
+                stats.record(elapsed)
+                self._synth_totals[0] += elapsed
+                self._synth_totals[1] += len(pcm) / self.audio_out.sample_rate
+                # Si el turno se canceló mientras se sintetizaba, ya no debe sonar
+                if self.speech_queue.was_flushed():
+                    continue
+                # Etapa play: se encola detrás de lo que ya suena; solo bloquea si el buffer está lleno
+                started = time.perf_counter()
+                self.audio_out.write(pcm)
+                play_stats.record(time.perf_counter() - started)
+            finally:
+                # Hasta aquí no ha terminado: pacer.drain() espera a esto, no a que la cola se vacíe
+                self.speech_queue.task_done()
+
+    # -------------------- Métricas por turno --------------------
+    def _counters(self) -> dict:
+        """Contadores acumulados de los que cada turno se queda con la diferencia."""
+        counters = {"synthesis_s": self._synth_totals[0], "audio_s": self._synth_totals[1]}
+        if self.audio_out:
+            counters["underruns"] = self.audio_out.stats()["underruns"]
+        transcript = self.face.transcript_stats() if hasattr(self.face, "transcript_stats") else {}
+        if "total_latency_ms" in transcript:
+            # Solo la ventana agrupa fragmentos por frame; la cara del servidor no tiene retraso
+            counters["flushes"] = transcript["flushes"]
+            counters["flush_latency_ms"] = transcript["total_latency_ms"]
+        return counters
+
+    def _finish_record(self, turn: Turn, before: dict):
+        record = turn.record
+        record["turn_s"] = time.perf_counter() - turn.started
+        if self.metrics is None:
+            return
+        after = self._counters()
+        delta = {name: after[name] - before[name] for name in after if name in before}
+        if "synthesize" in self.enabled:
+            record.update(synthesis_s=delta["synthesis_s"], audio_s=delta["audio_s"],
+                          underruns=delta["underruns"])
+            if delta["audio_s"] > 0:
+                record["synthesis_rtf"] = delta["synthesis_s"] / delta["audio_s"]
+        if delta.get("flushes"):
+            record["gui_flush_lag_ms"] = delta["flush_latency_ms"] / delta["flushes"]
+        self.metrics.record(record)
+
+    # -------------------- Estadísticas --------------------
+    def stats(self) -> dict:
+        stages = {name: s.summary() for name, s in self.stage_stats.items() if name in self.enabled}
+        if "play" in stages:
+            audio = self.audio_out.stats()
+            stages["play"].update(buffered_s=audio["buffered_s"], underruns=audio["underruns"])
+        if self.speech_queue:
+            stages["synthesize"]["queue"] = self.speech_queue.stats()
+            stages["synthesize"]["errors"] = self.synth_errors
+        first = list(self.first_output_s)
+        return {
+            "stages": stages,
+            "turns": dict(self.turns),
+            "first_output_s": sum(first) / len(first) if first else None,
+        }
@@ -0,0 +1,189 @@
+"""
+conversation_memory.py
+
+Historial de conversación con presupuesto de tokens.
+
+Sustituye a historial = historial[-6:], que guardaba siempre tres intercambios sin importar su
+longitud: una sola respuesta larga inflaba el prompt y en charlas cortas se tiraba contexto que
+cabía sin coste. ConversationMemory cuenta los tokens de cada intercambio (con el tokenizador que
+se le pase, o con una estimación barata) y devuelve los intercambios más recientes que caben en
+el presupuesto.
+
+Opcionalmente, los intercambios que se salen del presupuesto se comprimen en un resumen. El
+resumen se genera en un hilo en segundo plano justo después de cada turno, mientras el usuario
+escribe, y messages() usa siempre el último resumen disponible sin esperar: nunca añade latencia
+a la respuesta. El resumen comparte el LLM con el chat, así que al empezar un turno se interrumpe
+(interrupt_summary()): sus intercambios vuelven a la cola y se resumen después de ese turno.
+"""
+
+import math
+import threading
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+# Tokens extra por mensaje (rol y separadores de la plantilla de chat)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_INSTRUCTION_ES = (
+    "Resume en pocas frases y en español la conversación siguiente entre el usuario y el "
+    "asistente. Conserva nombres, datos y preferencias que el usuario haya mencionado."
+)
+SUMMARY_PREFIX_ES = "Resumen de la conversación anterior: "
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimación barata: unos 4 caracteres por token."""
+    return math.ceil(len(text) / 4) if text else 0
+
+
+class SummaryInterrupted(Exception):
+    """El resumen se dejó a medias para no retrasar un turno."""
+
+
+def make_llm_summarizer(llm, instruction: str = SUMMARY_INSTRUCTION_ES,
+                        labels=("Resumen previo", "Usuario", "Asistente")):
+    """
+    Devuelve summarizer(resumen_previo, intercambios, stop=None) -> str que usa llm.stream().
+    Si stop (un threading.Event) se activa, cierra el stream, lo que libera el LLM, y lanza
+    SummaryInterrupted. Sirve tanto con OllamaChatClient como con el Ollama de langchain.
+    """
+    previous_label, user_label, assistant_label = labels
+
+    def summarize(previous: str, turns: list, stop=None) -> str:
+        lines = []
+        if previous:
+            lines.append(f"{previous_label}: {previous}")
+        for pregunta, respuesta in turns:
+            lines.append(f"{user_label}: {pregunta}")
+            lines.append(f"{assistant_label}: {respuesta}")
+        mensajes = [SystemMessage(content=instruction), HumanMessage(content="\n".join(lines))]
+        partes = []
+        stream = llm.stream(mensajes)
+        try:
+            for chunk in stream:
+                if stop is not None and stop.is_set():
+                    raise SummaryInterrupted()
+                partes.append(chunk)
+        finally:
+            close = getattr(stream, "close", None)
+            if close:
+                close()
+        return "".join(partes).strip()
+    return summarize
+
+
+class ConversationMemory:
+    def __init__(self, max_tokens: int = 512, tokenizer=None, summarizer=None,
+                 summary_prefix: str = SUMMARY_PREFIX_ES):
+        """
+        max_tokens: presupuesto para historial + resumen (sin contar sistema, ejemplos ni pregunta).
+        tokenizer: callable texto -> número de tokens. Por defecto estimate_tokens.
+        summarizer: callable (resumen_previo, [(pregunta, respuesta), ...], stop=evento) -> resumen
+            nuevo; debe lanzar SummaryInterrupted si stop se activa (ver make_llm_summarizer).
+            Si es None, los intercambios que no caben simplemente se descartan.
+        """
+        self.max_tokens = max_tokens
+        self.tokenizer = tokenizer or estimate_tokens
+        self.summarizer = summarizer
+        self.summary_prefix = summary_prefix
+        self.summary = ""
+        self._summary_tokens = 0
+        self._turns = []          # [(pregunta, respuesta, tokens)], del más antiguo al más reciente
+        self._evicted = []        # intercambios pendientes de resumir
+        self._summarizing = False
+        self._interrupt = threading.Event()
+        self._lock = threading.Lock()
+        self.counters = {"turns": 0, "evicted": 0, "summaries": 0, "summary_errors": 0,
+                         "summaries_interrupted": 0}
+
+    def _count(self, text: str) -> int:
+        return self.tokenizer(text) + MESSAGE_OVERHEAD_TOKENS
+
+    def add_turn(self, pregunta: str, respuesta: str):
+        """Guarda un intercambio y recorta el historial al presupuesto."""
+        tokens = self._count(pregunta) + self._count(respuesta)
+        with self._lock:
+            self._turns.append((pregunta, respuesta, tokens))
+            self.counters["turns"] += 1
+            self._trim()
+            start_worker = self.summarizer is not None and bool(self._evicted) and not self._summarizing
+            if start_worker:
+                self._summarizing = True
+        if start_worker:
+            threading.Thread(target=self._summarize_pending, daemon=True).start()
+
+    def _trim(self):
+        # Se llama con self._lock adquirido
+        budget = self.max_tokens - self._summary_tokens
+        used = sum(t for _, _, t in self._turns)
+        while self._turns and used > budget:
+            pregunta, respuesta, tokens = self._turns.pop(0)
+            used -= tokens
+            self.counters["evicted"] += 1
+            if self.summarizer is not None:
+                self._evicted.append((pregunta, respuesta))
+
+    def interrupt_summary(self):
+        """
+        Para el resumen en curso, si lo hay, para que no ocupe el LLM durante un turno. Los
+        intercambios pendientes se resumen al terminar el siguiente turno (add_turn()).
+        """
+        with self._lock:
+            if self._summarizing:
+                self._interrupt.set()
+
+    def _summarize_pending(self):
+        while True:
+            with self._lock:
+                if not self._evicted or self._interrupt.is_set():
+                    self._summarizing = False
+                    self._interrupt.clear()
+                    return
+                turns, self._evicted = self._evicted, []
+                previous = self.summary
+            try:
+                summary = self.summarizer(previous, turns, stop=self._interrupt)
+            except SummaryInterrupted:
+                with self._lock:
+                    self._evicted = turns + self._evicted
+                    self.counters["summaries_interrupted"] += 1
+                continue
+            except Exception as e:
+                print(f"Error al resumir el historial: {e}")
+                with self._lock:
+                    self.counters["summary_errors"] += 1
+                continue
+            with self._lock:
+                self.summary = summary
+                self._summary_tokens = self._count(self.summary_prefix + summary) if summary else 0
+                self.counters["summaries"] += 1
+                # El resumen nuevo también ocupa presupuesto
+                self._trim()
+
+    def messages(self) -> list:
+        """Mensajes para el MessagesPlaceholder "historial": resumen (si hay) + intercambios."""
+        with self._lock:
+            out = []
+            if self.summary:
+                out.append(SystemMessage(content=self.summary_prefix + self.summary))
+            for pregunta, respuesta, _ in self._turns:
+                out.append(HumanMessage(content=pregunta))
+                out.append(AIMessage(content=respuesta))
+            return out
+
+    def clear(self):
+        with self._lock:
+            self._turns.clear()
+            self._evicted.clear()
+            self.summary = ""
+            self._summary_tokens = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(
+                self.counters,
+                kept_turns=len(self._turns),
+                history_tokens=sum(t for _, _, t in self._turns),
+                summary_tokens=self._summary_tokens,
+                max_tokens=self.max_tokens,
+            )
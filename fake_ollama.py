@@ -0,0 +1,396 @@
+"""
+fake_ollama.py
+
+Sustituto local de Ollama para medir la cadena sin modelo, sin GPU y sin red.
+
+Habla lo justo de la API de Ollama para los clientes de BERTraco (OllamaChatClient y el Ollama de
+langchain): POST /api/chat y /api/generate, en streaming (NDJSON) o no, y GET /api/tags y
+/api/version. Tres modos:
+
+  - sintético (SyntheticSource): texto de relleno con frases cortas, con TTFT, tokens por segundo
+    y variación (jitter) configurables. Con la misma semilla, la misma secuencia de tiempos.
+  - replay (Cassette): reproduce respuestas grabadas con sus tiempos reales entre fragmentos. Se
+    busca la grabación por el último mensaje del usuario (normalizado como en ResponseCache); si
+    no hay ninguna, se usan en el orden en que se grabaron.
+  - record (--record con --upstream): proxy hacia un Ollama de verdad que pasa la respuesta al
+    cliente según llega y la graba con sus tiempos, para reproducirla después.
+
+La grabación es un JSONL con una línea por respuesta:
+  {"endpoint": "chat", "model": ..., "prompt": último mensaje del usuario,
+   "chunks": [[segundos desde el fragmento anterior (el primero, desde la petición), texto], ...]}
+
+Las peticiones de calentamiento (sin mensajes o con num_predict=1, ver model_warmup.py) se
+contestan con un solo fragmento y no se graban. load_s simula la carga del modelo en la primera
+petición. speed acelera (>1) o frena los tiempos reproducidos.
+
+Uso:
+  python fake_ollama.py --port 11435 --ttft 0.3 --tps 25
+  python fake_ollama.py --port 11435 --replay grabacion.jsonl
+  python fake_ollama.py --port 11435 --record grabacion.jsonl --upstream http://127.0.0.1:11434
+  OLLAMA_HOST=http://127.0.0.1:11435 python BERTraco.py
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from response_cache import normalize_question
+
+_WORDS = ("i", "can", "tell", "you", "about", "the", "forest", "and", "its", "animals", "today", "it",
+          "is", "a", "nice", "day", "to", "talk", "with", "friends", "we", "like", "bright", "colors")
+_CREATED_AT = "2024-01-01T00:00:00Z"
+
+
+def last_user_message(body: dict) -> str:
+    """Texto con el que se identifica una petición: el último mensaje del usuario (o el prompt)."""
+    if "messages" in body:
+        for message in reversed(body.get("messages") or []):
+            if message.get("role") == "user":
+                return message.get("content", "")
+        return ""
+    return body.get("prompt", "")
+
+
+def is_warm_up(body: dict) -> bool:
+    options = body.get("options") or {}
+    return options.get("num_predict") == 1 or not last_user_message(body)
+
+
+class SyntheticSource:
+    """Respuestas de relleno con tiempos sintéticos: [(segundos de espera, texto), ...]."""
+
+    def __init__(self, ttft_s: float = 0.3, tokens_per_s: float = 25.0, tokens: int = 40,
+                 jitter: float = 0.2, seed: int = 0):
+        self.ttft_s = ttft_s
+        self.tokens_per_s = tokens_per_s
+        self.tokens = tokens
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _vary(self, seconds: float) -> float:
+        return max(0.0, seconds * (1 + self.jitter * self._rng.uniform(-1, 1)))
+
+    def script(self, prompt: str) -> list:
+        with self._lock:
+            count = max(1, round(self._vary(self.tokens)))
+            chunks = []
+            sentence = 0
+            for i in range(count):
+                word = self._rng.choice(_WORDS)
+                text = (word.capitalize() if sentence == 0 else " " + word)
+                sentence += 1
+                # Frases de 6 a 12 palabras, para que SentenceSegmenter tenga dónde cortar
+                if i == count - 1 or (sentence >= 6 and self._rng.random() < 0.25) or sentence >= 12:
+                    text += ". " if i < count - 1 else "."
+                    sentence = 0
+                gap = self._vary(self.ttft_s) if i == 0 else self._vary(1.0 / self.tokens_per_s)
+                chunks.append((gap, text))
+            return chunks
+
+    def stats(self) -> dict:
+        return {"mode": "synthetic", "ttft_s": self.ttft_s, "tokens_per_s": self.tokens_per_s}
+
+
+class Cassette:
+    """Respuestas grabadas (JSONL). script() para reproducir y append() para grabar."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = []
+        self._by_prompt = {}
+        self._cursors = {}
+        self._next = 0
+        self.counters = {"hits": 0, "fallbacks": 0, "recorded": 0}
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        self._add(json.loads(line))
+        except FileNotFoundError:
+            pass
+
+    def _add(self, entry):
+        self.entries.append(entry)
+        self._by_prompt.setdefault(normalize_question(entry.get("prompt", "")), []).append(entry)
+
+    def script(self, prompt: str) -> list:
+        with self._lock:
+            if not self.entries:
+                raise LookupError(f"No hay respuestas grabadas en {self.path}")
+            key = normalize_question(prompt)
+            candidates = self._by_prompt.get(key)
+            if candidates:
+                # La misma pregunta varias veces: se van alternando sus grabaciones
+                cursor = self._cursors.get(key, 0)
+                self._cursors[key] = cursor + 1
+                entry = candidates[cursor % len(candidates)]
+                self.counters["hits"] += 1
+            else:
+                entry = self.entries[self._next % len(self.entries)]
+                self._next += 1
+                self.counters["fallbacks"] += 1
+            return [(gap, text) for gap, text in entry["chunks"]]
+
+    def append(self, entry: dict):
+        with self._lock:
+            self._add(entry)
+            self.counters["recorded"] += 1
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counters, mode="replay", entries=len(self.entries))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 con chunked: el cliente reutiliza la conexión entre turnos, como con Ollama
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeOllama"
+
+    @property
+    def app(self) -> "FakeOllama":
+        return self.server.app
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.app.upstream:
+            self._proxy("GET", None)
+        elif self.path == "/api/tags":
+            self._send_json(200, {"models": [{"name": self.app.model, "model": self.app.model}]})
+        elif self.path == "/api/version":
+            self._send_json(200, {"version": "0.0.0-fake"})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length)
+        if self.path not in ("/api/chat", "/api/generate"):
+            self._send_json(404, {"error": "not found"})
+            return
+        try:
+            body = json.loads(raw or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": "invalid JSON"})
+            return
+        self.app.count("requests")
+        if self.app.upstream:
+            self._proxy("POST", raw, body)
+            return
+        started = time.perf_counter()
+        if self.app.take_load():
+            time.sleep(self.app.load_s / self.app.speed)
+        if is_warm_up(body):
+            chunks = [(0.0, "")]
+            self.app.count("warm_ups")
+        else:
+            try:
+                chunks = self.app.source.script(last_user_message(body))
+            except LookupError as e:
+                self._send_json(404, {"error": str(e)})
+                return
+        self._reply(body, chunks, started)
+
+    def _reply(self, body, chunks, started):
+        chat = self.path == "/api/chat"
+        model = body.get("model", self.app.model)
+
+        def part(text, done):
+            data = {"model": model, "created_at": _CREATED_AT, "done": done}
+            if chat:
+                data["message"] = {"role": "assistant", "content": text}
+            else:
+                data["response"] = text
+            if done:
+                data.update(done_reason="stop", total_duration=int((time.perf_counter() - started) * 1e9),
+                            eval_count=len(chunks))
+            return data
+
+        if body.get("stream", True) is False:
+            for gap, _ in chunks:
+                time.sleep(gap / self.app.speed)
+            data = part("".join(text for _, text in chunks), True)
+            self._send_json(200, data)
+            return
+        try:
+            self._start_stream()
+            # Se duerme hasta cada instante previsto, así los retrasos de escritura no se acumulan
+            due = time.perf_counter()
+            for gap, text in chunks:
+                due += gap / self.app.speed
+                time.sleep(max(0.0, due - time.perf_counter()))
+                self._write_chunk((json.dumps(part(text, False)) + "\n").encode("utf-8"))
+            self._write_chunk((json.dumps(part("", True)) + "\n").encode("utf-8"))
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # El cliente cortó (turno cancelado): como Ollama, se deja de generar
+            self.app.count("aborted")
+            self.close_connection = True
+
+    def _proxy(self, method, raw, body=None):
+        """Modo grabación: reenvía a Ollama, pasa la respuesta según llega y la graba."""
+        import httpx
+
+        url = self.app.upstream.rstrip("/") + self.path
+        record = body is not None and not is_warm_up(body) and body.get("stream", True) is not False
+        chunks = []
+        # El primer intervalo se cuenta desde la petición: incluye la carga y la evaluación del prompt
+        last = time.perf_counter()
+        try:
+            with httpx.Client(timeout=httpx.Timeout(10.0, read=None)) as client:
+                with client.stream(method, url, content=raw,
+                                   headers={"Content-Type": "application/json"}) as upstream:
+                    self.send_response(upstream.status_code)
+                    self.send_header("Content-Type", upstream.headers.get("Content-Type", "application/json"))
+                    self.send_header("Transfer-Encoding", "chunked")
+                    self.end_headers()
+                    for line in upstream.iter_lines():
+                        if not line:
+                            continue
+                        self._write_chunk((line + "\n").encode("utf-8"))
+                        if not record or upstream.status_code != 200:
+                            continue
+                        data = json.loads(line)
+                        text = (data.get("message") or {}).get("content", "") if "message" in data \
+                            else data.get("response", "")
+                        if text:
+                            now = time.perf_counter()
+                            chunks.append([round(now - last, 4), text])
+                            last = now
+                    self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            self.app.count("aborted")
+            self.close_connection = True
+            return
+        except httpx.HTTPError as e:
+            self._send_json(502, {"error": f"upstream: {e}"})
+            return
+        if record and chunks:
+            self.app.cassette.append({
+                "endpoint": self.path.rsplit("/", 1)[-1],
+                "model": body.get("model"),
+                "prompt": last_user_message(body),
+                "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "chunks": chunks,
+            })
+
+
+class FakeOllama:
+    def __init__(self, source=None, host: str = "127.0.0.1", port: int = 0, model: str = "qwen:0.5b",
+                 speed: float = 1.0, load_s: float = 0.0, upstream: str = None, cassette: Cassette = None):
+        if upstream and cassette is None:
+            raise ValueError("El modo grabación necesita una Cassette donde grabar")
+        self.source = source or SyntheticSource()
+        self.model = model
+        self.speed = speed
+        self.load_s = load_s
+        self.upstream = upstream
+        self.cassette = cassette
+        self.counters = {"requests": 0, "warm_ups": 0, "aborted": 0}
+        self._loaded = False
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.app = self
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def take_load(self) -> bool:
+        """True solo la primera vez: esa petición paga load_s (modelo frío)."""
+        with self._lock:
+            if self._loaded or not self.load_s:
+                self._loaded = True
+                return False
+            self._loaded = True
+            return True
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name="fake-ollama", daemon=True).start()
+        return self
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.counters)
+        source = self.cassette if self.upstream else self.source
+        stats.update(source.stats())
+        if self.upstream:
+            stats["mode"] = "record"
+        return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ollama falso para medir BERTraco sin modelo")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--model", default="qwen:0.5b", help="Nombre que devuelve /api/tags")
+    parser.add_argument("--replay", help="Reproduce las respuestas grabadas en este JSONL")
+    parser.add_argument("--record", help="Graba en este JSONL lo que responda --upstream")
+    parser.add_argument("--upstream", help="Ollama real al que reenviar en modo grabación")
+    parser.add_argument("--ttft", type=float, default=0.3, help="Sintético: segundos hasta el primer token")
+    parser.add_argument("--tps", type=float, default=25.0, help="Sintético: tokens por segundo")
+    parser.add_argument("--tokens", type=int, default=40, help="Sintético: tokens por respuesta")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Sintético: variación relativa de los tiempos")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--speed", type=float, default=1.0, help="Factor de velocidad de los tiempos")
+    parser.add_argument("--load", type=float, default=0.0, help="Segundos de carga en la primera petición")
+    args = parser.parse_args()
+
+    if bool(args.record) != bool(args.upstream):
+        parser.error("--record y --upstream van juntos")
+    cassette = Cassette(args.record or args.replay) if (args.record or args.replay) else None
+    source = cassette if args.replay else SyntheticSource(args.ttft, args.tps, args.tokens, args.jitter, args.seed)
+    server = FakeOllama(source, host=args.host, port=args.port, model=args.model, speed=args.speed,
+                        load_s=args.load, upstream=args.upstream, cassette=cassette)
+    mode = "grabando" if args.record else ("replay" if args.replay else "sintético")
+    print(f"Ollama falso ({mode}) en {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Ollama falso: {server.stats()}")
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+headless_face.py
+
+Cara sin ventana para el servidor (bertraco_server.py).
+
+El núcleo del chat (ChatPipeline, chat_pipeline.py) habla con la cara solo a través de unos
+pocos métodos (after, wake_up, start_speaking, start_assistant_message, post_assistant_text...).
+HeadlessFace implementa esos mismos métodos sin Tk: en lugar de dibujar, emite eventos con
+emit(evento, datos) para que el servidor los mande al cliente. Así el mismo núcleo sirve a la
+ventana y a los clientes remotos.
+
+Eventos: "state" ({"state": idle/thinking/speaking/sleeping}, solo cuando cambia),
+"message_start", "token" ({"text": ...}) y "message_end". La máquina de estados es la de MiniFace:
+speaking > thinking > sleeping > idle, y se duerme tras sleep_timeout_s sin actividad.
+"""
+
+import threading
+import time
+
+
+class HeadlessFace:
+    STATES = ("idle", "thinking", "speaking", "sleeping")
+
+    def __init__(self, emit=None, sleep_timeout_s: float = 10.0):
+        self.emit = emit or (lambda event, data: None)
+        self.sleep_timeout_s = sleep_timeout_s
+        self.speaking = False
+        self.thinking = False
+        self.sleeping = False
+        self.last_activity_time = time.time()
+        self.closed = False
+        self.counters = {"tokens": 0, "messages": 0, "state_changes": 0}
+        self._last_state = "idle"
+        self._lock = threading.RLock()
+        self._sleep_timer = None
+        self._schedule_sleep()
+
+    # -------------------- Interfaz de MiniFace --------------------
+    def after(self, delay_ms, func, *args):
+        """Como Tk.after, pero sin hilo de GUI: a 0 ms se ejecuta ya, en el hilo que llama."""
+        if delay_ms <= 0:
+            func(*args)
+            return None
+        timer = threading.Timer(delay_ms / 1000.0, func, args)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    @property
+    def state(self):
+        if self.speaking:
+            return "speaking"
+        if self.thinking:
+            return "thinking"
+        if self.sleeping:
+            return "sleeping"
+        return "idle"
+
+    def wake_up(self):
+        with self._lock:
+            self.sleeping = False
+            self._touch()
+
+    def start_speaking(self):
+        with self._lock:
+            self.sleeping = False
+            self.speaking = True
+            self._touch()
+
+    def stop_speaking(self):
+        with self._lock:
+            self.speaking = False
+            self._touch()
+
+    def start_thinking(self):
+        with self._lock:
+            self.sleeping = False
+            self.thinking = True
+            self._touch()
+
+    def stop_thinking(self):
+        with self._lock:
+            self.thinking = False
+            self._touch()
+
+    def start_sleeping(self):
+        with self._lock:
+            if self.speaking or self.thinking or self.closed:
+                return
+            self.sleeping = True
+            self._publish_state()
+
+    def start_assistant_message(self):
+        self.counters["messages"] += 1
+        self.emit("message_start", {})
+
+    def post_assistant_text(self, chunk):
+        """Aquí no hace falta agrupar por frame: cada fragmento sale tal cual hacia el cliente."""
+        self.counters["tokens"] += 1
+        self.emit("token", {"text": chunk})
+
+    def end_assistant_message(self):
+        self.emit("message_end", {})
+
+    def destroy(self):
+        self.close()
+
+    def transcript_stats(self):
+        return dict(self.counters)
+
+    # -------------------- Internos --------------------
+    def _touch(self):
+        # Se llama con self._lock adquirido
+        self.last_activity_time = time.time()
+        self._publish_state()
+        self._schedule_sleep()
+
+    def _publish_state(self):
+        state = self.state
+        if state != self._last_state:
+            self._last_state = state
+            self.counters["state_changes"] += 1
+            self.emit("state", {"state": state})
+
+    def _schedule_sleep(self):
+        if self._sleep_timer is not None:
+            self._sleep_timer.cancel()
+        if self.closed or not self.sleep_timeout_s:
+            return
+        self._sleep_timer = threading.Timer(self.sleep_timeout_s, self.start_sleeping)
+        self._sleep_timer.daemon = True
+        self._sleep_timer.start()
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            if self._sleep_timer is not None:
+                self._sleep_timer.cancel()
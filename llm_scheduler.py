@@ -0,0 +1,215 @@
+"""
+llm_scheduler.py
+
+Reparto del LLM entre varias sesiones (bertraco_server.py).
+
+Con un chat_loop por sesión y todas compartiendo el mismo cliente, el orden de llegada decidía
+quién generaba, y un cliente que mandaba un mensaje tras otro acaparaba el modelo. FairScheduler:
+  - deja como mucho max_concurrent generaciones a la vez (lo que aguante Ollama, ver
+    OLLAMA_NUM_PARALLEL);
+  - cuando hay cola, reparte los huecos por turnos entre sesiones (round robin): cada sesión con
+    peticiones esperando recibe uno antes de que otra reciba el segundo;
+  - admit() rechaza al llegar, antes de encolar nada, si la sesión ya tiene max_session_depth
+    mensajes pendientes o el servidor max_queue_depth; Overloaded lleva un retry_after_s estimado;
+  - stats() da los turnos en vuelo, la cola y el tiempo de espera (media, p95, máximo) para
+    dimensionar la concurrencia de Ollama con la carga real.
+
+ScheduledLLM envuelve al cliente: stream() e invoke() esperan su hueco antes de pedir nada. La
+sesión se toma de current_session (un ContextVar), así que el resto del código no cambia; lo que
+corre fuera de una sesión (p. ej. los resúmenes del historial) cuenta como la sesión BACKGROUND,
+que solo recibe un hueco cuando ninguna sesión está esperando. Si current_cancel tiene el evento de
+cancelación del turno, una generación cancelada mientras espera deja su sitio en la ronda sin
+llegar a ocupar un hueco.
+La espera de cada generación queda también en el registro del turno (turn_metrics), si lo hay.
+"""
+
+import contextvars
+import threading
+import time
+from collections import deque
+
+from turn_metrics import current_metrics
+
+current_session = contextvars.ContextVar("bertraco_session", default=None)
+current_cancel = contextvars.ContextVar("bertraco_cancel", default=None)
+
+BACKGROUND = "_fondo"
+
+
+class Overloaded(RuntimeError):
+    def __init__(self, message: str, retry_after_s: float, scope: str):
+        super().__init__(message)
+        self.retry_after_s = retry_after_s
+        self.scope = scope  # "session" o "server"
+
+
+class FairScheduler:
+    def __init__(self, max_concurrent: int = 1, max_queue_depth: int = 32, max_session_depth: int = 2,
+                 stats_window: int = 500):
+        if max_concurrent < 1:
+            raise ValueError("max_concurrent debe ser al menos 1")
+        self.max_concurrent = max_concurrent
+        self.max_queue_depth = max_queue_depth
+        self.max_session_depth = max_session_depth
+        self.in_flight = 0
+        self._waiters = {}  # sesión -> deque de [concedido]
+        self._rotation = deque()  # sesiones con peticiones esperando, en orden de turno
+        self._pending = {}  # sesión -> mensajes admitidos y sin terminar
+        self._cond = threading.Condition()
+        self.counters = {"admitted": 0, "rejected_session": 0, "rejected_server": 0, "grants": 0,
+                         "max_in_flight": 0, "max_waiting": 0}
+        self.wait_s = deque(maxlen=stats_window)
+        self.stream_s = deque(maxlen=stats_window)
+
+    # -------------------- Admisión --------------------
+    def admit(self, session):
+        """Reserva sitio para un mensaje de session o lanza Overloaded. Luego hay que llamar a done()."""
+        with self._cond:
+            pending = self._pending.get(session, 0)
+            total = sum(self._pending.values())
+            if pending >= self.max_session_depth:
+                self.counters["rejected_session"] += 1
+                raise Overloaded("La sesión ya tiene mensajes pendientes", self._retry_after(pending), "session")
+            if total >= self.max_queue_depth:
+                self.counters["rejected_server"] += 1
+                raise Overloaded("El servidor está saturado", self._retry_after(total), "server")
+            self._pending[session] = pending + 1
+            self.counters["admitted"] += 1
+
+    def done(self, session):
+        """El mensaje admitido de session ya se ha atendido (o descartado)."""
+        with self._cond:
+            pending = self._pending.get(session, 0) - 1
+            if pending > 0:
+                self._pending[session] = pending
+            else:
+                self._pending.pop(session, None)
+
+    def forget(self, session):
+        """Suelta todo lo admitido de una sesión que se cierra."""
+        with self._cond:
+            self._pending.pop(session, None)
+
+    def _retry_after(self, backlog) -> float:
+        # Se llama con self._cond adquirido
+        mean = sum(self.stream_s) / len(self.stream_s) if self.stream_s else 5.0
+        return max(1.0, round(mean * (backlog + 1) / self.max_concurrent, 1))
+
+    # -------------------- Huecos de generación --------------------
+    def acquire(self, session, cancel: threading.Event = None):
+        """
+        Espera un hueco para generar. Devuelve los segundos de espera, o None si cancel se activó
+        antes de conseguirlo (entonces no hay nada que liberar).
+        """
+        start = time.perf_counter()
+        with self._cond:
+            if cancel is not None and cancel.is_set():
+                return None
+            if self.in_flight < self.max_concurrent and not self._rotation:
+                self._grant()
+            else:
+                ticket = [False]
+                waiters = self._waiters.setdefault(session, deque())
+                if not waiters:
+                    self._rotation.append(session)
+                waiters.append(ticket)
+                waiting = sum(len(w) for w in self._waiters.values())
+                self.counters["max_waiting"] = max(self.counters["max_waiting"], waiting)
+                while not ticket[0]:
+                    if cancel is not None and cancel.is_set():
+                        self._withdraw(session, ticket)
+                        return None
+                    # Con cancel se mira de vez en cuando: el evento no avisa a la condición
+                    self._cond.wait(None if cancel is None else 0.05)
+            waited = time.perf_counter() - start
+            self.wait_s.append(waited)
+        return waited
+
+    def release(self, stream_s: float = None):
+        with self._cond:
+            self.in_flight -= 1
+            if stream_s is not None:
+                self.stream_s.append(stream_s)
+            while self._rotation and self.in_flight < self.max_concurrent:
+                session = self._next_session()
+                waiters = self._waiters[session]
+                waiters.popleft()[0] = True
+                self._grant()
+                if waiters:
+                    # Al final de la ronda: las demás sesiones van antes
+                    self._rotation.append(session)
+                else:
+                    del self._waiters[session]
+            self._cond.notify_all()
+
+    def _withdraw(self, session, ticket):
+        # Se llama con self._cond adquirido: quita una petición que aún no tenía hueco
+        waiters = self._waiters[session]
+        waiters.remove(ticket)
+        if not waiters:
+            del self._waiters[session]
+            self._rotation.remove(session)
+
+    def _next_session(self):
+        # Se llama con self._cond adquirido: la primera sesión de la ronda, BACKGROUND la última
+        for session in self._rotation:
+            if session != BACKGROUND:
+                self._rotation.remove(session)
+                return session
+        return self._rotation.popleft()
+
+    def _grant(self):
+        # Se llama con self._cond adquirido
+        self.in_flight += 1
+        self.counters["grants"] += 1
+        self.counters["max_in_flight"] = max(self.counters["max_in_flight"], self.in_flight)
+
+    def stats(self) -> dict:
+        with self._cond:
+            waits = sorted(self.wait_s)
+            return dict(
+                self.counters,
+                max_concurrent=self.max_concurrent,
+                in_flight=self.in_flight,
+                waiting=sum(len(w) for w in self._waiters.values()),
+                sessions_waiting=len(self._rotation),
+                pending=sum(self._pending.values()),
+                wait_mean_s=sum(waits) / len(waits) if waits else 0.0,
+                wait_p95_s=waits[int(0.95 * (len(waits) - 1))] if waits else 0.0,
+                wait_max_s=waits[-1] if waits else 0.0,
+                stream_mean_s=sum(self.stream_s) / len(self.stream_s) if self.stream_s else 0.0,
+            )
+
+
+class ScheduledLLM:
+    """Cliente del LLM que pide hueco a un FairScheduler antes de cada generación."""
+
+    def __init__(self, llm, scheduler: FairScheduler):
+        self.llm = llm
+        self.scheduler = scheduler
+
+    def stream(self, mensajes, **extra):
+        session = current_session.get() or BACKGROUND
+        cancel = current_cancel.get()
+        waited = self.scheduler.acquire(session, cancel)
+        if waited is None:
+            return
+        if cancel is not None and cancel.is_set():
+            # El hueco llegó a la vez que la cancelación
+            self.scheduler.release()
+            return
+        record = current_metrics.get()
+        if record is not None:
+            record["llm_wait_s"] = waited
+        start = time.perf_counter()
+        try:
+            yield from self.llm.stream(mensajes, **extra)
+        finally:
+            self.scheduler.release(time.perf_counter() - start)
+
+    def invoke(self, mensajes) -> str:
+        return "".join(self.stream(mensajes))
+
+    def __getattr__(self, name):
+        # warm_up, keep_alive, stats... del cliente envuelto
+        return getattr(self.llm, name)
@@ -0,0 +1,123 @@
+"""
+model_warmup.py
+
+Calentamiento del modelo al arrancar y keep-alive mientras la cara está despierta.
+
+El primer mensaje tras arrancar pagaba la carga de qwen:0.5b en Ollama, y tras un rato sin uso el
+servidor puede volver a descargarlo. ModelWarmer:
+  - nada más abrir la ventana, en un hilo aparte, carga el modelo y evalúa el prefijo fijo del
+    prompt (sistema + ejemplos), con la cara en estado "thinking" hasta que termina;
+  - mientras la cara no esté dormida, renueva el keep_alive del modelo cada ping_interval_s con
+    una petición vacía (no evalúa nada, así que no pisa la caché KV del prefijo);
+  - etiqueta el tiempo hasta el primer token de cada turno como "cold" o "warm" según si el
+    modelo debería seguir cargado, y lo escribe en el log.
+
+Solo funciona con clientes que tengan warm_up() (OllamaChatClient). Con el Ollama de langchain
+no hace nada y todos los turnos cuentan como fríos.
+"""
+
+import re
+import threading
+import time
+
+_DURATION_RE = re.compile(r"^\s*(-?\d+(?:\.\d+)?)\s*([smh]?)\s*$")
+_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600}
+
+
+def keep_alive_seconds(value):
+    """Convierte un keep_alive de Ollama ("30m", "1h", 300...) a segundos (None si es para siempre)."""
+    if value is None:
+        return 5 * 60  # valor por defecto del servidor
+    if isinstance(value, (int, float)):
+        seconds = float(value)
+    else:
+        match = _DURATION_RE.match(str(value))
+        if not match:
+            return 5 * 60
+        seconds = float(match.group(1)) * _UNITS[match.group(2)]
+    return None if seconds < 0 else seconds
+
+
+class ModelWarmer:
+    def __init__(self, llm, face, prime_messages=None, ping_interval_s: float = 60.0):
+        self.llm = llm
+        self.face = face
+        self.prime_messages = list(prime_messages) if prime_messages else None
+        self.ping_interval_s = ping_interval_s
+        self.supported = hasattr(llm, "warm_up")
+        self.keep_alive_s = keep_alive_seconds(getattr(llm, "keep_alive", None))
+        self.warm = threading.Event()
+        self.warmup_s = None
+        self.pings = 0
+        self.errors = 0
+        self._last_contact = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.ttft_s = {"cold": [], "warm": []}
+
+    def start(self):
+        if not self.supported:
+            # Sin calentamiento no hay nada que esperar
+            self.face.after(0, self.face.stop_thinking)
+            return self
+        self.face.after(0, self.face.start_thinking)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        try:
+            self.warmup_s = self.llm.warm_up(self.prime_messages)
+            self._last_contact = time.monotonic()
+            self.warm.set()
+            print(f"Modelo cargado en {self.warmup_s:.2f}s")
+        except Exception as e:
+            self.errors += 1
+            print(f"No se pudo calentar el modelo: {e}")
+        finally:
+            self.face.after(0, self.face.stop_thinking)
+
+        while not self._stop.wait(self.ping_interval_s):
+            # Dormida, se deja que el servidor descargue el modelo cuando venza el keep_alive
+            if self.face.state == "sleeping":
+                continue
+            try:
+                self.llm.warm_up()
+                self._last_contact = time.monotonic()
+                self.pings += 1
+            except Exception as e:
+                self.errors += 1
+                print(f"Error en el keep-alive del modelo: {e}")
+
+    def is_warm(self) -> bool:
+        """True si el modelo debería seguir cargado en el servidor."""
+        if self._last_contact is None:
+            return False
+        if self.keep_alive_s is None:
+            return True
+        return time.monotonic() - self._last_contact < self.keep_alive_s
+
+    def observe_ttft(self, seconds: float):
+        """Registra el TTFT de un turno como frío o caliente. Llamar justo al recibir el primer token."""
+        label = "warm" if self.is_warm() else "cold"
+        self.ttft_s[label].append(seconds)
+        # La petición del turno también renueva el keep_alive
+        self._last_contact = time.monotonic()
+        print(f"TTFT ({label}): {seconds:.2f}s")
+
+    def stats(self) -> dict:
+        def mean(values):
+            return sum(values) / len(values) if values else None
+        return {
+            "supported": self.supported,
+            "warmup_s": self.warmup_s,
+            "pings": self.pings,
+            "errors": self.errors,
+            "ttft_cold_s": mean(self.ttft_s["cold"]),
+            "ttft_warm_s": mean(self.ttft_s["warm"]),
+            "turns_cold": len(self.ttft_s["cold"]),
+            "turns_warm": len(self.ttft_s["warm"]),
+        }
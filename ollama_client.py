@@ -0,0 +1,216 @@
+"""
+ollama_client.py
+
+Cliente asyncio de streaming para la API de chat de Ollama (/api/chat).
+
+A diferencia de langchain_community.llms.Ollama, que abre una petición por turno desde un hilo
+bloqueante y aplana los mensajes en un único prompt:
+  - usa un único httpx.AsyncClient (a través del paquete ollama) con conexiones keep-alive
+    reutilizadas entre turnos;
+  - tiene timeouts de conexión y de lectura configurables;
+  - limita las peticiones simultáneas;
+  - mide el tiempo hasta el primer token (TTFT) de cada respuesta.
+
+stream(mensajes) es síncrono y devuelve los fragmentos de texto igual que llm.stream(), así que
+los chat_loop lo usan sin cambios. Por dentro, el bucle de eventos vive en un hilo propio durante
+toda la sesión para que el pool de conexiones sobreviva entre turnos.
+"""
+
+import asyncio
+import os
+import queue
+import threading
+import time
+
+import httpx
+import ollama
+
+DEFAULT_MODEL = "qwen:0.5b"
+DEFAULT_KEEP_ALIVE = "30m"
+
+# langchain usa "human"/"ai"/"system"; la API de chat usa "user"/"assistant"/"system"
+_ROLES = {"human": "user", "ai": "assistant", "system": "system", "user": "user", "assistant": "assistant"}
+
+_DONE = object()
+
+
+def to_chat_messages(mensajes) -> list:
+    """Convierte mensajes de langchain (o dicts role/content) al formato de la API de chat."""
+    out = []
+    for m in mensajes:
+        if isinstance(m, dict):
+            out.append({"role": m["role"], "content": m["content"]})
+        else:
+            out.append({"role": _ROLES[m.type], "content": m.content})
+    return out
+
+
+class OllamaChatClient:
+    def __init__(self, model: str = DEFAULT_MODEL, host: str = None, connect_timeout: float = 5.0,
+                 read_timeout: float = 120.0, max_concurrent: int = 1, keep_alive=None, options: dict = None):
+        self.model = model
+        self.host = host
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_concurrent = max_concurrent
+        # Cuánto tiempo mantiene Ollama el modelo en memoria tras la petición (p. ej. "10m")
+        self.keep_alive = keep_alive
+        self.options = options
+        self.requests = 0
+        self.errors = 0
+        self.last_ttft_s = None
+        self.ttft_s = []
+        self._client = None
+        self._semaphore = None
+        self._loop = None
+        self._loop_thread = None
+        self._loop_lock = threading.Lock()
+
+    # -------------------- API asyncio --------------------
+    def _ensure_client(self):
+        if self._client is None:
+            self._client = ollama.AsyncClient(
+                host=self.host,
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(max_connections=self.max_concurrent,
+                                    max_keepalive_connections=self.max_concurrent,
+                                    keepalive_expiry=300.0),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        return self._client
+
+    async def astream(self, mensajes, **extra):
+        """Genera los fragmentos de texto de la respuesta según llegan del servidor."""
+        client = self._ensure_client()
+        async with self._semaphore:
+            started = time.perf_counter()
+            first = True
+            self.requests += 1
+            try:
+                kwargs = {"keep_alive": self.keep_alive} if self.keep_alive is not None else {}
+                kwargs.update(extra)
+                respuesta = await client.chat(model=self.model, messages=to_chat_messages(mensajes),
+                                              stream=True, options=self.options, **kwargs)
+                async for parte in respuesta:
+                    texto = parte.message.content if parte.message else ""
+                    if not texto:
+                        continue
+                    if first:
+                        self.last_ttft_s = time.perf_counter() - started
+                        self.ttft_s.append(self.last_ttft_s)
+                        first = False
+                    yield texto
+            except Exception:
+                self.errors += 1
+                raise
+
+    async def awarm_up(self, mensajes=None) -> float:
+        """
+        Carga el modelo en el servidor y renueva su keep_alive. Si se pasan mensajes (p. ej. el
+        prefijo fijo del prompt) se evalúan generando un solo token, para que su caché KV quede
+        lista para el primer turno. Devuelve los segundos que tardó.
+        """
+        client = self._ensure_client()
+        async with self._semaphore:
+            started = time.perf_counter()
+            kwargs = {"keep_alive": self.keep_alive} if self.keep_alive is not None else {}
+            options = dict(self.options or {}, num_predict=1) if mensajes else self.options
+            respuesta = await client.chat(model=self.model, messages=to_chat_messages(mensajes or []),
+                                          stream=True, options=options, **kwargs)
+            async for _ in respuesta:
+                pass
+            return time.perf_counter() - started
+
+    async def aclose(self):
+        if self._client is not None:
+            # Las versiones antiguas del paquete ollama no tienen close()
+            close = getattr(self._client, "close", None)
+            await (close() if close else self._client._client.aclose())
+            self._client = None
+
+    # -------------------- Fachada síncrona (drop-in de llm.stream) --------------------
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def _get_loop(self):
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(target=self._run_loop, daemon=True)
+                self._loop_thread.start()
+            return self._loop
+
+    def submit(self, coro):
+        """Ejecuta una corrutina en el bucle del cliente y devuelve un concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self._get_loop())
+
+    def stream(self, mensajes, **extra):
+        """Versión bloqueante de astream(): itera los fragmentos desde cualquier hilo."""
+        salida = queue.Queue()
+
+        async def bombear():
+            try:
+                async for texto in self.astream(mensajes, **extra):
+                    salida.put(texto)
+            except BaseException as e:
+                salida.put(e)
+            finally:
+                salida.put(_DONE)
+
+        future = self.submit(bombear())
+        try:
+            while True:
+                item = salida.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # Si quien consume deja de iterar (p. ej. turno cancelado) se corta la petición
+            future.cancel()
+
+    def invoke(self, mensajes) -> str:
+        return "".join(self.stream(mensajes))
+
+    def warm_up(self, mensajes=None, timeout: float = None) -> float:
+        """Versión bloqueante de awarm_up()."""
+        return self.submit(self.awarm_up(mensajes)).result(timeout=timeout)
+
+    def close(self):
+        if self._loop is not None:
+            self.submit(self.aclose()).result(timeout=5)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "last_ttft_s": self.last_ttft_s,
+            "mean_ttft_s": sum(self.ttft_s) / len(self.ttft_s) if self.ttft_s else None,
+        }
+
+
+def llm_concurrency() -> int:
+    """Generaciones simultáneas contra Ollama (BERTRACO_LLM_CONCURRENCY)."""
+    return max(1, int(os.environ.get("BERTRACO_LLM_CONCURRENCY", "1")))
+
+
+def make_llm(model: str = DEFAULT_MODEL):
+    """
+    Modelo para los chat_loop. Por defecto el cliente asyncio; BERTRACO_LLM_CLIENT=langchain
+    vuelve al langchain_community.llms.Ollama de siempre.
+
+    El cliente asyncio pide a Ollama que mantenga el modelo cargado entre turnos
+    (BERTRACO_KEEP_ALIVE, por defecto 30m): mientras siga cargado, la caché KV del prefijo común
+    (sistema + ejemplos, ver prompt_prefix) se reutiliza y no se vuelve a evaluar.
+
+    BERTRACO_LLM_CONCURRENCY (por defecto 1) fija cuántas generaciones manda a la vez; en el
+    servidor conviene igualarlo a OLLAMA_NUM_PARALLEL.
+    """
+    if os.environ.get("BERTRACO_LLM_CLIENT", "async") == "langchain":
+        from langchain_community.llms import Ollama
+        return Ollama(model=model)
+    return OllamaChatClient(model=model, keep_alive=os.environ.get("BERTRACO_KEEP_ALIVE", DEFAULT_KEEP_ALIVE),
+                            max_concurrent=llm_concurrency())
@@ -0,0 +1,56 @@
+"""
+prompt_prefix.py
+
+Reutilización del prefijo fijo del prompt (mensaje de sistema + ejemplos few-shot).
+
+prompt_final.format_messages() vuelve a renderizar el sistema y todos los ejemplos en cada turno.
+PromptPrefix los renderiza una sola vez y luego solo añade el historial y la pregunta, de modo que
+el principio de cada petición es idéntico byte a byte entre turnos. Con la API de chat, Ollama
+reutiliza la caché KV del prefijo común de la petición anterior mientras el modelo siga cargado
+(ver keep_alive en ollama_client), así que ese prefijo no se vuelve a evaluar.
+
+También guarda el tiempo hasta el primer token con el modo activado y desactivado para poder
+compararlos (BERTRACO_PROMPT_PREFIX=0 lo desactiva).
+"""
+
+import hashlib
+import os
+
+from langchain_core.messages import HumanMessage
+
+
+class PromptPrefix:
+    def __init__(self, prompt, enabled: bool = None):
+        if enabled is None:
+            enabled = os.environ.get("BERTRACO_PROMPT_PREFIX", "1") != "0"
+        self.prompt = prompt
+        self.enabled = enabled
+        # Con historial vacío, todo menos la última pregunta es la parte fija
+        rendered = prompt.format_messages(pregunta="", mensaje_usuario="", historial=[])
+        self.messages = tuple(rendered[:-1])
+        self.fingerprint = hashlib.sha1(
+            "\n".join(f"{m.type}:{m.content}" for m in self.messages).encode("utf-8")
+        ).hexdigest()[:12]
+        self.ttft_s = {True: [], False: []}
+
+    def format_messages(self, pregunta, historial) -> list:
+        """Mismo resultado que prompt.format_messages(), reutilizando el prefijo si está activo."""
+        if not self.enabled:
+            return self.prompt.format_messages(pregunta=pregunta, mensaje_usuario=pregunta, historial=historial)
+        return [*self.messages, *historial, HumanMessage(content=pregunta)]
+
+    def observe_ttft(self, seconds: float):
+        self.ttft_s[self.enabled].append(seconds)
+
+    def stats(self) -> dict:
+        def mean(values):
+            return sum(values) / len(values) if values else None
+        return {
+            "enabled": self.enabled,
+            "prefix_messages": len(self.messages),
+            "fingerprint": self.fingerprint,
+            "ttft_on_s": mean(self.ttft_s[True]),
+            "ttft_off_s": mean(self.ttft_s[False]),
+            "turns_on": len(self.ttft_s[True]),
+            "turns_off": len(self.ttft_s[False]),
+        }
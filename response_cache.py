@@ -0,0 +1,214 @@
+"""
+response_cache.py
+
+Caché de respuestas para preguntas repetidas o casi repetidas.
+
+En el quiosco llegan cientos de veces al día los mismos saludos ("hola, como estas?") y cada uno
+iba al LLM. ResponseCache guarda la respuesta indexada por la pregunta normalizada (minúsculas,
+sin tildes ni signos) y una huella del historial reciente, de modo que la misma pregunta en otro
+punto de la conversación no comparte respuesta.
+
+  - Nivel exacto: misma pregunta normalizada y misma huella.
+  - Nivel difuso (opcional, fuzzy_threshold): similitud de n-gramas de caracteres (Dice) con las
+    preguntas guardadas bajo la misma huella.
+  - Expulsión LRU (max_entries) y por antigüedad (ttl_s).
+  - Persistencia en disco en JSON (escritura atómica), para que sobreviva a reinicios.
+
+iter_chunks() trocea una respuesta guardada en fragmentos tipo LLM, para que pase por el mismo
+camino de la cara y el audio que una respuesta generada.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+_PUNCT_RE = re.compile(r"[^\w\s]")
+_SPACE_RE = re.compile(r"\s+")
+_CHUNK_RE = re.compile(r"\s*\S+\s*")
+
+_CACHE_FORMAT_VERSION = 1
+
+
+def normalize_question(text: str) -> str:
+    """Minúsculas, sin tildes, sin signos de puntuación y con los espacios colapsados."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = _PUNCT_RE.sub(" ", text)
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+def history_fingerprint(historial, turns: int = 1) -> str:
+    """Huella de los últimos `turns` intercambios del historial (lista de mensajes)."""
+    if turns <= 0:
+        return ""
+    recientes = historial[-2 * turns:]
+    if not recientes:
+        return ""
+    h = hashlib.sha1()
+    for m in recientes:
+        h.update(f"{m.type}\x00{m.content}\x01".encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def char_ngrams(text: str, n: int = 3) -> frozenset:
+    padded = f" {text} "
+    if len(padded) <= n:
+        return frozenset([padded])
+    return frozenset(padded[i:i + n] for i in range(len(padded) - n + 1))
+
+
+def iter_chunks(text: str):
+    """Trocea una respuesta en fragmentos de una palabra (con sus espacios), como llm.stream()."""
+    yield from _CHUNK_RE.findall(text)
+
+
+class ResponseCache:
+    def __init__(self, path: str = None, max_entries: int = 256, ttl_s: float = 24 * 3600,
+                 fuzzy_threshold: float = None, ngram: int = 3, history_turns: int = 1,
+                 save_every: int = 8):
+        """
+        path: fichero JSON donde persistir la caché (None = solo en memoria).
+        fuzzy_threshold: similitud mínima (0-1) para el nivel difuso; None lo desactiva.
+        history_turns: cuántos intercambios recientes forman parte de la clave.
+        save_every: cada cuántas inserciones se vuelca a disco (además de en close()).
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.fuzzy_threshold = fuzzy_threshold
+        self.ngram = ngram
+        self.history_turns = history_turns
+        self.save_every = save_every
+        # (pregunta normalizada, huella) -> {"value", "created"}; el orden es el de uso (LRU)
+        self._entries = OrderedDict()
+        self._ngrams = {}
+        self._dirty = 0
+        self._lock = threading.Lock()
+        # Un save() cada vez: las sesiones del servidor comparten el fichero temporal
+        self._save_lock = threading.Lock()
+        self.counters = {"hits_exact": 0, "hits_fuzzy": 0, "misses": 0, "stores": 0,
+                         "expired": 0, "evicted": 0}
+        if path:
+            self._load()
+
+    def _key(self, question, historial):
+        return normalize_question(question), history_fingerprint(historial, self.history_turns)
+
+    def _expired(self, entry, now) -> bool:
+        return self.ttl_s is not None and now - entry["created"] > self.ttl_s
+
+    def get(self, question: str, historial=()):
+        """Devuelve el valor guardado para la pregunta, o None si no hay (o ha caducado)."""
+        key = self._key(question, historial)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry, now):
+                    self._entries.move_to_end(key)
+                    self.counters["hits_exact"] += 1
+                    return entry["value"]
+                self._remove(key)
+                self.counters["expired"] += 1
+            if self.fuzzy_threshold is not None:
+                found = self._fuzzy_lookup(key, now)
+                if found is not None:
+                    self._entries.move_to_end(found)
+                    self.counters["hits_fuzzy"] += 1
+                    return self._entries[found]["value"]
+            self.counters["misses"] += 1
+            return None
+
+    def _fuzzy_lookup(self, key, now):
+        # Se llama con self._lock adquirido
+        text, fingerprint = key
+        grams = char_ngrams(text, self.ngram)
+        best, best_score = None, self.fuzzy_threshold
+        for other, entry in list(self._entries.items()):
+            if other[1] != fingerprint:
+                continue
+            if self._expired(entry, now):
+                self._remove(other)
+                self.counters["expired"] += 1
+                continue
+            other_grams = self._ngrams[other]
+            score = 2 * len(grams & other_grams) / (len(grams) + len(other_grams))
+            if score >= best_score:
+                best, best_score = other, score
+        return best
+
+    def put(self, question: str, historial, value):
+        """Guarda el valor (cualquier cosa serializable en JSON) para la pregunta."""
+        if not value:
+            return
+        key = self._key(question, historial)
+        with self._lock:
+            self._entries[key] = {"value": value, "created": time.time()}
+            self._entries.move_to_end(key)
+            self._ngrams[key] = char_ngrams(key[0], self.ngram)
+            self.counters["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.counters["evicted"] += 1
+            self._dirty += 1
+            save = self.path and self._dirty >= self.save_every
+        if save:
+            self.save()
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        self._ngrams.pop(key, None)
+
+    # -------------------- Persistencia --------------------
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"No se pudo leer la caché de respuestas {self.path}: {e}")
+            return
+        if data.get("version") != _CACHE_FORMAT_VERSION:
+            return
+        now = time.time()
+        for text, fingerprint, entry in data.get("entries", []):
+            if self._expired(entry, now):
+                continue
+            key = (text, fingerprint)
+            self._entries[key] = entry
+            self._ngrams[key] = char_ngrams(text, self.ngram)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def save(self):
+        if not self.path:
+            return
+        with self._save_lock:
+            with self._lock:
+                data = {
+                    "version": _CACHE_FORMAT_VERSION,
+                    "entries": [[k[0], k[1], e] for k, e in self._entries.items()],
+                }
+                self._dirty = 0
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(tmp, self.path)
+            except OSError as e:
+                print(f"No se pudo guardar la caché de respuestas {self.path}: {e}")
+
+    def close(self):
+        if self._dirty:
+            self.save()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counters, entries=len(self._entries))
@@ -0,0 +1,87 @@
+"""
+sentence_stream.py
+
+Corta en frases (o cláusulas) un texto que llega en fragmentos desde el LLM.
+
+BERTraco_voice_translate.py lo usa para traducir cada frase en cuanto está completa, mientras
+el modelo sigue generando, en lugar de esperar a tener la respuesta entera.
+
+  - Fin de frase: ".", "!", "?" o "…" (con comillas o paréntesis de cierre opcionales) seguido de
+    espacio o salto de línea. No corta en abreviaturas conocidas ("Mr.", "e.g.") ni en números
+    ("3.5" no lleva espacio detrás). "No." solo es abreviatura delante de un número ("No. 5") y una
+    mayúscula suelta solo es una inicial delante de un nombre ("J. Smith"); "I said no." o
+    "It was I." sí cortan. Si aún no ha llegado la palabra siguiente, se espera a verla.
+  - Fin de cláusula: ",", ";" o ":" seguido de espacio, solo si el trozo ya tiene min_clause_chars;
+    así las frases largas empiezan a traducirse antes sin mandar al traductor trozos sueltos.
+  - Si se pasa de max_chars sin ningún corte, se corta en el último espacio.
+"""
+
+import re
+
+_SENTENCE_END_RE = re.compile(r"[.!?…]+[\"')\]]*(?=\s)")
+_CLAUSE_END_RE = re.compile(r"[,;:](?=\s)")
+
+ABBREVIATIONS_EN = frozenset({
+    "mr", "mrs", "ms", "dr", "prof", "sr", "jr", "st", "vs", "etc", "e.g", "i.e", "approx",
+})
+# Abreviaturas que solo lo son delante de un número ("No. 5")
+NUMBER_ABBREVIATIONS = frozenset({"no"})
+
+ABBREVIATIONS_ES = frozenset({
+    "sr", "sra", "srta", "dr", "dra", "prof", "lic", "ing", "etc", "ej", "p.ej", "aprox", "núm", "pág", "ud", "uds",
+})
+
+
+class SentenceSegmenter:
+    def __init__(self, min_clause_chars: int = 40, max_chars: int = 200,
+                 abbreviations=ABBREVIATIONS_EN):
+        self.min_clause_chars = min_clause_chars
+        self.max_chars = max_chars
+        self.abbreviations = abbreviations
+        self._buffer = ""
+
+    def feed(self, chunk: str) -> list:
+        """Añade un fragmento y devuelve las frases que ya están completas (puede ser [])."""
+        self._buffer += chunk
+        segments = []
+        while True:
+            cut = self._find_cut()
+            if cut is None:
+                break
+            segment, self._buffer = self._buffer[:cut].strip(), self._buffer[cut:].lstrip()
+            if segment:
+                segments.append(segment)
+        return segments
+
+    def flush(self) -> list:
+        """Devuelve lo que quede pendiente al terminar la respuesta."""
+        segment, self._buffer = self._buffer.strip(), ""
+        return [segment] if segment else []
+
+    def _find_cut(self):
+        text = self._buffer
+        for match in _SENTENCE_END_RE.finditer(text):
+            if not self._is_abbreviation(text, match.start(), match.end()):
+                return match.end()
+        if len(text) >= self.min_clause_chars:
+            for match in _CLAUSE_END_RE.finditer(text, self.min_clause_chars - 1):
+                return match.end()
+        if len(text) > self.max_chars:
+            space = text.rfind(" ", 0, self.max_chars)
+            if space > 0:
+                return space
+        return None
+
+    def _is_abbreviation(self, text: str, dot: int, end: int) -> bool:
+        if text[dot] != ".":
+            return False
+        word = text[:dot].rsplit(None, 1)[-1] if text[:dot].strip() else ""
+        if word.lower() in self.abbreviations:
+            return True
+        following = text[end:].split(None, 1)
+        next_word = following[0] if following else None
+        if word.lower() in NUMBER_ABBREVIATIONS:
+            return next_word is None or next_word[0].isdigit()
+        if len(word) == 1 and word.isupper() and word != "I":
+            return next_word is None or next_word[0].isupper()
+        return False
@@ -0,0 +1,152 @@
+"""
+speech_queue.py
+
+Cola acotada de trabajo para el hilo de audio.
+
+Sustituye al queue.Queue sin límite de palabras sueltas:
+  - las palabras cortas que llegan seguidas se fusionan en frases (menos llamadas al sintetizador
+    y menos fundidos entre palabras);
+  - cuando la cola está llena se aplica una política: "block" (el productor espera),
+    "drop_oldest" (se descarta lo más antiguo) o "summary" (lo más antiguo se resume en una
+    sola sílaba, para que siga sonando algo en vez de acumular retraso);
+  - flush() descarta de golpe todo lo pendiente del turno actual, sin bucles de get().
+
+Mantiene put()/get()/empty()/task_done()/join() de queue.Queue, y put(None) sigue siendo la señal
+de fin. join() espera también a la entrada que el hilo de audio ya sacó y aún está sintetizando:
+"cola vacía" no quiere decir que el audio esté listo.
+"""
+
+import threading
+import time
+from collections import deque
+
+POLICIES = ("block", "drop_oldest", "summary")
+
+
+class SpeechQueue:
+    def __init__(self, max_items: int = 32, merge_chars: int = 24, policy: str = "summary"):
+        if policy not in POLICIES:
+            raise ValueError(f"Política desconocida: {policy}. Opciones: {', '.join(POLICIES)}")
+        if max_items < 2:
+            raise ValueError("max_items debe ser al menos 2")
+        self.max_items = max_items
+        self.merge_chars = merge_chars
+        self.policy = policy
+        self._items = deque()
+        self._closed = False
+        self._generation = 0
+        self._taken_generation = 0
+        # Entradas en la cola más las sacadas con get() sin su task_done()
+        self._unfinished = 0
+        self._cond = threading.Condition()
+        self.counters = {"put": 0, "merged": 0, "dropped": 0, "summarized": 0, "flushed": 0,
+                         "max_depth": 0}
+
+    def put(self, text, timeout=None) -> bool:
+        """
+        Añade texto a la cola. Devuelve False si se descartó (cola cerrada, o timeout con "block").
+        """
+        if text is None:
+            self.close()
+            return True
+        with self._cond:
+            if self._closed:
+                return False
+            self.counters["put"] += 1
+            # Fusiona con la última entrada si todavía es corta
+            if self._items and len(self._items[-1]) < self.merge_chars:
+                self._items[-1] += text
+                self.counters["merged"] += 1
+                self._cond.notify_all()
+                return True
+            if len(self._items) >= self.max_items and not self._make_room(timeout):
+                return False
+            self._items.append(text)
+            self._unfinished += 1
+            self.counters["max_depth"] = max(self.counters["max_depth"], len(self._items))
+            self._cond.notify_all()
+            return True
+
+    def _make_room(self, timeout) -> bool:
+        # Se llama con self._cond adquirido y la cola llena
+        if self.policy == "block":
+            ok = self._cond.wait_for(lambda: len(self._items) < self.max_items or self._closed, timeout)
+            return ok and not self._closed
+        if self.policy == "drop_oldest":
+            self._items.popleft()
+            self._unfinished -= 1
+            self.counters["dropped"] += 1
+            return True
+        # "summary": las dos entradas más antiguas se quedan en una sola sílaba
+        first = self._items.popleft()
+        second = self._items.popleft()
+        syllable = (first.strip() or second.strip() or " ")[0] + " "
+        self._items.appendleft(syllable)
+        self._unfinished -= 1
+        self.counters["summarized"] += 1
+        return True
+
+    def get(self, timeout=None):
+        """
+        Devuelve la siguiente frase, o None cuando la cola está cerrada y vacía (o tras el timeout).
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not self._items:
+                if self._closed:
+                    return None
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            self._taken_generation = self._generation
+            text = self._items.popleft()
+            self._cond.notify_all()
+            return text
+
+    def flush(self) -> int:
+        """Descarta todo lo pendiente del turno. Devuelve cuántas entradas se descartaron."""
+        with self._cond:
+            flushed = len(self._items)
+            self._items.clear()
+            self._unfinished -= flushed
+            self._generation += 1
+            self.counters["flushed"] += flushed
+            self._cond.notify_all()
+            return flushed
+
+    def task_done(self):
+        """El consumidor terminó con la última entrada que sacó con get() (haya sonado o no)."""
+        with self._cond:
+            self._unfinished -= 1
+            self._cond.notify_all()
+
+    def join(self, timeout=None) -> bool:
+        """
+        Espera a que no quede nada en la cola ni a medio procesar. Devuelve False si se agota el
+        timeout.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self._unfinished <= 0, timeout)
+
+    def was_flushed(self) -> bool:
+        """True si hubo un flush() después del último get(): lo que se sacó ya no es de este turno."""
+        with self._cond:
+            return self._taken_generation != self._generation
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def empty(self) -> bool:
+        with self._cond:
+            return not self._items
+
+    def qsize(self) -> int:
+        with self._cond:
+            return len(self._items)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return dict(self.counters, depth=len(self._items), policy=self.policy)
@@ -0,0 +1,53 @@
+"""
+startup_profile.py
+
+Medición del arranque de los scripts de entrada (--profile-startup).
+
+Cada script crea un StartupProfiler antes de cualquier importación pesada y envuelve en step()
+cada importación y cada paso de inicialización, tanto en el hilo principal como en el de carga
+en segundo plano. report() devuelve una tabla con el instante de inicio (desde que se creó el
+profiler), la duración y el hilo de cada paso; los pasos anidados salen sangrados.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StartupProfiler:
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.records = []  # (inicio_s, duración_s o None si es una marca, nombre, hilo, nivel)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def step(self, name: str):
+        depth = getattr(self._local, "depth", 0)
+        self._local.depth = depth + 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._local.depth = depth
+            self._add(started, time.perf_counter() - started, name, depth)
+
+    def mark(self, name: str):
+        """Registra un instante (p. ej. "ventana visible") sin duración."""
+        self._add(time.perf_counter(), None, name, getattr(self._local, "depth", 0))
+
+    def _add(self, started, duration, name, depth):
+        with self._lock:
+            self.records.append((started - self.t0, duration, name, threading.current_thread().name, depth))
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.t0
+
+    def report(self) -> str:
+        with self._lock:
+            records = sorted(self.records, key=lambda r: r[0])
+        lines = [f"{'inicio':>9}  {'duración':>9}  {'hilo':<12}  paso"]
+        for started, duration, name, thread, depth in records:
+            shown = f"{duration * 1000:7.1f}ms" if duration is not None else f"{'—':>9}"
+            lines.append(f"{started * 1000:7.1f}ms  {shown}  {thread[:12]:<12}  {'  ' * depth}{name}")
+        return "\n".join(lines)
@@ -0,0 +1,166 @@
+"""
+translation_cache.py
+
+Memoria persistente de traducciones para translate_es_to_en / translate_en_to_es.
+
+Las traducciones de Argos son deterministas pero caras en CPU, y se repiten mucho (saludos del
+usuario, frases hechas del modelo). TranslationCache guarda cada traducción por frase, con la
+clave (dirección, versión del modelo, texto normalizado):
+
+  - trabaja por frases: un texto se corta con SentenceSegmenter y solo se traducen las frases
+    que no estén ya guardadas, así un texto nuevo reutiliza las frases conocidas;
+  - la versión del modelo (argos_model_version) sale del paquete de Argos instalado; si se
+    reinstala o actualiza, la clave cambia y las traducciones antiguas dejan de usarse solas
+    (retain_versions() además las borra del fichero);
+  - acotada (LRU, max_entries) y guardada en disco en JSON con escritura atómica;
+  - stats() da los aciertos por dirección.
+"""
+
+import json
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from sentence_stream import ABBREVIATIONS_EN, ABBREVIATIONS_ES, SentenceSegmenter
+
+_SPACE_RE = re.compile(r"\s+")
+
+_CACHE_FORMAT_VERSION = 1
+
+_ABBREVIATIONS = {"en": ABBREVIATIONS_EN, "es": ABBREVIATIONS_ES}
+
+
+def normalize_text(text: str) -> str:
+    """NFC y espacios colapsados. Se respetan mayúsculas y signos: cambian la traducción."""
+    return _SPACE_RE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def argos_package_version(pkg) -> str:
+    """
+    Identifica un paquete de Argos instalado: versión del paquete y de Argos, más la fecha de
+    modificación de su metadata.json (cambia al reinstalarlo).
+    """
+    try:
+        mtime = int(os.path.getmtime(os.path.join(pkg.package_path, "metadata.json")))
+    except OSError:
+        mtime = 0
+    return f"{pkg.package_version}/{pkg.argos_version}/{mtime}"
+
+
+def argos_model_version(from_code: str, to_code: str) -> str:
+    """argos_package_version() del paquete instalado para un par de idiomas."""
+    import argostranslate.package
+
+    for pkg in argostranslate.package.get_installed_packages():
+        if pkg.from_code == from_code and pkg.to_code == to_code:
+            return argos_package_version(pkg)
+    return "desconocida"
+
+
+class TranslationCache:
+    def __init__(self, path: str = None, max_entries: int = 4096, save_every: int = 32):
+        self.path = path
+        self.max_entries = max_entries
+        self.save_every = save_every
+        # (dirección, versión, frase normalizada) -> traducción; el orden es el de uso (LRU)
+        self._entries = OrderedDict()
+        self._dirty = 0
+        self._lock = threading.Lock()
+        # Serializa save(): el fichero temporal es uno por proceso, no por hilo
+        self._save_lock = threading.Lock()
+        self.counters = {}
+        if path:
+            self._load()
+
+    def translate(self, direction: str, version: str, text: str, translate_fn) -> str:
+        """
+        Traduce text ("es->en", "en->es"...) frase a frase, usando translate_fn solo para las
+        frases que no estén guardadas.
+        """
+        source = direction.split("->")[0]
+        segmenter = SentenceSegmenter(abbreviations=_ABBREVIATIONS.get(source, ABBREVIATIONS_EN))
+        segments = segmenter.feed(normalize_text(text)) + segmenter.flush()
+        out = []
+        for segment in segments:
+            key = (direction, version, segment)
+            with self._lock:
+                counters = self.counters.setdefault(direction, {"hits": 0, "misses": 0})
+                cached = self._entries.get(key)
+                if cached is not None:
+                    self._entries.move_to_end(key)
+                    counters["hits"] += 1
+            if cached is None:
+                cached = translate_fn(segment)
+                self._store(key, cached, counters)
+            out.append(cached)
+        return " ".join(out)
+
+    def _store(self, key, translation, counters):
+        with self._lock:
+            counters["misses"] += 1
+            self._entries[key] = translation
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty += 1
+            save = self.path and self._dirty >= self.save_every
+        if save:
+            self.save()
+
+    def retain_versions(self, versions: dict):
+        """Borra las traducciones de modelos que ya no están instalados. versions: {dirección: versión}."""
+        with self._lock:
+            stale = [k for k in self._entries if versions.get(k[0], k[1]) != k[1]]
+            for k in stale:
+                del self._entries[k]
+            if stale:
+                self._dirty += 1
+        return len(stale)
+
+    # -------------------- Persistencia --------------------
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"No se pudo leer la caché de traducciones {self.path}: {e}")
+            return
+        if data.get("version") != _CACHE_FORMAT_VERSION:
+            return
+        for direction, version, segment, translation in data.get("entries", [])[-self.max_entries:]:
+            self._entries[(direction, version, segment)] = translation
+
+    def save(self):
+        if not self.path:
+            return
+        with self._save_lock:
+            with self._lock:
+                data = {
+                    "version": _CACHE_FORMAT_VERSION,
+                    "entries": [[*k, t] for k, t in self._entries.items()],
+                }
+                self._dirty = 0
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(tmp, self.path)
+            except OSError as e:
+                print(f"No se pudo guardar la caché de traducciones {self.path}: {e}")
+
+    def close(self):
+        if self._dirty:
+            self.save()
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = {"entries": len(self._entries)}
+            for direction, c in self.counters.items():
+                total = c["hits"] + c["misses"]
+                out[direction] = dict(c, hit_rate=c["hits"] / total if total else 0.0)
+            return out
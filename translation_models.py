@@ -0,0 +1,249 @@
+"""
+translation_models.py
+
+Instalación y carga de los modelos de Argos sin depender de internet.
+
+setup_translation() actualizaba el índice de paquetes de Argos y descargaba los modelos si
+faltaban, y en cada arranque recorría todos los idiomas instalados para montar los traductores.
+Aquí:
+  - install_from_dirs() instala los .argosmodel de uno o varios directorios locales (o un
+    mirror montado en disco). El par de idiomas se lee del metadata.json de dentro del paquete,
+    no del nombre del fichero; si hay varias versiones se queda con la más alta;
+  - install_online() es la descarga de siempre, solo si se permite;
+  - load_translators() usa primero el manifiesto (un JSON pequeño con la ruta y la versión del
+    paquete que resolvió cada dirección la última vez) y carga esos paquetes directamente, sin
+    recorrer los idiomas instalados. Si el manifiesto no vale (otro Argos, paquete borrado o
+    reinstalado) hace la búsqueda normal y lo reescribe;
+  - si no hay modelos, lanza ModelsUnavailable y quien llama decide (la app sigue sin traducir).
+"""
+
+import json
+import os
+import zipfile
+
+from translation_cache import argos_package_version
+
+MANIFEST_VERSION = 1
+
+
+class ModelsUnavailable(RuntimeError):
+    """No hay traductor para alguna de las direcciones pedidas."""
+
+
+def _direction(from_code: str, to_code: str) -> str:
+    return f"{from_code}->{to_code}"
+
+
+def _version_key(version: str):
+    """"1.9.10" -> (1, 9, 10), para comparar versiones de paquetes."""
+    key = []
+    for part in str(version).split("."):
+        key.append(int(part) if part.isdigit() else 0)
+    return tuple(key)
+
+
+def read_package_metadata(path: str) -> dict:
+    """Lee el metadata.json de un .argosmodel (un zip con un directorio dentro)."""
+    with zipfile.ZipFile(path) as z:
+        name = next((n for n in z.namelist() if n.count("/") == 1 and n.endswith("/metadata.json")), None)
+        if name is None:
+            raise ValueError(f"{path} no tiene metadata.json")
+        return json.loads(z.read(name).decode("utf-8"))
+
+
+def find_local_packages(dirs) -> dict:
+    """{(from, to): (versión, ruta)} con el .argosmodel más reciente de cada par en dirs."""
+    found = {}
+    for directory in dirs:
+        try:
+            names = sorted(os.listdir(directory))
+        except FileNotFoundError:
+            continue
+        except OSError as e:
+            print(f"No se pudo leer el directorio de modelos {directory}: {e}")
+            continue
+        for name in names:
+            if not name.endswith(".argosmodel"):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                meta = read_package_metadata(path)
+            except (OSError, ValueError, zipfile.BadZipFile) as e:
+                print(f"Paquete de traducción no válido {path}: {e}")
+                continue
+            pair = (meta.get("from_code"), meta.get("to_code"))
+            version = meta.get("package_version", "0")
+            if pair not in found or _version_key(version) > _version_key(found[pair][0]):
+                found[pair] = (version, path)
+    return found
+
+
+def _installed_pairs():
+    import argostranslate.package
+
+    return {(p.from_code, p.to_code) for p in argostranslate.package.get_installed_packages()}
+
+
+def install_from_dirs(pairs, dirs) -> list:
+    """Instala desde dirs los pares que falten. Devuelve los pares instalados."""
+    import argostranslate.package
+
+    missing = [tuple(p) for p in pairs if tuple(p) not in _installed_pairs()]
+    if not missing or not dirs:
+        return []
+    local = find_local_packages(dirs)
+    installed = []
+    for pair in missing:
+        if pair not in local:
+            continue
+        version, path = local[pair]
+        print(f"Instalando {_direction(*pair)} {version} desde {path}")
+        argostranslate.package.install_from_path(path)
+        installed.append(pair)
+    return installed
+
+
+def install_online(pairs) -> list:
+    """Descarga del índice de Argos los pares que falten (necesita internet)."""
+    import argostranslate.package
+
+    missing = [tuple(p) for p in pairs if tuple(p) not in _installed_pairs()]
+    if not missing:
+        return []
+    argostranslate.package.update_package_index()
+    available = argostranslate.package.get_available_packages()
+    installed = []
+    for from_code, to_code in missing:
+        package = next((p for p in available if p.from_code == from_code and p.to_code == to_code), None)
+        if package is None:
+            continue
+        print(f"Instalando: {package.from_name} -> {package.to_name}")
+        package.install()
+        installed.append((from_code, to_code))
+    return installed
+
+
+# -------------------- Manifiesto --------------------
+def _argos_version() -> str:
+    try:
+        from importlib.metadata import version
+        return version("argostranslate")
+    except Exception:
+        return "desconocida"
+
+
+def _read_manifest(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"No se pudo leer el manifiesto de traductores {path}: {e}")
+        return None
+    if data.get("version") != MANIFEST_VERSION or data.get("argos") != _argos_version():
+        return None
+    return data
+
+
+def _write_manifest(path, entries):
+    data = {"version": MANIFEST_VERSION, "argos": _argos_version(), "pairs": entries}
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"No se pudo guardar el manifiesto de traductores {path}: {e}")
+
+
+def _load_from_manifest(path, pairs):
+    """Carga cada paquete del manifiesto sin pasar por get_installed_languages(). None si no vale."""
+    data = _read_manifest(path)
+    if data is None:
+        return None
+    import argostranslate.package
+    import argostranslate.translate
+
+    translators, versions = {}, {}
+    for from_code, to_code in pairs:
+        direction = _direction(from_code, to_code)
+        entry = data["pairs"].get(direction)
+        if entry is None:
+            return None
+        try:
+            pkg = argostranslate.package.Package(entry["package_path"])
+            if argos_package_version(pkg) != entry["model_version"]:
+                return None
+            translators[direction] = argostranslate.translate.PackageTranslation(
+                argostranslate.translate.Language(pkg.from_code, pkg.from_name),
+                argostranslate.translate.Language(pkg.to_code, pkg.to_name),
+                pkg,
+            )
+        except Exception as e:
+            print(f"Manifiesto de traductores desactualizado ({direction}): {e}")
+            return None
+        versions[direction] = entry["model_version"]
+    return translators, versions
+
+
+def _load_by_scan(pairs):
+    """La búsqueda de siempre entre los idiomas instalados. Devuelve también lo necesario para el manifiesto."""
+    import argostranslate.package
+    import argostranslate.translate
+
+    langs = {lang.code: lang for lang in argostranslate.translate.get_installed_languages()}
+    packages = {(p.from_code, p.to_code): p for p in argostranslate.package.get_installed_packages()}
+    translators, versions, entries = {}, {}, {}
+    for from_code, to_code in pairs:
+        direction = _direction(from_code, to_code)
+        translation = None
+        if from_code in langs and to_code in langs:
+            translation = langs[from_code].get_translation(langs[to_code])
+        if translation is None:
+            raise ModelsUnavailable(f"No hay modelo de traducción {direction}")
+        translators[direction] = translation
+        pkg = packages.get((from_code, to_code))
+        if pkg is not None:
+            versions[direction] = argos_package_version(pkg)
+            entries[direction] = {"package_path": str(pkg.package_path), "model_version": versions[direction]}
+        else:
+            # Traducción a través de otro idioma: funciona, pero no se puede cargar directamente
+            versions[direction] = "desconocida"
+    return translators, versions, entries
+
+
+def load_translators(pairs, manifest_path=None, model_dirs=(), online=False):
+    """
+    Devuelve ({dirección: traductor}, {dirección: versión del modelo}) para pairs
+    (p. ej. (("es", "en"), ("en", "es"))). Instala lo que falte desde model_dirs y, si online,
+    desde internet. Lanza ModelsUnavailable si aun así falta algún par.
+    """
+    pairs = [tuple(p) for p in pairs]
+    if manifest_path:
+        loaded = _load_from_manifest(manifest_path, pairs)
+        if loaded is not None:
+            return loaded
+
+    import argostranslate.translate
+
+    try:
+        translators, versions, entries = _load_by_scan(pairs)
+    except ModelsUnavailable as e:
+        print(f"{e}; buscando paquetes para instalar")
+        install_from_dirs(pairs, model_dirs)
+        if online:
+            try:
+                install_online(pairs)
+            except Exception as e:
+                print(f"No se pudieron descargar los modelos de traducción: {e}")
+        # get_installed_languages() guarda en caché lo que encontró la primera vez
+        cache_clear = getattr(argostranslate.translate.get_installed_languages, "cache_clear", None)
+        if cache_clear:
+            cache_clear()
+        translators, versions, entries = _load_by_scan(pairs)
+
+    if manifest_path and len(entries) == len(pairs):
+        _write_manifest(manifest_path, entries)
+    return translators, versions
@@ -0,0 +1,242 @@
+"""
+translation_service.py
+
+Traducción con Argos en un proceso aparte.
+
+translator.translate() dentro del hilo de chat compartía el GIL con Tk y con la síntesis de
+audio, y la cara se entrecortaba mientras traducía. TranslationService:
+  - arranca un proceso (spawn) que carga los traductores una sola vez;
+  - recibe las peticiones por una cola y las atiende por lotes: todo lo que haya esperando
+    (hasta batch_max) se traduce de una vez y vuelve en un solo mensaje;
+  - devuelve cada resultado en un concurrent.futures.Future (submit) o bloqueando (translate);
+  - si el proceso muere, lo vuelve a arrancar y reenvía las peticiones que estaban en vuelo. El
+    proceso avisa de qué petición está traduciendo, así solo esa cuenta como culpable y se
+    descarta tras max_attempts caídas; las demás se reenvían sin más.
+
+translator(direccion) devuelve un objeto con .translate(texto), igual que los traductores de
+Argos, para que translate_es_to_en / translate_en_to_es no cambien.
+"""
+
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+DEFAULT_PAIRS = (("es", "en"), ("en", "es"))
+
+
+def _worker_main(requests, results, pairs, batch_max, manifest_path):
+    """
+    Bucle del proceso de traducción. results es el extremo de escritura de un Pipe: send() es
+    síncrono, así que el aviso ("working", id) llega aunque el proceso muera justo después.
+    """
+    try:
+        from translation_models import load_translators
+
+        # Con manifiesto, carga directamente los paquetes que resolvió el proceso principal
+        translators, _ = load_translators(pairs, manifest_path)
+    except Exception as e:
+        results.send(("failed", repr(e)))
+        return
+    results.send(("ready", os.getpid()))
+
+    stop = False
+    while not stop:
+        item = requests.get()
+        if item is None:
+            break
+        batch = [item]
+        while len(batch) < batch_max:
+            try:
+                item = requests.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                stop = True
+                break
+            batch.append(item)
+        out = []
+        for req_id, direction, text in batch:
+            results.send(("working", req_id))
+            try:
+                out.append((req_id, translators[direction].translate(text), None))
+            except Exception as e:
+                out.append((req_id, None, repr(e)))
+        results.send(("batch", out))
+
+
+class _RemoteTranslator:
+    def __init__(self, service, direction):
+        self.service = service
+        self.direction = direction
+
+    def translate(self, text: str) -> str:
+        return self.service.translate(self.direction, text)
+
+
+class TranslationService:
+    def __init__(self, pairs=DEFAULT_PAIRS, batch_max: int = 16, start_timeout: float = 120.0,
+                 max_restarts: int = 5, max_attempts: int = 2, manifest_path: str = None):
+        self.pairs = tuple(tuple(p) for p in pairs)
+        self.manifest_path = manifest_path
+        self.batch_max = batch_max
+        self.start_timeout = start_timeout
+        self.max_restarts = max_restarts
+        self.max_attempts = max_attempts
+        self._ctx = multiprocessing.get_context("spawn")
+        self._ids = itertools.count()
+        self._pending = {}  # id -> [future, direction, text, intentos, enviado_en]
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._failure = None
+        self._closing = False
+        self._process = None
+        self._requests = None
+        self._results = None
+        self._current = None
+        self._reader = None
+        self.counters = {"requests": 0, "batches": 0, "restarts": 0, "errors": 0}
+        self._latency_s = 0.0
+
+    # -------------------- Proceso --------------------
+    def start(self):
+        """Arranca el proceso y espera a que tenga los modelos cargados."""
+        self._spawn()
+        self._reader = threading.Thread(target=self._read_results, name="traducción", daemon=True)
+        self._reader.start()
+        if not self._ready.wait(self.start_timeout):
+            self.close()
+            raise RuntimeError("El proceso de traducción no arrancó a tiempo")
+        if self._failure:
+            self.close()
+            raise RuntimeError(f"El proceso de traducción no pudo cargar los modelos: {self._failure}")
+        return self
+
+    def _spawn(self):
+        # Colas nuevas en cada arranque: si el proceso murió con una cola a medias, queda inservible
+        self._requests = self._ctx.Queue()
+        self._results, child_end = self._ctx.Pipe(duplex=False)
+        self._ready.clear()
+        self._current = None
+        self._process = self._ctx.Process(
+            target=_worker_main, args=(self._requests, child_end, self.pairs, self.batch_max, self.manifest_path),
+            name="bertraco-traduccion", daemon=True,
+        )
+        self._process.start()
+        # Cerrar aquí el extremo del hijo para que recv() dé EOFError si el proceso muere
+        child_end.close()
+
+    def _restart(self):
+        if self.counters["restarts"] >= self.max_restarts:
+            self._fail_all(RuntimeError("El proceso de traducción se ha caído demasiadas veces"))
+            self._closing = True
+            return
+        self.counters["restarts"] += 1
+        print(f"El proceso de traducción terminó (código {self._process.exitcode}); reiniciando")
+        with self._lock:
+            culprit = self._current
+            self._results.close()
+            self._spawn()
+            for req_id, entry in list(self._pending.items()):
+                future, direction, text, attempts, _ = entry
+                if req_id == culprit:
+                    if attempts >= self.max_attempts:
+                        del self._pending[req_id]
+                        future.set_exception(RuntimeError("La traducción hizo caer el proceso de traducción"))
+                        continue
+                    entry[3] += 1
+                self._requests.put((req_id, direction, text))
+
+    def _read_results(self):
+        while not self._closing:
+            try:
+                if not self._results.poll(0.5):
+                    if not self._closing and not self._process.is_alive():
+                        self._restart()
+                    continue
+                kind, payload = self._results.recv()
+            except (EOFError, OSError):
+                if not self._closing:
+                    self._process.join(timeout=1)
+                    self._restart()
+                continue
+            if kind == "working":
+                self._current = payload
+            elif kind == "ready":
+                self._ready.set()
+            elif kind == "failed":
+                self._failure = payload
+                self._fail_all(RuntimeError(f"Traductores no disponibles: {payload}"))
+                self._ready.set()
+                return
+            elif kind == "batch":
+                self._deliver(payload)
+
+    def _deliver(self, batch):
+        now = time.perf_counter()
+        with self._lock:
+            self.counters["batches"] += 1
+            for req_id, result, error in batch:
+                entry = self._pending.pop(req_id, None)
+                if entry is None:
+                    continue
+                self._latency_s += now - entry[4]
+                if error is not None:
+                    self.counters["errors"] += 1
+                    entry[0].set_exception(RuntimeError(error))
+                else:
+                    entry[0].set_result(result)
+
+    def _fail_all(self, exc):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for entry in pending.values():
+            entry[0].set_exception(exc)
+
+    # -------------------- API --------------------
+    def submit(self, direction: str, text: str) -> Future:
+        """Encola una traducción ("es->en", "en->es"...) y devuelve su Future."""
+        future = Future()
+        if self._closing or self._failure:
+            future.set_exception(RuntimeError("El servicio de traducción no está disponible"))
+            return future
+        with self._lock:
+            req_id = next(self._ids)
+            self._pending[req_id] = [future, direction, text, 1, time.perf_counter()]
+            self.counters["requests"] += 1
+            self._requests.put((req_id, direction, text))
+        return future
+
+    def translate(self, direction: str, text: str, timeout: float = None) -> str:
+        return self.submit(direction, text).result(timeout=timeout)
+
+    def translator(self, direction: str) -> _RemoteTranslator:
+        return _RemoteTranslator(self, direction)
+
+    def close(self):
+        self._closing = True
+        if self._process is None:
+            return
+        try:
+            self._requests.put(None)
+        except (OSError, ValueError):
+            pass
+        self._process.join(timeout=2)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._results.close()
+        self._fail_all(RuntimeError("El servicio de traducción se ha cerrado"))
+
+    def stats(self) -> dict:
+        with self._lock:
+            done = self.counters["requests"] - len(self._pending)
+            return dict(
+                self.counters,
+                in_flight=len(self._pending),
+                mean_batch=done / self.counters["batches"] if self.counters["batches"] else 0.0,
+                mean_latency_s=self._latency_s / done if done else 0.0,
+                pid=self._process.pid if self._process else None,
+            )
@@ -0,0 +1,230 @@
+"""
+turn_metrics.py
+
+Métricas por turno, para ver si algo empeora al cambiar de modelo o de máquina.
+
+Hasta ahora solo había prints sueltos ("Error en el chat_loop", "Traduciendo de..."). ChatPipeline
+rellena un registro por turno y TurnMetrics:
+  - lo añade como una línea JSON a un fichero (JSONL), con la cadena, el modelo y la hora, para
+    comparar ejecuciones con cualquier herramienta (pandas, jq...);
+  - acumula contadores e histogramas y los da en el formato de texto de Prometheus
+    (prometheus_text()), que sirve MetricsServer en /metrics o el propio bertraco_server.py.
+
+Campos del registro (los que no aplican a la cadena o al turno no aparecen):
+  input_wait_s       tiempo del mensaje en la cola antes de empezar el turno
+  llm_wait_s         espera por un hueco del LLM (FairScheduler, solo en el servidor)
+  ttft_s             desde la petición hasta el primer fragmento (sin llm_wait_s)
+  generation_s       desde la petición hasta el último fragmento (sin llm_wait_s)
+  tokens, tokens_per_s   fragmentos del stream (Ollama manda un token por fragmento) y su ritmo
+                     tras el primero
+  translate_in_s, translate_out_s   tiempo de traducción en cada dirección (la de salida, sumada
+                     sobre todas las frases)
+  synthesis_s, audio_s, synthesis_rtf   tiempo de síntesis, audio generado y su cociente (real-time
+                     factor: por debajo de 1 la voz se genera más rápido de lo que suena)
+  underruns          veces que el audio se quedó sin datos durante el turno
+  gui_flush_lag_ms   retraso medio desde el fragmento hasta la pantalla (solo la ventana)
+  first_output_s, turn_s   primera palabra y turno completo
+  outcome            completed / cancelled / error (con error)
+  cached             la respuesta salió de la caché
+
+current_metrics es un ContextVar con el registro del turno en curso, para que partes que no
+conocen el pipeline (el planificador del LLM) apunten lo suyo.
+"""
+
+import contextvars
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+current_metrics = contextvars.ContextVar("bertraco_turn_metrics", default=None)
+
+METRICAS_RUTA = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "metricas_turnos.jsonl")
+
+# Nombre del campo -> límites superiores de los buckets del histograma
+_SECONDS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+HISTOGRAMS = {
+    "input_wait_s": _SECONDS,
+    "llm_wait_s": _SECONDS,
+    "ttft_s": _SECONDS,
+    "generation_s": _SECONDS,
+    "tokens_per_s": (1, 5, 10, 20, 40, 80, 160),
+    "translate_in_s": _SECONDS,
+    "translate_out_s": _SECONDS,
+    "synthesis_rtf": (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0),
+    "gui_flush_lag_ms": (5, 10, 20, 50, 100, 250, 1000),
+    "first_output_s": _SECONDS,
+    "turn_s": _SECONDS,
+}
+# Campos que se suman en contadores
+COUNTERS = ("tokens", "underruns", "audio_s", "synthesis_s")
+
+_PREFIX = "bertraco_"
+_ESCAPES = str.maketrans({"\\": "\\\\", '"': '\\"', "\n": "\\n"})
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v).translate(_ESCAPES)}"' for k, v in labels.items()) + "}"
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class TurnMetrics:
+    def __init__(self, path: str = None, labels: dict = None, max_bytes: int = 10 * 1024 * 1024):
+        self.path = path
+        self.labels = dict(labels or {})
+        self.max_bytes = max_bytes
+        self.outcomes = {}
+        self.counters = {name: 0.0 for name in COUNTERS}
+        self.histograms = {name: _Histogram(buckets) for name, buckets in HISTOGRAMS.items()}
+        self.write_errors = 0
+        self._file = None
+        self._lock = threading.Lock()
+
+    def record(self, record: dict):
+        """Guarda el registro de un turno (una línea JSONL) y lo suma a los agregados."""
+        record = dict(self.labels, ts=round(time.time(), 3),
+                      **{k: round(v, 4) if isinstance(v, float) else v for k, v in record.items()})
+        with self._lock:
+            outcome = record.get("outcome", "completed")
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+            for name in COUNTERS:
+                if record.get(name) is not None:
+                    self.counters[name] += record[name]
+            for name, histogram in self.histograms.items():
+                if record.get(name) is not None:
+                    histogram.observe(record[name])
+            if self.path:
+                self._write(record)
+
+    def _write(self, record):
+        # Se llama con self._lock adquirido
+        try:
+            if self._file is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+            if self.max_bytes and self._file.tell() > self.max_bytes:
+                # Se conserva solo el fichero anterior
+                self._file.close()
+                self._file = None
+                os.replace(self.path, f"{self.path}.1")
+        except OSError as e:
+            self.write_errors += 1
+            if self.write_errors == 1:
+                print(f"No se pudieron guardar las métricas en {self.path}: {e}")
+
+    def prometheus_text(self, gauges: dict = None) -> str:
+        """Agregados en el formato de texto de Prometheus; gauges añade valores sueltos del momento."""
+        labels = _labels(self.labels)
+        lines = [f"# TYPE {_PREFIX}turns_total counter"]
+        with self._lock:
+            for outcome, count in sorted(self.outcomes.items()):
+                lines.append(f"{_PREFIX}turns_total{_labels(dict(self.labels, outcome=outcome))} {count}")
+            for name, value in self.counters.items():
+                metric = f"{_PREFIX}{name}_total"
+                lines += [f"# TYPE {metric} counter", f"{metric}{labels} {value:g}"]
+            for name, histogram in self.histograms.items():
+                metric = f"{_PREFIX}{name}"
+                lines.append(f"# TYPE {metric} histogram")
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append(f"{metric}_bucket{_labels(dict(self.labels, le=f'{bound:g}'))} {count}")
+                lines.append(f"{metric}_bucket{_labels(dict(self.labels, le='+Inf'))} {histogram.count}")
+                lines.append(f"{metric}_sum{labels} {histogram.total:g}")
+                lines.append(f"{metric}_count{labels} {histogram.count}")
+        for name, value in (gauges or {}).items():
+            if isinstance(value, (int, float)):
+                metric = f"{_PREFIX}{name}"
+                lines += [f"# TYPE {metric} gauge", f"{metric}{labels} {value:g}"]
+        return "\n".join(lines) + "\n"
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "turns": dict(self.outcomes),
+                "path": self.path,
+                "write_errors": self.write_errors,
+                "mean": {name: h.total / h.count for name, h in self.histograms.items() if h.count},
+            }
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def metrics_from_env(pipeline: str, llm=None):
+    """
+    TurnMetrics según BERTRACO_METRICS: por defecto en METRICAS_RUTA, "0" para no guardar nada y
+    cualquier otro valor es la ruta del JSONL. None si está desactivado.
+    """
+    setting = os.environ.get("BERTRACO_METRICS", "1")
+    if setting == "0":
+        return None
+    labels = {"pipeline": pipeline, "model": getattr(llm, "model", None) or "desconocido"}
+    return TurnMetrics(METRICAS_RUTA if setting == "1" else setting, labels=labels)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.metrics.prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer:
+    """GET /metrics con prometheus_text(), en un hilo aparte. Solo escucha en local por defecto."""
+
+    def __init__(self, metrics: TurnMetrics, port: int, host: str = "127.0.0.1"):
+        self.httpd = ThreadingHTTPServer((host, port), _MetricsHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.metrics = metrics
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name="metricas", daemon=True).start()
+        host, port = self.httpd.server_address[:2]
+        print(f"Métricas en http://{host}:{port}/metrics")
+        return self
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def start_metrics_server(metrics: TurnMetrics):
+    """Arranca MetricsServer si BERTRACO_METRICS_PORT está definido (y hay métricas)."""
+    port = int(os.environ.get("BERTRACO_METRICS_PORT", "0"))
+    if not metrics or not port:
+        return None
+    try:
+        return MetricsServer(metrics, port).start()
+    except OSError as e:
+        print(f"No se pudo abrir el puerto de métricas {port}: {e}")
+        return None